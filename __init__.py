@@ -2,12 +2,31 @@
 # This code is licensed under MIT license (see LICENSE for details)
 
 import bpy
+import contextlib
 import os
 import math
 import numpy
-import threading
 import shutil
+import tempfile
 import time
+import json
+
+from . import archive
+from . import atlas
+from . import border
+from . import cache
+from . import dedupe
+from . import delta
+from . import encoding
+from . import pixelart
+from . import pipeline
+from . import profiling
+from . import sampling
+from . import jobs
+from . import journal
+from . import mirror
+from . import palette
+from . import workers
 
 {
     "name": "Sprite Frame Generator",
@@ -24,10 +43,22 @@ import time
 ################
 
 # The global function to reuse for applying render settings.
+# Returns the previous values of the settings a render changes only for itself, for restore_render_settings.
 def apply_render_settings(context):
+    config = context.scene.sprite_frame_generator_config
+    previous = {}
+
     # set render resolution
-    bpy.context.scene.render.resolution_x = context.scene.sprite_frame_generator_config.render_resolution[0]
-    bpy.context.scene.render.resolution_y = context.scene.sprite_frame_generator_config.render_resolution[1]
+    bpy.context.scene.render.resolution_x = config.render_resolution[0]
+    bpy.context.scene.render.resolution_y = config.render_resolution[1]
+
+    if config.composite_engine == 'NATIVE':
+        # render one pixel per pixel art block, the samples of a pixel are no longer averaged with its neighbours
+        size = pixelart.block_size(config.composite_pixel_size)
+        bpy.context.scene.render.resolution_x = -(-config.render_resolution[0] // size)
+        bpy.context.scene.render.resolution_y = -(-config.render_resolution[1] // size)
+        previous["filter_size"] = bpy.context.scene.render.filter_size
+        bpy.context.scene.render.filter_size = 1.0
 
     # set render frames per second
     bpy.context.scene.render.fps = context.scene.sprite_frame_generator_config.render_fps
@@ -37,6 +68,12 @@ def apply_render_settings(context):
 
     camera = bpy.context.scene.camera
     reset_camera_rotation(camera)
+    return previous
+
+# Puts back the settings apply_render_settings changed only for the render.
+def restore_render_settings(previous):
+    if "filter_size" in previous:
+        bpy.context.scene.render.filter_size = previous["filter_size"]
 
 def rotate_camera_around_z_axis(camera, angle):
     rotation_matrix = numpy.array([[math.cos(angle), -math.sin(angle), 0],
@@ -56,10 +93,1657 @@ def rotate_light_around_z_axis(light, angle):
                                    [0, 0, 1]])
     light.location = numpy.dot(light.location, rotation_matrix)
 
+# Returns the armatures of objects, or of every object, making sure they have animation data.
+def find_animatable_objects(objects=None):
+    animatable_objects = []
+    for obj in (bpy.data.objects if objects is None else objects):
+        # obj type must be ARMATURE
+        if obj.type != 'ARMATURE':
+            continue
+
+        # obj must have animation data, otherwise create one
+        if not obj.animation_data:
+            obj.animation_data_create()
+
+        # add to animatable objects
+        if obj.animation_data:
+            animatable_objects.append(obj)
+    return animatable_objects
+
+# Returns the objects of a character of a batch job, see jobs.character_jobs: everything in its collection,
+# or its armature and the objects parented to it.
+def character_objects(character):
+    if character["collection"] is not None:
+        if character["collection"] not in bpy.data.collections:
+            raise RuntimeError("Collection " + character["collection"] + " of character " + character["name"] + " not found.")
+        return set(bpy.data.collections[character["collection"]].all_objects)
+    if character["armature"] not in bpy.data.objects:
+        raise RuntimeError("Armature " + character["armature"] + " of character " + character["name"] + " not found.")
+    armature = bpy.data.objects[character["armature"]]
+    return {armature} | set(armature.children_recursive)
+
+# Hides the objects of every other character from the render and frames the camera for the character.
+# Objects no character lists, such as the environment, stay as they are and keep their render data.
+# Returns what hide_character needs to undo it.
+def show_character(characters, index, camera):
+    character = characters[index]
+    own = character_objects(character)
+    others = set()
+    for i, other in enumerate(characters):
+        if i != index:
+            others |= character_objects(other)
+    others -= own
+    hidden = {obj: obj.hide_render for obj in others}
+    for obj in others:
+        obj.hide_render = True
+
+    previous_camera = (camera.location.copy(), getattr(camera.data, "lens", None), getattr(camera.data, "ortho_scale", None))
+    if character["camera_location"] is not None:
+        camera.location = character["camera_location"]
+        reset_camera_rotation(camera)
+    if character["camera_lens"] is not None:
+        camera.data.lens = character["camera_lens"]
+    if character["camera_ortho_scale"] is not None:
+        camera.data.ortho_scale = character["camera_ortho_scale"]
+    return hidden, camera, previous_camera
+
+def hide_character(shown):
+    hidden, camera, (location, lens, ortho_scale) = shown
+    for obj, hide_render in hidden.items():
+        obj.hide_render = hide_render
+    camera.location = location
+    reset_camera_rotation(camera)
+    if lens is not None:
+        camera.data.lens = lens
+    if ortho_scale is not None:
+        camera.data.ortho_scale = ortho_scale
+
+def action_frame_range(action, config):
+    return int(action.frame_range[0]) + config.animation_start_frame, int(action.frame_range[1])
+
+def direction_folder(output_path, action_name, direction):
+    return os.path.join(output_path, action_name, "direction_"+str(direction))
+
+# Direction j is seen after j + 1 rotations of the camera around the z axis.
+def direction_angle(config, direction):
+    return 2*math.pi/config.render_directions * (direction + 1)
+
+def assign_action(animatable_objects, action):
+    for obj in animatable_objects:
+        # assign the action to the object
+        obj.animation_data.action = action
+
+# Maps every frame to render to the frame whose image it uses, which is itself unless the frame is held.
+def plan_frames(scene, frame_start, frame_end, animatable_objects, camera):
+    config = scene.sprite_frame_generator_config
+    frame_numbers = list(range(frame_start, frame_end + 1, scene.frame_step))
+    if config.animation_sampling == 'ADAPTIVE':
+        return sample_frames(scene, frame_numbers, animatable_objects)
+    if config.animation_skip_held_frames:
+        return find_held_frames(scene, frame_numbers, animatable_objects, camera)
+    return {frame: frame for frame in frame_numbers}
+
+# Starts a render, marking its first frame in the profile, see profile_render_post.
+def render_call(**args):
+    global first_frame_pending
+    first_frame_pending = True
+    try:
+        bpy.ops.render.render(**args)
+    finally:
+        first_frame_pending = False
+
+# Renders the planned frames to scene.render.filepath, skipping held frames.
+def render_planned_frames(scene, originals, frame_start, frame_end):
+    for run_start, run_end in dedupe.frame_runs(sorted(set(originals.values())), scene.frame_step):
+        scene.frame_start = run_start
+        scene.frame_end = run_end
+        render_call(animation=True)
+    scene.frame_start = frame_start
+    scene.frame_end = frame_end
+
+# Lists the frames of a direction rendered to scene.render.filepath.
+def frame_records(scene, output_path, action_name, direction, originals):
+    frames = []
+    for frame in sorted(originals):
+        record = {"action": action_name, "direction": direction, "frame": frame,
+                  "path": os.path.relpath(scene.render.frame_path(frame=originals[frame]), output_path)}
+        if originals[frame] != frame:
+            record["duplicate_of"] = originals[frame]
+        frames.append(record)
+    return frames
+
+# Runs the post render stages on the rendered frames of a direction.
+def finish_frames(output_path, frames, config):
+    if config.composite_engine in {'NUMPY', 'NATIVE'}:
+        pixelate_frames(output_path, [frame for frame in frames if "duplicate_of" not in frame], config)
+    if config.output_deduplicate:
+        deduplicate_frames(output_path, frames)
+
+# Adds the paths of the pass images to the frame records and gives the pass images of the frames rendered now
+# the size and blocks of their color frames. Frames in skip were finished by an earlier render.
+def finish_pass_frames(output_path, frames, config, skip=()):
+    names = output_passes(config)
+    if not names:
+        return
+    for frame in frames:
+        frame["passes"] = {name: pass_path(frame["path"], name) for name in names}
+        if "duplicate_of" in frame:
+            # passes of a frame that turned out to repeat another one are not needed
+            for name in names:
+                own_path = os.path.join(output_path, os.path.dirname(frame["path"]), name, "frame_%04d.png" % frame["frame"])
+                if os.path.exists(own_path):
+                    os.remove(own_path)
+            continue
+        if frame["frame"] in skip or config.composite_engine not in {'NUMPY', 'NATIVE'}:
+            continue
+        for name in names:
+            path = os.path.join(output_path, frame["passes"][name])
+            if config.composite_engine == 'NATIVE':
+                pixels = pixelart.upscale(load_image_pixels(path), output_scale(config))
+            else:
+                pixels = pixelart.pixelate_pass(load_image_pixels(path), config.composite_pixel_size)
+            save_image_pixels(path, pixels)
+
+# Renders one direction of an action and returns a record for every written frame.
+# The camera and light are placed relative to their origin locations, so directions can be rendered in any order.
+# With a journal_key, finished frames are journaled, and with Resume on, intact journaled frames are not rendered again.
+# A border_rect from action_render_borders is used as it is instead of computing the border of the direction,
+# and planned originals, see plan_frames, instead of planning the frames.
+def render_direction(scene, action, direction, frame_start, frame_end, output_path,
+                     animatable_objects, camera, light, camera_origin, light_origin, trim_stage=None, journal_key=None,
+                     border_rect=None, originals=None):
+    config = scene.sprite_frame_generator_config
+
+    # create the folder for the angle and action if it doesn't exist
+    angle_folder = direction_folder(output_path, action.name, direction)
+    if not os.path.exists(angle_folder):
+        os.makedirs(angle_folder)
+
+    set_profile_context(action=action.name, direction=direction)
+    with profile_stage("assign_action"):
+        assign_action(animatable_objects, action)
+    rect = border_rect
+    if rect is None:
+        with profile_stage("border"):
+            rect = auto_render_border(scene, frame_start, frame_end, [direction], animatable_objects, camera, camera_origin)
+
+    # make camera and light rotate around the z axis at the center of the world
+    with profile_stage("camera"):
+        angle = direction_angle(config, direction)
+        camera.location = camera_origin
+        rotate_camera_around_z_axis(camera, angle)
+        light.location = light_origin
+        rotate_light_around_z_axis(light, angle)
+
+    # set output file path
+    scene.render.filepath = os.path.join(angle_folder, "frame_####")
+
+    previous_border = apply_render_border(scene, rect)
+    passes = attach_pass_outputs(scene, angle_folder, camera)
+    try:
+        if originals is None:
+            with profile_stage("plan"):
+                originals = plan_frames(scene, frame_start, frame_end, animatable_objects, camera)
+        done = resumable_frames(config, journal_key, action.name, direction)
+        if config.render_in_memory:
+            frames = render_frames_in_memory(scene, output_path, action.name, direction, originals, trim_stage,
+                                             done, journal_key)
+        else:
+            pending = {frame: original for frame, original in originals.items() if original not in done}
+            # frames are journaled as blender writes them, unless post render stages still change them
+            post_stages = config.composite_engine in {'NUMPY', 'NATIVE'} or config.output_deduplicate
+            set_journal_context(None if post_stages else (journal_key, action.name, direction, output_path))
+            try:
+                render_planned_frames(scene, pending, frame_start, frame_end)
+            finally:
+                set_journal_context(None)
+            frames = frame_records(scene, output_path, action.name, direction, pending)
+            with profile_stage("post"):
+                finish_frames(output_path, frames, config)
+            if post_stages:
+                journal_frames(journal_key, frames, pending)
+            frames = sorted(frames + resumed_records(done, originals), key=lambda frame: frame["frame"])
+    finally:
+        detach_pass_outputs(scene, passes)
+        restore_render_border(scene, previous_border)
+
+    with profile_stage("passes"):
+        finish_pass_frames(output_path, frames, config, done)
+    add_border_metadata(scene, frames, rect)
+    add_frame_durations(scene, frames)
+    return frames
+
+# Returns the render size in pixels.
+def render_size(scene):
+    render = scene.render
+    return (render.resolution_x * render.resolution_percentage // 100,
+            render.resolution_y * render.resolution_percentage // 100)
+
+# Returns the visible meshes the animatable objects move or deform: their children,
+# and meshes with an Armature modifier using one of them.
+def deformed_meshes(scene, animatable_objects):
+    animatable = set(animatable_objects)
+    meshes = []
+    for obj in scene.objects:
+        if obj.type != 'MESH' or obj.hide_render:
+            continue
+        parent = obj.parent
+        while parent is not None and parent not in animatable:
+            parent = parent.parent
+        if parent is not None or any(modifier.type == 'ARMATURE' and modifier.object in animatable for modifier in obj.modifiers):
+            meshes.append(obj)
+    return meshes
+
+# Returns the world space corners of the evaluated bounding boxes of the meshes.
+def mesh_bounds_corners(meshes, depsgraph):
+    corners = []
+    for obj in meshes:
+        evaluated = obj.evaluated_get(depsgraph)
+        corners.append(border.box_corners(evaluated.bound_box, evaluated.matrix_world))
+    if not corners:
+        return numpy.empty((0, 3))
+    return numpy.concatenate(corners)
+
+# Returns the corners of the deformed meshes over the frames, the points every direction's border is projected from.
+def border_points(scene, frame_numbers, animatable_objects):
+    meshes = deformed_meshes(scene, animatable_objects)
+    current_frame = scene.frame_current
+    points = [numpy.empty((0, 3))]
+    try:
+        for frame in frame_numbers:
+            scene.frame_set(frame)
+            points.append(mesh_bounds_corners(meshes, bpy.context.evaluated_depsgraph_get()))
+    finally:
+        scene.frame_set(current_frame)
+    return numpy.concatenate(points)
+
+# Returns the pixel rect the points cover as seen from a direction, see border.py. The camera is left at the direction.
+def project_render_border(scene, points, direction, camera, camera_origin):
+    config = scene.sprite_frame_generator_config
+    render = scene.render
+    width, height = render_size(scene)
+    if len(points) == 0:
+        return (0, 0, width, height)
+
+    # keep numpy pixel art blocks on the grid of the full frame
+    align = 1
+    if config.composite_engine == 'NUMPY':
+        align = pixelart.block_size(config.composite_pixel_size)
+
+    camera.location = camera_origin
+    rotate_camera_around_z_axis(camera, direction_angle(config, direction))
+    bpy.context.view_layer.update()
+    projection = camera.calc_matrix_camera(bpy.context.evaluated_depsgraph_get(), x=width, y=height,
+                                           scale_x=render.pixel_aspect_x, scale_y=render.pixel_aspect_y)
+    screen_points = border.project_points(points, camera.matrix_world.inverted(), projection)
+    if screen_points is None:
+        # the camera is inside the bounds, render everything
+        return (0, 0, width, height)
+    return border.border_rect(screen_points, width, height, config.render_border_padding, align)
+
+# Returns the pixel rect the meshes cover over the frames as seen from all the directions.
+# The camera is left at the last direction.
+def compute_render_border(scene, frame_numbers, directions, animatable_objects, camera, camera_origin):
+    points = border_points(scene, frame_numbers, animatable_objects)
+    return border.union_rects(project_render_border(scene, points, direction, camera, camera_origin) for direction in directions)
+
+# Returns the border for rendering the directions, or None when automatic borders are off.
+def auto_render_border(scene, frame_start, frame_end, directions, animatable_objects, camera, camera_origin):
+    config = scene.sprite_frame_generator_config
+    if config.render_auto_border == 'OFF':
+        return None
+    if config.render_auto_border == 'ACTION':
+        directions = range(config.render_directions)
+    frame_numbers = range(frame_start, frame_end + 1, scene.frame_step)
+    return compute_render_border(scene, frame_numbers, directions, animatable_objects, camera, camera_origin)
+
+# Returns {direction: border} of the directions of an action, or None when automatic borders are off.
+# The mesh corners are collected once for the action and projected for every direction, Per Action borders are
+# the union of all of them. Computed once and handed to every direction or work unit rendering the action.
+def action_render_borders(scene, action, frame_start, frame_end, directions, animatable_objects, camera, camera_origin):
+    config = scene.sprite_frame_generator_config
+    if config.render_auto_border == 'OFF' or not directions:
+        return None
+    assign_action(animatable_objects, action)
+    try:
+        points = border_points(scene, range(frame_start, frame_end + 1, scene.frame_step), animatable_objects)
+        if config.render_auto_border == 'ACTION':
+            rect = border.union_rects(project_render_border(scene, points, direction, camera, camera_origin)
+                                      for direction in range(config.render_directions))
+            return {direction: rect for direction in directions}
+        return {direction: project_render_border(scene, points, direction, camera, camera_origin) for direction in directions}
+    finally:
+        camera.location = camera_origin
+        reset_camera_rotation(camera)
+
+# Returns the border of a render of several directions, the union of their borders, or None.
+def directions_border(borders, directions):
+    if borders is None:
+        return None
+    return border.union_rects(borders[direction] for direction in directions)
+
+# Renders only the pixel rect, cropped. Returns the previous border settings for restore_render_border.
+def apply_render_border(scene, rect):
+    if rect is None:
+        return None
+    render = scene.render
+    previous = (render.use_border, render.use_crop_to_border,
+                render.border_min_x, render.border_max_x, render.border_min_y, render.border_max_y)
+    width, height = render_size(scene)
+    render.border_min_x, render.border_max_x, render.border_min_y, render.border_max_y = border.render_border(rect, width, height)
+    render.use_border = True
+    render.use_crop_to_border = True
+    return previous
+
+def restore_render_border(scene, previous):
+    if previous is None:
+        return
+    render = scene.render
+    (render.use_border, render.use_crop_to_border,
+     render.border_min_x, render.border_max_x, render.border_min_y, render.border_max_y) = previous
+
+# Records where the cropped frames sit in the full frame, so sprite anchors do not move with the border.
+def add_border_metadata(scene, frames, rect):
+    if rect is None:
+        return
+    scale = output_scale(scene.sprite_frame_generator_config)
+    for frame in frames:
+        frame["offset"] = [rect[0] * scale, rect[1] * scale]
+        frame["canvas_size"] = [size * scale for size in render_size(scene)]
+
+# Name of the viewer node the in memory render loop reads pixels from.
+VIEWER_NODE_NAME = "Sprite Frame Generator Viewer"
+
+# Returns why the scene's color management cannot be reproduced by the in memory render loop, or None.
+def in_memory_color_management_error(scene):
+    view_settings = scene.view_settings
+    if scene.display_settings.display_device != 'sRGB':
+        return "Rendering in memory needs the sRGB display device."
+    if view_settings.view_transform != 'Standard' or view_settings.look != 'None' or view_settings.use_curve_mapping:
+        return "Rendering in memory needs the Standard view transform without look or curves."
+    return None
+
+# Blender image formats that store scene linear values instead of display colors.
+LINEAR_FILE_FORMATS = {'OPEN_EXR', 'OPEN_EXR_MULTILAYER', 'HDR'}
+
+# Returns the Blender image format of the frame files written by the scene's output settings.
+def blender_file_format(config):
+    # the config is a property of the scene
+    return config.id_data.render.image_settings.file_format
+
+# Returns why the output format or passes cannot be written with the current settings, or None.
+def output_format_error(config):
+    if output_passes(config) and config.render_use_multiview:
+        return "Passes need directions rendered one at a time, not as views."
+    if config.output_format == 'BLENDER':
+        # these stages write display colors back in the scene's format
+        rewrites_frames = (config.composite_engine in {'NUMPY', 'NATIVE'} or config.render_mirror != 'OFF' or
+                           config.output_palette)
+        if rewrites_frames and blender_file_format(config) in LINEAR_FILE_FORMATS:
+            return "The NumPy pixel art engines, Mirror and Shared Palette need a file format with display colors, not OpenEXR or HDR."
+        return None
+    if not config.render_in_memory or config.render_use_multiview:
+        return "Output formats other than the scene's need Render in Memory without directions rendered as views."
+    try:
+        encoding.check_format(config.output_format)
+    except encoding.EncodingError as e:
+        return str(e)
+    return None
+
+# Adds a viewer node fed by the compositor output, so the rendered pixels can be read from python.
+# Returns the node and whether the compositor had to be turned on for it.
+def attach_viewer_node(scene):
+    enabled_nodes = not scene.use_nodes
+    scene.use_nodes = True
+    tree = scene.node_tree
+
+    composite_node = next((node for node in tree.nodes if node.type == 'COMPOSITE'), None)
+    if composite_node is not None and composite_node.inputs[0].is_linked:
+        source = composite_node.inputs[0].links[0].from_socket
+    else:
+        render_layers_node = next((node for node in tree.nodes if node.type == 'R_LAYERS'), None)
+        if render_layers_node is None:
+            render_layers_node = tree.nodes.new(type='CompositorNodeRLayers')
+        source = render_layers_node.outputs[0]
+
+    viewer_node = tree.nodes.new(type='CompositorNodeViewer')
+    viewer_node.name = VIEWER_NODE_NAME
+    tree.links.new(source, viewer_node.inputs[0])
+    # the active viewer node is the one written to the Viewer Node image
+    tree.nodes.active = viewer_node
+    return viewer_node, enabled_nodes
+
+def detach_viewer_node(scene, viewer_node, enabled_nodes):
+    scene.node_tree.nodes.remove(viewer_node)
+    if enabled_nodes:
+        scene.use_nodes = False
+
+# Name of the file output node writing the passes of the rendered frames.
+PASS_NODE_NAME = "Sprite Frame Generator Passes"
+
+# Names of the passes written next to the color frames, and the config properties turning them on.
+PASS_PROPERTIES = (("normal", "output_pass_normal"), ("depth", "output_pass_depth"),
+                   ("mask", "output_pass_mask"), ("index", "output_pass_index"))
+
+# View layer properties of the passes that need one, turned on for them.
+PASS_VIEW_LAYER_PROPERTIES = {"normal": "use_pass_normal", "depth": "use_pass_z", "index": "use_pass_object_index"}
+
+def output_passes(config):
+    return [name for name, prop in PASS_PROPERTIES if getattr(config, prop)]
+
+# Returns the path of a pass image of the frame file at path, in a folder named after the pass next to it.
+def pass_path(path, name):
+    return os.path.join(os.path.dirname(path), name, os.path.splitext(os.path.basename(path))[0] + ".png")
+
+# Turns on the view layer passes and adds a file output node writing them to the pass folders of angle_folder,
+# so every render writes its passes next to the color frame. Normals are in the space of the camera as placed now,
+# and depth maps config.output_depth_range meters around the world origin from white to black.
+# Returns what detach_pass_outputs needs to undo it, or None when no pass is written.
+def attach_pass_outputs(scene, angle_folder, camera):
+    config = scene.sprite_frame_generator_config
+    names = output_passes(config)
+    if not names:
+        return None
+
+    # already on for the whole job inside a render session, see start_render_session
+    view_layer = bpy.context.view_layer
+    previous_passes = {prop: getattr(view_layer, prop) for prop in PASS_VIEW_LAYER_PROPERTIES.values()}
+    for name in names:
+        if name in PASS_VIEW_LAYER_PROPERTIES:
+            setattr(view_layer, PASS_VIEW_LAYER_PROPERTIES[name], True)
+
+    enabled_nodes = not scene.use_nodes
+    scene.use_nodes = True
+    tree = scene.node_tree
+    nodes = []
+
+    def new_node(node_type):
+        node = tree.nodes.new(type=node_type)
+        nodes.append(node)
+        return node
+
+    render_layers_node = next((node for node in tree.nodes if node.type == 'R_LAYERS'), None)
+    if render_layers_node is None:
+        render_layers_node = new_node('CompositorNodeRLayers')
+    outputs = render_layers_node.outputs
+    alpha = outputs["Alpha"]
+    combine_type = 'CompositorNodeCombineColor' if hasattr(bpy.types, 'CompositorNodeCombineColor') else 'CompositorNodeCombRGBA'
+
+    # values in 0..1 with the alpha of the render
+    def combine(channels):
+        combine_node = new_node(combine_type)
+        for i, channel in enumerate(channels):
+            tree.links.new(channel, combine_node.inputs[i])
+        tree.links.new(alpha, combine_node.inputs[3])
+        return combine_node.outputs[0]
+
+    def math_node(operation, value, *constants):
+        node = new_node('CompositorNodeMath')
+        node.operation = operation
+        tree.links.new(value, node.inputs[0])
+        for i, constant in enumerate(constants):
+            node.inputs[i + 1].default_value = constant
+        return node.outputs[0]
+
+    sources = {}
+    if "normal" in names:
+        bpy.context.view_layer.update()
+        rotation = camera.matrix_world.to_3x3()
+        channels = []
+        for axis in range(3):
+            normal_node = new_node('CompositorNodeNormal')
+            # the Dot output is the negated dot product with the node's normal
+            normal_node.outputs[0].default_value = -rotation.col[axis]
+            tree.links.new(outputs["Normal"], normal_node.inputs[0])
+            channels.append(math_node('MULTIPLY_ADD', normal_node.outputs[1], 0.5, 0.5))
+        sources["normal"] = combine(channels)
+    if "depth" in names:
+        distance = camera.matrix_world.translation.length
+        map_node = new_node('CompositorNodeMapRange')
+        map_node.use_clamp = True
+        tree.links.new(outputs.get("Depth") or outputs["Z"], map_node.inputs[0])
+        map_node.inputs[1].default_value = distance - config.output_depth_range / 2
+        map_node.inputs[2].default_value = distance + config.output_depth_range / 2
+        map_node.inputs[3].default_value = 1.0
+        map_node.inputs[4].default_value = 0.0
+        sources["depth"] = combine([map_node.outputs[0]] * 3)
+    if "mask" in names:
+        sources["mask"] = alpha
+    if "index" in names:
+        # exact for pass indices up to 255
+        sources["index"] = math_node('DIVIDE', outputs["IndexOB"], 255.0)
+
+    output_node = new_node('CompositorNodeOutputFile')
+    output_node.name = PASS_NODE_NAME
+    output_node.base_path = angle_folder
+    output_node.format.file_format = 'PNG'
+    output_node.format.color_mode = 'RGBA'
+    output_node.format.color_depth = '8'
+    if hasattr(output_node.format, "color_management"):
+        # passes are data, they are written without the view transform
+        output_node.format.color_management = 'OVERRIDE'
+        output_node.format.view_settings.view_transform = 'Raw'
+    output_node.file_slots.clear()
+    for name in names:
+        output_node.file_slots.new(name)
+        output_node.file_slots[-1].path = name + "/frame_####"
+        tree.links.new(sources[name], output_node.inputs[-1])
+    return nodes, previous_passes, enabled_nodes
+
+def detach_pass_outputs(scene, attached):
+    if attached is None:
+        return
+    nodes, previous_passes, enabled_nodes = attached
+    for node in nodes:
+        scene.node_tree.nodes.remove(node)
+    view_layer = bpy.context.view_layer
+    for prop, value in previous_passes.items():
+        setattr(view_layer, prop, value)
+    if enabled_nodes:
+        scene.use_nodes = False
+
+# Copies the pixels of the viewer node into buffer, which is reallocated only when the render size changes.
+def read_viewer_pixels(buffer):
+    viewer = bpy.data.images['Viewer Node']
+    width, height = viewer.size
+    if buffer is None or buffer.size != width * height * 4:
+        buffer = numpy.empty(width * height * 4, dtype=numpy.float32)
+    viewer.pixels.foreach_get(buffer)
+    return buffer, width, height
+
+# Writes frames to their paths through one reused image datablock.
+class ImageWriter:
+    def __init__(self, output_path, file_format, on_written=None):
+        self.output_path = output_path
+        self.file_format = file_format
+        self.on_written = on_written
+        self.image = None
+
+    def __call__(self, record, pixels):
+        height, width = pixels.shape[:2]
+        if self.image is None or tuple(self.image.size) != (width, height):
+            self.close()
+            self.image = bpy.data.images.new("Sprite Frame Generator Writer", width, height, alpha=True)
+        self.image.pixels.foreach_set(numpy.ascontiguousarray(pixels[::-1], dtype=numpy.float32).ravel())
+        # write next to the target first, so a crash never leaves a half written frame
+        path = os.path.join(self.output_path, record["path"])
+        self.image.filepath_raw = path + ".tmp"
+        self.image.file_format = self.file_format
+        self.image.save()
+        os.replace(path + ".tmp", path)
+        if self.on_written is not None:
+            self.on_written(record)
+        return pixels
+
+    def close(self):
+        if self.image is not None:
+            bpy.data.images.remove(self.image)
+            self.image = None
+
+# Returns the path of a rendered frame, with the extension of the output format.
+def output_frame_path(scene, frame):
+    config = scene.sprite_frame_generator_config
+    path = scene.render.frame_path(frame=frame)
+    if config.output_format == 'BLENDER':
+        return path
+    return os.path.splitext(path)[0] + encoding.EXTENSIONS[config.output_format]
+
+# Returns the last stage of the in memory pipeline, writing frames in the output format.
+# on_written is called with the record of every frame once its file is complete.
+def frame_writer(scene, output_path, on_written=None):
+    config = scene.sprite_frame_generator_config
+    if config.output_format == 'BLENDER':
+        return ImageWriter(output_path, scene.render.image_settings.file_format, on_written)
+    # frames pixelated with numpy have few colors, so most fit in a palette PNG
+    writer = encoding.AsyncImageWriter(config.output_format, config.output_compression,
+                                       indexed=config.composite_engine in {'NUMPY', 'NATIVE'},
+                                       threads=config.output_encoder_threads,
+                                       max_pending=config.output_encoder_threads * 2)
+    return pipeline.EncodeStage(output_path, writer, on_written)
+
+# Renders the planned frames one at a time without writing them, and streams the pixels through the post render stages.
+# Only the final frames are written, nothing is read back from disk.
+# done holds the records of journaled frames that are not rendered again.
+def render_frames_in_memory(scene, output_path, action_name, direction, originals, trim_stage=None, done=None, journal_key=None):
+    config = scene.sprite_frame_generator_config
+    view_settings = scene.view_settings
+
+    def on_written(record):
+        journal_frames(journal_key, [record])
+
+    writer = frame_writer(scene, output_path, on_written if journal_key is not None else None)
+    stages = []
+    if config.composite_engine == 'NUMPY':
+        stages.append(pipeline.PixelateStage(config.composite_pixel_size, config.composite_color_palette_size))
+    elif config.composite_engine == 'NATIVE':
+        stages.append(pipeline.NativePixelateStage(config.composite_color_palette_size, output_scale(config)))
+    if config.output_deduplicate:
+        stages.append(pipeline.DeduplicateStage())
+    if trim_stage is not None:
+        stages.append(trim_stage)
+    stages.append(writer)
+    frame_pipeline = pipeline.FramePipeline(stages, active_profiler)
+
+    viewer_node, enabled_nodes = attach_viewer_node(scene)
+    current_frame = scene.frame_current
+    buffer = None
+    display = None
+    records = dict(done or {})
+    try:
+        for frame in sorted(set(originals.values()) - set(records)):
+            scene.frame_set(frame)
+            render_call(write_still=False)
+
+            with profile_stage("read", frame=frame):
+                buffer, width, height = read_viewer_pixels(buffer)
+                if display is None or display.shape != (height, width, 4):
+                    display = numpy.empty((height, width, 4), dtype=numpy.float32)
+                # blender stores rows from bottom to top
+                pixels = pipeline.render_to_display(buffer.reshape(height, width, 4)[::-1],
+                                                    view_settings.exposure, view_settings.gamma, out=display)
+
+            records[frame] = {"action": action_name, "direction": direction, "frame": frame,
+                              "path": os.path.relpath(output_frame_path(scene, frame), output_path)}
+            if frame_pipeline.process(records[frame], pixels) is None and "duplicate_of" in records[frame]:
+                # dropped as a copy of an earlier frame, there is no file of its own to wait for
+                journal_frames(journal_key, [records[frame]])
+    finally:
+        with profile_stage("write"):
+            writer.close()
+        detach_viewer_node(scene, viewer_node, enabled_nodes)
+        scene.frame_set(current_frame)
+
+    return resumed_records(records, originals)
+
+# Returns the records of the planned frames whose original frames have a record.
+# Held frames repeat the record of the frame they hold.
+def resumed_records(records, originals):
+    frames = []
+    for frame in sorted(originals):
+        if originals[frame] not in records:
+            continue
+        original = records[originals[frame]]
+        record = dict(original)
+        record["frame"] = frame
+        if originals[frame] != frame:
+            record["duplicate_of"] = original.get("duplicate_of", original["frame"])
+        frames.append(record)
+    return frames
+
+# Renders a work unit (see jobs.py) and returns its frame records.
+def render_unit(scene, unit, output_path, animatable_objects, camera, light, camera_origin, light_origin):
+    action = bpy.data.actions[unit["action"]]
+    directions = unit["directions"]
+    # json object keys are strings
+    journal_keys = {int(direction): key for direction, key in unit.get("journal_keys", {}).items()}
+    # the border of the whole action, when the coordinator computed it
+    border_rect = tuple(unit["border"]) if unit.get("border") is not None else None
+    # the frames of a split action are planned over the whole action, see jobs.unit_originals
+    originals = {int(frame): original for frame, original in unit["originals"].items()} if "originals" in unit else None
+    if len(directions) > 1:
+        frames_by_direction = render_directions_multiview(scene, action, directions, unit["frame_start"], unit["frame_end"],
+                                                          output_path, animatable_objects, camera, light, camera_origin, light_origin,
+                                                          journal_keys, border_rect, originals)
+        return [frame for direction in directions for frame in frames_by_direction[direction]]
+    return render_direction(scene, action, directions[0], unit["frame_start"], unit["frame_end"],
+                            output_path, animatable_objects, camera, light, camera_origin, light_origin,
+                            journal_key=journal_keys.get(directions[0]), border_rect=border_rect, originals=originals)
+
+# Suffix of the multi-view camera and image files of a direction.
+def multiview_suffix(direction):
+    return "_direction_" + str(direction)
+
+# Raises unless every view camera has the name blender looks it up by, the scene camera name with the view suffix.
+# A name that is taken gets a .001 suffix instead, and the view would render with the scene camera.
+def check_multiview_cameras(camera, view_cameras, directions):
+    for view_camera, direction in zip(view_cameras, directions):
+        if view_camera.name != camera.name + multiview_suffix(direction):
+            raise RuntimeError("Multi-view needs a camera named " + camera.name + multiview_suffix(direction) +
+                               ", but the name is taken. Rename or remove the object using it.")
+
+# Renders several directions of an action as views of one multi-view render, so the animation is evaluated once per frame.
+# Returns the frame records of every direction. All views share one light, so the light stays at its origin.
+# Directions are journaled once all their frames are moved and finished, and always rendered in full.
+def render_directions_multiview(scene, action, directions, frame_start, frame_end, output_path,
+                                animatable_objects, camera, light, camera_origin, light_origin, journal_keys=None,
+                                border_rect=None, originals=None):
+    config = scene.sprite_frame_generator_config
+    render = scene.render
+
+    set_profile_context(action=action.name, direction=directions)
+    with profile_stage("assign_action"):
+        assign_action(animatable_objects, action)
+    rect = border_rect
+    if rect is None:
+        with profile_stage("border"):
+            rect = auto_render_border(scene, frame_start, frame_end, directions, animatable_objects, camera, camera_origin)
+    camera.location = camera_origin
+    reset_camera_rotation(camera)
+    light.location = light_origin
+
+    staging_folder = os.path.join(output_path, action.name, ".multiview")
+    if not os.path.exists(staging_folder):
+        os.makedirs(staging_folder)
+
+    previous_settings = (render.use_multiview, render.views_format, render.image_settings.views_format, scene.camera)
+    previous_views = {view.name: view.use for view in render.views}
+    view_cameras = []
+    views = []
+    previous_border = apply_render_border(scene, rect)
+    try:
+        render.use_multiview = True
+        render.views_format = 'MULTIVIEW'
+        render.image_settings.views_format = 'INDIVIDUAL'
+        for view in render.views:
+            view.use = False
+
+        # one camera per direction, found by blender from the scene camera name and the view suffix
+        for direction in directions:
+            suffix = multiview_suffix(direction)
+            view_camera = camera.copy()
+            view_camera.name = camera.name + suffix
+            for collection in camera.users_collection:
+                collection.objects.link(view_camera)
+            view_camera.location = camera_origin
+            rotate_camera_around_z_axis(view_camera, direction_angle(config, direction))
+            view_cameras.append(view_camera)
+
+            view = render.views.new(suffix[1:])
+            view.camera_suffix = suffix
+            view.file_suffix = suffix
+            views.append(view)
+        check_multiview_cameras(camera, view_cameras, directions)
+        # blender strips the view suffix from the scene camera name and appends the suffix of every view,
+        # a scene camera without a suffix would be used for all views as it is
+        scene.camera = view_cameras[0]
+
+        render.filepath = os.path.join(staging_folder, "frame_####")
+        if originals is None:
+            with profile_stage("plan"):
+                originals = plan_frames(scene, frame_start, frame_end, animatable_objects, camera)
+        render_planned_frames(scene, originals, frame_start, frame_end)
+
+        # move the images of every view into its direction folder
+        for direction, view in zip(directions, views):
+            angle_folder = direction_folder(output_path, action.name, direction)
+            if not os.path.exists(angle_folder):
+                os.makedirs(angle_folder)
+            for frame in set(originals.values()):
+                file_name = os.path.basename(render.frame_path(frame=frame))
+                os.replace(render.frame_path(frame=frame, view=view.name), os.path.join(angle_folder, file_name))
+    finally:
+        for view in views:
+            render.views.remove(view)
+        for view_camera in view_cameras:
+            bpy.data.objects.remove(view_camera)
+        for view in render.views:
+            view.use = previous_views.get(view.name, view.use)
+        render.use_multiview, render.views_format, render.image_settings.views_format, scene.camera = previous_settings
+        restore_render_border(scene, previous_border)
+        shutil.rmtree(staging_folder, ignore_errors=True)
+
+    frames_by_direction = {}
+    for direction in directions:
+        render.filepath = os.path.join(direction_folder(output_path, action.name, direction), "frame_####")
+        frames_by_direction[direction] = frame_records(scene, output_path, action.name, direction, originals)
+        with profile_stage("post", direction=direction):
+            finish_frames(output_path, frames_by_direction[direction], config)
+        add_border_metadata(scene, frames_by_direction[direction], rect)
+        add_frame_durations(scene, frames_by_direction[direction])
+        journal_frames((journal_keys or {}).get(direction), frames_by_direction[direction], originals)
+    return frames_by_direction
+
+# The journal of the render running in this process, see journal.py.
+active_journal = None
+# (cache key, action name, direction, output path) of the frames blender writes itself, journaled by the render_write handler.
+journal_context = None
+
+def set_journal_context(context):
+    global journal_context
+    journal_context = context
+
+# Journals the records of frames that are completely written. With originals, held frames are left out,
+# they have no file of their own and are planned again on resume.
+def journal_frames(key, frames, originals=None):
+    if active_journal is None or key is None:
+        return
+    for frame in frames:
+        if originals is None or originals[frame["frame"]] == frame["frame"]:
+            active_journal.record(key, frame)
+
+# Returns {frame: record} of the intact journaled frames of a direction when resuming, otherwise nothing.
+def resumable_frames(config, key, action_name, direction):
+    if active_journal is None or key is None or not config.output_resume:
+        return {}
+    return active_journal.completed_frames(key, action_name, direction)
+
+def journal_render_write(scene, *args):
+    if active_journal is None or journal_context is None:
+        return
+    key, action_name, direction, output_path = journal_context
+    frame = scene.frame_current
+    active_journal.record(key, {"action": action_name, "direction": direction, "frame": frame,
+                                "path": os.path.relpath(scene.render.frame_path(frame=frame), output_path)})
+
+# Opens the journal of the output folder. Only the process that starts a render compacts it.
+def start_journal(output_path, compact=False):
+    global active_journal
+    active_journal = journal.Journal(output_path, compact)
+    if journal_render_write not in bpy.app.handlers.render_write:
+        bpy.app.handlers.render_write.append(journal_render_write)
+
+def stop_journal():
+    global active_journal
+    if journal_render_write in bpy.app.handlers.render_write:
+        bpy.app.handlers.render_write.remove(journal_render_write)
+    if active_journal is not None:
+        active_journal.close()
+    active_journal = None
+    set_journal_context(None)
+
+# The profiler and progress estimate of the render running in this process, see profiling.py.
+active_profiler = None
+active_progress = None
+# Whether the next rendered frame is the first of a render call.
+first_frame_pending = False
+
+# Times a stage of the running render.
+def profile_stage(name, **args):
+    if active_profiler is None:
+        return contextlib.nullcontext()
+    return active_profiler.stage(name, **args)
+
+# Tags the following stages with the action and direction being rendered.
+def set_profile_context(**context):
+    if active_profiler is not None:
+        active_profiler.set_context(**context)
+
+# Handlers timing what blender does on its own: evaluating frames, rendering, compositing and writing files.
+def profile_frame_change_pre(scene, *args):
+    if active_profiler is not None:
+        active_profiler.begin("evaluate")
+
+def profile_frame_change_post(scene, *args):
+    if active_profiler is not None:
+        active_profiler.end("evaluate", frame=scene.frame_current)
+
+def profile_render_pre(scene, *args):
+    if active_profiler is not None:
+        active_profiler.begin("render")
+
+def profile_render_post(scene, *args):
+    global first_frame_pending
+    if active_profiler is not None:
+        if first_frame_pending:
+            active_profiler.end("render", frame=scene.frame_current, first=True)
+        else:
+            active_profiler.end("render", frame=scene.frame_current)
+        active_profiler.begin("write")
+    first_frame_pending = False
+    if active_progress is not None:
+        active_progress.frame_done()
+        # a progress line per frame is only printed when profiling output is requested
+        if scene.sprite_frame_generator_config.output_profile:
+            print("[sprite_frame_generator] " + active_progress.status_line(), flush=True)
+
+def profile_render_write(scene, *args):
+    if active_profiler is not None:
+        active_profiler.end("write", frame=scene.frame_current)
+
+def profile_composite_pre(scene, *args):
+    if active_profiler is not None:
+        active_profiler.begin("composite")
+
+def profile_composite_post(scene, *args):
+    if active_profiler is not None:
+        active_profiler.end("composite", frame=scene.frame_current)
+
+# Handler lists and their profiling handlers. The composite handlers only exist in newer blender versions.
+PROFILE_HANDLERS = [
+    ("frame_change_pre", profile_frame_change_pre),
+    ("frame_change_post", profile_frame_change_post),
+    ("render_pre", profile_render_pre),
+    ("render_post", profile_render_post),
+    ("render_write", profile_render_write),
+    ("composite_pre", profile_composite_pre),
+    ("composite_post", profile_composite_post),
+]
+
+# Starts timing the render stages. With Write Profile on, stages are traced to a file of this process in the output folder.
+def start_profiling(config, output_path, total_frames=None):
+    global active_profiler, active_progress
+    path = profiling.process_profile_path(output_path) if config.output_profile else None
+    active_profiler = profiling.Profiler(path)
+    active_progress = profiling.ProgressEstimate(total_frames) if total_frames is not None else None
+    for name, handler in PROFILE_HANDLERS:
+        handlers = getattr(bpy.app.handlers, name, None)
+        if handlers is not None and handler not in handlers:
+            handlers.append(handler)
+
+# Stops timing. With merge, the traces of all processes are merged into the profile of the output folder.
+# Returns a line on the render warm-up of this process, or None when nothing was rendered.
+def stop_profiling(config, output_path, merge=True):
+    global active_profiler, active_progress
+    for name, handler in PROFILE_HANDLERS:
+        handlers = getattr(bpy.app.handlers, name, None)
+        if handlers is not None and handler in handlers:
+            handlers.remove(handler)
+    warmup = None
+    if active_profiler is not None:
+        active_profiler.close()
+        warmup = profiling.warmup_line(active_profiler.events)
+    active_profiler = None
+    active_progress = None
+    if config.output_profile and merge:
+        profiling.merge_profiles(output_path, config.output_profile_chrome)
+    return warmup
+
+# Sets up the renderer once for a whole job. With Keep Render Data, the scene synced to the renderer, its BVH,
+# images and compiled shaders are kept between renders, so later renders only update the camera, light and
+# posed objects. The view layer passes are turned on for the whole job, as switching them resets the kept data.
+# Returns the previous settings for stop_render_session.
+def start_render_session(scene):
+    config = scene.sprite_frame_generator_config
+    view_layer = bpy.context.view_layer
+    previous = (scene.render.use_persistent_data,
+                {prop: getattr(view_layer, prop) for prop in PASS_VIEW_LAYER_PROPERTIES.values()})
+    scene.render.use_persistent_data = config.render_persistent_data
+    for name in output_passes(config):
+        if name in PASS_VIEW_LAYER_PROPERTIES:
+            setattr(view_layer, PASS_VIEW_LAYER_PROPERTIES[name], True)
+    return previous
+
+def stop_render_session(scene, previous):
+    use_persistent_data, passes = previous
+    scene.render.use_persistent_data = use_persistent_data
+    for prop, value in passes.items():
+        setattr(bpy.context.view_layer, prop, value)
+
+# Number of frames the numpy pixel art engine processes at once.
+PIXELATE_BATCH_SIZE = 16
+
+# Returns how many times larger the written frames are than the rendered ones.
+def output_scale(config):
+    if config.composite_engine == 'NATIVE' and config.composite_upscale:
+        return pixelart.block_size(config.composite_pixel_size)
+    return 1
+
+# Applies the numpy pixel art effect to rendered frames in place.
+def pixelate_frames(output_path, frames, config):
+    for i in range(0, len(frames), PIXELATE_BATCH_SIZE):
+        paths = [os.path.join(output_path, frame["path"]) for frame in frames[i:i + PIXELATE_BATCH_SIZE]]
+        batch = numpy.stack([load_image_pixels(path) for path in paths])
+        if config.composite_engine == 'NATIVE':
+            batch = pixelart.pixelate_native(batch, config.composite_color_palette_size, output_scale(config))
+        else:
+            batch = pixelart.pixelate(batch, config.composite_pixel_size, config.composite_color_palette_size)
+        for path, pixels in zip(paths, batch):
+            save_image_pixels(path, pixels, blender_file_format(config))
+
+# Steps through the frames and maps every frame to the first frame with the same armature poses and camera placement.
+def find_held_frames(scene, frame_numbers, animatable_objects, camera):
+    current_frame = scene.frame_current
+    originals = {}
+    first_frames = {}
+    try:
+        for frame in frame_numbers:
+            scene.frame_set(frame)
+            depsgraph = bpy.context.evaluated_depsgraph_get()
+            matrices = []
+            for obj in animatable_objects:
+                evaluated = obj.evaluated_get(depsgraph)
+                bones = evaluated.pose.bones
+                pose = numpy.empty(len(bones) * 16, dtype=numpy.float32)
+                bones.foreach_get("matrix", pose)
+                matrices.append(pose)
+                matrices.append(numpy.array(evaluated.matrix_world))
+            matrices.append(numpy.array(camera.evaluated_get(depsgraph).matrix_world))
+            originals[frame] = first_frames.setdefault(dedupe.pose_key(matrices), frame)
+    finally:
+        scene.frame_set(current_frame)
+    return originals
+
+# Reads the world space heads and tails of every bone of the animatable objects in every frame,
+# and maps every frame to the sampled frame shown in its place, see sampling.py.
+def sample_frames(scene, frame_numbers, animatable_objects):
+    config = scene.sprite_frame_generator_config
+    current_frame = scene.frame_current
+    armatures = [obj for obj in animatable_objects if obj.pose is not None]
+    if not armatures:
+        return {frame: frame for frame in frame_numbers}
+    lengths = []
+    for obj in armatures:
+        bones = obj.pose.bones
+        bone_lengths = numpy.empty(len(bones), dtype=numpy.float32)
+        bones.foreach_get("length", bone_lengths)
+        lengths.append(bone_lengths)
+
+    poses = []
+    try:
+        for frame in frame_numbers:
+            scene.frame_set(frame)
+            depsgraph = bpy.context.evaluated_depsgraph_get()
+            points = []
+            for obj, bone_lengths in zip(armatures, lengths):
+                evaluated = obj.evaluated_get(depsgraph)
+                bones = evaluated.pose.bones
+                matrices = numpy.empty(len(bones) * 16, dtype=numpy.float32)
+                bones.foreach_get("matrix", matrices)
+                points.append(sampling.bone_points(matrices, bone_lengths, evaluated.matrix_world))
+            poses.append(numpy.concatenate(points) if points else numpy.zeros((0, 3)))
+    finally:
+        scene.frame_set(current_frame)
+
+    poses = numpy.stack(poses)
+    max_error = sampling.pose_size(poses) * config.animation_max_pose_error / 100.0
+    kept = sampling.sample_poses(poses, config.animation_frame_budget, max_error)
+    return sampling.hold_map(frame_numbers, kept)
+
+# Records how long every sampled frame is shown, in milliseconds, on the frames that start a run of the same image.
+def add_frame_durations(scene, frames):
+    if scene.sprite_frame_generator_config.animation_sampling != 'ADAPTIVE' or not frames:
+        return
+    shown = {frame["frame"]: frame.get("duplicate_of", frame["frame"]) for frame in frames}
+    durations = sampling.frame_durations(shown, scene.frame_step, scene.render.fps / scene.render.fps_base)
+    for frame in frames:
+        if frame["frame"] in durations:
+            frame["duration"] = durations[frame["frame"]]
+
+# Compares the rendered pixels of the frames and replaces repeated images with references to their first occurrence.
+def deduplicate_frames(output_path, frames):
+    first_frames = {}
+    for frame in frames:
+        if "duplicate_of" in frame:
+            continue
+        path = os.path.join(output_path, frame["path"])
+        original = first_frames.setdefault(dedupe.pixel_key(load_image_pixels(path)), frame)
+        if original is not frame:
+            os.remove(path)
+            frame["path"] = original["path"]
+            frame["duplicate_of"] = original["frame"]
+
+    # frames skipped before the render may point at a frame that was just removed
+    by_frame = {frame["frame"]: frame for frame in frames}
+    for frame in frames:
+        if "duplicate_of" in frame:
+            original = by_frame[frame["duplicate_of"]]
+            if "duplicate_of" in original:
+                frame["path"] = original["path"]
+                frame["duplicate_of"] = original["duplicate_of"]
+
+# Node properties that only change how a node tree looks in the editor.
+NODE_UI_PROPERTIES = ("location", "width", "width_hidden", "height", "dimensions", "select", "hide",
+                      "show_options", "show_preview", "show_texture", "use_custom_color", "color", "label")
+
+# Converts blender arrays, vectors and matrices to numpy so they hash by value.
+def plain_value(value):
+    if isinstance(value, (str, bool, int, float)) or value is None:
+        return value
+    if isinstance(value, set):
+        return sorted(value)
+    try:
+        return numpy.array(value, dtype=numpy.float64)
+    except (TypeError, ValueError):
+        return str(value)
+
+# Adds every plain property (numbers, strings, enums and arrays of them) of a blender struct to the fingerprint.
+def fingerprint_rna(fingerprint, struct, exclude=()):
+    if struct is None:
+        fingerprint.update(None)
+        return
+    fingerprint.update(struct.bl_rna.identifier)
+    for prop in struct.bl_rna.properties:
+        if prop.identifier == "rna_type" or prop.identifier in exclude or prop.type in {'POINTER', 'COLLECTION'}:
+            continue
+        fingerprint.update(prop.identifier, plain_value(getattr(struct, prop.identifier, None)))
+
+def fingerprint_node_tree(fingerprint, tree):
+    if tree is None:
+        fingerprint.update(None)
+        return
+    for node in sorted(tree.nodes, key=lambda node: node.name):
+        fingerprint.update(node.name, node.bl_idname)
+        fingerprint_rna(fingerprint, node, exclude=NODE_UI_PROPERTIES)
+        for socket in node.inputs:
+            fingerprint.update(socket.identifier, plain_value(getattr(socket, "default_value", None)))
+        image = getattr(node, "image", None)
+        fingerprint.update(image.filepath if image else None)
+        # node groups
+        if getattr(node, "node_tree", None) is not None:
+            fingerprint_node_tree(fingerprint, node.node_tree)
+    fingerprint.update(sorted((link.from_node.name, link.from_socket.identifier,
+                               link.to_node.name, link.to_socket.identifier) for link in tree.links))
+
+def fingerprint_action(fingerprint, action):
+    if action is None:
+        fingerprint.update(None)
+        return
+    fingerprint.update(action.name)
+    for fcurve in action.fcurves:
+        fingerprint.update(fcurve.data_path, fcurve.array_index, fcurve.extrapolation)
+        points = fcurve.keyframe_points
+        values = numpy.empty(len(points) * 2, dtype=numpy.float32)
+        for attribute in ("co", "handle_left", "handle_right"):
+            points.foreach_get(attribute, values)
+            fingerprint.update(values)
+        fingerprint.update([point.interpolation for point in points])
+        for modifier in fcurve.modifiers:
+            fingerprint_rna(fingerprint, modifier)
+
+TRANSFORM_CHANNELS = ("location", "rotation_euler", "rotation_quaternion", "rotation_axis_angle", "scale",
+                      "delta_location", "delta_rotation_euler", "delta_rotation_quaternion", "delta_scale")
+
+# Returns the (data path, array index) of every fcurve of the actions.
+def keyed_channels(actions):
+    return {(fcurve.data_path, fcurve.array_index) for action in actions if action for fcurve in action.fcurves}
+
+# Hashes the transform channels of an object or pose bone that none of the keyed channels animate.
+def fingerprint_transform(fingerprint, struct, keyed):
+    fingerprint.update(struct.rotation_mode)
+    for channel in TRANSFORM_CHANNELS:
+        # pose bones have no delta transforms
+        if not hasattr(struct, channel):
+            continue
+        path = struct.path_from_id(channel)
+        fingerprint.update(channel, [None if (path, index) in keyed else float(value) for index, value in enumerate(getattr(struct, channel))])
+
+# Hashes what every direction of every action shares: renderable objects, materials, world, render and compositor settings.
+# The camera and light placement and the rendered action are hashed per direction by direction_cache_key.
+def scene_cache_key(scene, animatable_objects, camera, light):
+    fingerprint = cache.Fingerprint()
+
+    for obj in sorted(scene.objects, key=lambda obj: obj.name):
+        if obj.hide_render:
+            continue
+        fingerprint.update(obj.name, obj.type, obj.parent.name if obj.parent else None, obj.parent_type, obj.parent_bone)
+        # the camera and light move for every direction. matrix_world depends on the current frame,
+        # so only the channels that no action changes are hashed, animated ones are in the hashed actions
+        if obj in animatable_objects:
+            keyed = keyed_channels(bpy.data.actions)
+        else:
+            keyed = keyed_channels([obj.animation_data.action] if obj.animation_data else [])
+        if obj != camera and obj != light:
+            fingerprint.update(numpy.array(obj.matrix_parent_inverse, dtype=numpy.float64))
+            fingerprint_transform(fingerprint, obj, keyed)
+        for modifier in obj.modifiers:
+            fingerprint_rna(fingerprint, modifier)
+        for constraint in obj.constraints:
+            fingerprint_rna(fingerprint, constraint)
+        # objects with their own animation
+        if obj not in animatable_objects and obj.animation_data:
+            fingerprint_action(fingerprint, obj.animation_data.action)
+
+        if obj.type == 'MESH':
+            mesh = obj.data
+            co = numpy.empty(len(mesh.vertices) * 3, dtype=numpy.float32)
+            mesh.vertices.foreach_get("co", co)
+            loops = numpy.empty(len(mesh.loops), dtype=numpy.int32)
+            mesh.loops.foreach_get("vertex_index", loops)
+            material_indices = numpy.empty(len(mesh.polygons), dtype=numpy.int32)
+            mesh.polygons.foreach_get("material_index", material_indices)
+            fingerprint.update(co, loops, material_indices, [group.name for group in obj.vertex_groups])
+            # vertex group weights have no foreach_get, every vertex has its own list of groups
+            fingerprint.update([[(element.group, element.weight) for element in vertex.groups] for vertex in mesh.vertices])
+            for layer in mesh.uv_layers:
+                uvs = numpy.empty(len(layer.data) * 2, dtype=numpy.float32)
+                layer.data.foreach_get("uv", uvs)
+                fingerprint.update(layer.name, layer.active_render, uvs)
+            for slot in obj.material_slots:
+                fingerprint.update(slot.material.name if slot.material else None)
+                if slot.material:
+                    fingerprint_rna(fingerprint, slot.material)
+                    fingerprint_node_tree(fingerprint, slot.material.node_tree)
+        elif obj.type == 'ARMATURE':
+            bones = obj.data.bones
+            matrices = numpy.empty(len(bones) * 16, dtype=numpy.float32)
+            bones.foreach_get("matrix_local", matrices)
+            fingerprint.update([bone.name for bone in bones], [bone.parent.name if bone.parent else None for bone in bones], matrices)
+            for bone in obj.pose.bones:
+                fingerprint_transform(fingerprint, bone, keyed)
+                for constraint in bone.constraints:
+                    fingerprint_rna(fingerprint, constraint)
+        elif obj.type in {'CAMERA', 'LIGHT'}:
+            fingerprint_rna(fingerprint, obj.data)
+
+    if scene.world:
+        fingerprint_rna(fingerprint, scene.world)
+        fingerprint_node_tree(fingerprint, scene.world.node_tree)
+
+    fingerprint_rna(fingerprint, scene.render, exclude=("filepath",))
+    fingerprint_rna(fingerprint, scene.render.image_settings)
+    fingerprint_rna(fingerprint, scene.view_settings)
+    fingerprint_rna(fingerprint, scene.display_settings)
+    for engine_settings in ("cycles", "eevee"):
+        if hasattr(scene, engine_settings):
+            fingerprint_rna(fingerprint, getattr(scene, engine_settings))
+    fingerprint.update(scene.frame_step, scene.use_nodes)
+    if scene.use_nodes:
+        fingerprint_node_tree(fingerprint, scene.node_tree)
+
+    return fingerprint.hexdigest()
+
+def direction_cache_key(scene_key, config, action, direction, frame_start, frame_end, camera_origin, light_origin):
+    fingerprint = cache.Fingerprint()
+    fingerprint.update(scene_key, direction_angle(config, direction), frame_start, frame_end,
+                       config.animation_skip_held_frames, config.output_deduplicate, config.composite_engine,
+                       config.animation_sampling, config.animation_frame_budget, config.animation_max_pose_error,
+                       config.render_mirror, config.output_palette,
+                       config.render_use_multiview, config.render_in_memory, config.output_format,
+                       config.render_auto_border, config.render_border_padding,
+                       numpy.array(camera_origin, dtype=numpy.float64), numpy.array(light_origin, dtype=numpy.float64))
+    if config.composite_engine in {'NUMPY', 'NATIVE'}:
+        fingerprint.update(config.composite_pixel_size, config.composite_color_palette_size, output_scale(config))
+    if config.output_format != 'BLENDER':
+        fingerprint.update(config.output_compression)
+    if output_passes(config):
+        fingerprint.update(output_passes(config), config.output_depth_range)
+    if config.output_palette:
+        fingerprint.update(config.output_palette_size)
+    fingerprint_action(fingerprint, action)
+    return fingerprint.hexdigest()
+
+# Deletes direction folders, delta sequences and cache manifests left over from a run with more directions.
+def remove_stale_directions(output_path, action_name, directions):
+    action_folder = os.path.join(output_path, action_name)
+    if not os.path.isdir(action_folder):
+        return
+    for name in os.listdir(action_folder):
+        stem = name
+        for extension in (delta.DELTA_EXTENSION, cache.CACHE_EXTENSION):
+            if name.endswith(extension):
+                stem = name[:-len(extension)]
+        if stem.startswith("direction_") and stem[len("direction_"):].isdigit() and int(stem[len("direction_"):]) >= directions:
+            path = os.path.join(action_folder, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+
+# Reads an image file into a (height, width, 4) float array with rows from top to bottom.
+def load_image_pixels(path):
+    if path.endswith(encoding.EXTENSIONS['QOI']):
+        # blender cannot read QOI files
+        with open(path, "rb") as f:
+            return encoding.decode_qoi(f.read())
+    image = bpy.data.images.load(path, check_existing=False)
+    try:
+        width, height = image.size
+        pixels = numpy.empty(width * height * 4, dtype=numpy.float32)
+        image.pixels.foreach_get(pixels)
+    finally:
+        bpy.data.images.remove(image)
+    # blender stores rows from bottom to top
+    return pixels.reshape(height, width, 4)[::-1]
+
+# Writes a (height, width, 4) float array with rows from top to bottom as an image file in one of Blender's formats.
+def save_image_pixels(path, pixels, file_format='PNG'):
+    height, width = pixels.shape[:2]
+    image = bpy.data.images.new(os.path.basename(path), width, height, alpha=True)
+    try:
+        image.pixels.foreach_set(numpy.ascontiguousarray(pixels[::-1], dtype=numpy.float32).ravel())
+        # write next to the target first, so a crash never leaves a half written image
+        image.filepath_raw = path + ".tmp"
+        image.file_format = file_format
+        image.save()
+        os.replace(path + ".tmp", path)
+    finally:
+        bpy.data.images.remove(image)
+
+# Packs the rendered frames of one action into atlas_#.png files and atlas.json in the action folder.
+# Frames trimmed by trim_stage while rendering in memory are not read back from disk.
+# The shared palette and its lookup table are read from the output folder unless shared_palette already has them.
+def pack_action_atlas(output_path, action_name, frames, config, trim_stage=None, shared_palette=None):
+    if not frames:
+        return
+    if trim_stage is None:
+        trim_stage = pipeline.TrimStage()
+
+    # held frames share the rect of the frame they repeat
+    unique_frames = [frame for frame in frames if "duplicate_of" not in frame]
+    for frame in unique_frames:
+        if (frame["direction"], frame["frame"]) not in trim_stage.trimmed:
+            trim_stage.add(frame, load_image_pixels(os.path.join(output_path, frame["path"])))
+
+    sources = [{"action": frame["action"], "direction": frame["direction"], "frame": frame["frame"]} for frame in unique_frames]
+    crops, bounds, source_sizes = zip(*[trim_stage.trimmed[(frame["direction"], frame["frame"])] for frame in unique_frames])
+    atlases, metadata = atlas.pack_trimmed(sources, crops, bounds, source_sizes,
+                                           config.output_atlas_max_size, config.output_atlas_padding)
+    pass_metadata = {"atlases": metadata["atlases"], "frames": list(metadata["frames"])}
+
+    entries = {(entry["direction"], entry["frame"]): entry for entry in metadata["frames"]}
+    metadata["frames"] = []
+    for frame in frames:
+        entry = dict(entries[(frame["direction"], frame.get("duplicate_of", frame["frame"]))])
+        entry["frame"] = frame["frame"]
+        if "duplicate_of" in frame:
+            entry["duplicate_of"] = frame["duplicate_of"]
+        if "offset" in frame:
+            # trim offsets and sizes relative to the full frame, not the render border
+            entry["trim"] = [entry["trim"][0] + frame["offset"][0], entry["trim"][1] + frame["offset"][1]]
+            entry["source_size"] = list(frame["canvas_size"])
+        metadata["frames"].append(entry)
+
+    action_folder = os.path.join(output_path, action_name)
+    shared = shared_palette if shared_palette is not None else read_shared_palette(config, output_path)
+    for i, pixels in enumerate(atlases):
+        image_name = "atlas_" + str(i) + ".png"
+        if shared is not None:
+            save_palette_pixels(os.path.join(action_folder, image_name), pixels, shared, config)
+        else:
+            save_image_pixels(os.path.join(action_folder, image_name), pixels)
+        metadata["atlases"][i]["image"] = image_name
+
+    # pass pages share the rects of the color pages
+    for name in output_passes(config):
+        crops = [atlas.crop(load_image_pixels(os.path.join(output_path, frame["passes"][name])), frame_bounds)
+                 for frame, frame_bounds in zip(unique_frames, bounds)]
+        for i, pixels in enumerate(atlas.fill_pages(pass_metadata, crops)):
+            image_name = "atlas_" + name + "_" + str(i) + ".png"
+            save_image_pixels(os.path.join(action_folder, image_name), pixels)
+            metadata["atlases"][i].setdefault("passes", {})[name] = image_name
+
+    with open(os.path.join(action_folder, "atlas.json"), "w") as f:
+        json.dump(metadata, f, indent=2)
+    return trim_stage
+
+# Suffix of the output folder of the mirrored copy of an action.
+MIRRORED_ACTION_SUFFIX = "_mirrored"
+
+# Returns the directions of directions that are rendered, the others are flipped from their mirror direction.
+def rendered_directions(config, directions):
+    if config.render_mirror != 'DIRECTIONS':
+        return list(directions)
+    return [j for j in directions if not mirror.is_mirrored(config.render_directions, j)]
+
+# Writes pixels to a frame path in the output format.
+def save_frame_pixels(path, pixels, config):
+    if config.output_format == 'BLENDER':
+        save_image_pixels(path, pixels, blender_file_format(config))
+    else:
+        indexed = config.composite_engine in {'NUMPY', 'NATIVE'}
+        encoding.write_file(path, encoding.encode(pixels, config.output_format, config.output_compression, indexed))
+
+# Flips the frames and passes of a direction into the folder of direction in action_name and returns their records.
+def mirror_frames(output_path, frames, action_name, direction, config):
+    folder = direction_folder(output_path, action_name, direction)
+    os.makedirs(folder, exist_ok=True)
+    mirrored = []
+    width = None
+    for frame in frames:
+        record = dict(frame, action=action_name, direction=direction)
+        record["path"] = os.path.relpath(os.path.join(folder, os.path.basename(frame["path"])), output_path)
+        if "passes" in frame:
+            record["passes"] = {name: pass_path(record["path"], name) for name in frame["passes"]}
+        if "duplicate_of" not in frame:
+            pixels = load_image_pixels(os.path.join(output_path, frame["path"]))
+            width = pixels.shape[1]
+            save_frame_pixels(os.path.join(output_path, record["path"]), mirror.flip_pixels(pixels), config)
+            for name, path in frame.get("passes", {}).items():
+                os.makedirs(os.path.dirname(os.path.join(output_path, record["passes"][name])), exist_ok=True)
+                save_image_pixels(os.path.join(output_path, record["passes"][name]),
+                                  mirror.flip_pixels(load_image_pixels(os.path.join(output_path, path)), name == "normal"))
+        mirrored.append(record)
+
+    # every frame of a direction has the size of its render border
+    for record in mirrored:
+        if "offset" in record and width is not None:
+            record["offset"] = mirror.mirrored_offset(record["offset"], width, record["canvas_size"][0])
+    return mirrored
+
+# Flips the rendered directions into the mirrored directions missing from frames_by_direction.
+# With Mirrored Actions, flips every direction into the folders of the mirrored copy of the action instead
+# and returns its frames by direction, otherwise None.
+def add_mirrored_frames(output_path, action_name, frames_by_direction, config):
+    directions = config.render_directions
+    if config.render_mirror == 'DIRECTIONS':
+        for j in range(directions):
+            source = mirror.mirror_direction(directions, j)
+            if j not in frames_by_direction and source in frames_by_direction:
+                frames_by_direction[j] = mirror_frames(output_path, frames_by_direction[source], action_name, j, config)
+    elif config.render_mirror == 'ACTIONS' and all(j in frames_by_direction for j in range(directions)):
+        mirrored_name = action_name + MIRRORED_ACTION_SUFFIX
+        shutil.rmtree(os.path.join(output_path, mirrored_name), ignore_errors=True)
+        return {j: mirror_frames(output_path, frames_by_direction[mirror.mirror_direction(directions, j)], mirrored_name, j, config)
+                for j in range(directions)}
+    return None
+
+# Returns a copy of the action mirrored across the x axis of the armature, with .L and .R bones swapped.
+# Mirrors location x and the y and z rotation of the keyframes, which suits rigs with symmetric rest poses.
+def mirror_action(action):
+    mirrored = action.copy()
+    mirrored.name = action.name + MIRRORED_ACTION_SUFFIX
+    for fcurve in mirrored.fcurves:
+        data_path = fcurve.data_path
+        if data_path.startswith('pose.bones["'):
+            bone_name = data_path[len('pose.bones["'):data_path.index('"]')]
+            fcurve.data_path = 'pose.bones["' + bpy.utils.flip_name(bone_name) + data_path[data_path.index('"]'):]
+        prop = data_path.rsplit(".", 1)[-1]
+        negated = {"location": {0}, "rotation_euler": {1, 2}, "rotation_quaternion": {2, 3}, "rotation_axis_angle": {2, 3}}
+        if fcurve.array_index in negated.get(prop, ()):
+            for point in fcurve.keyframe_points:
+                point.co[1] = -point.co[1]
+                point.handle_left[1] = -point.handle_left[1]
+                point.handle_right[1] = -point.handle_right[1]
+    return mirrored
+
+# Returns the pixels of a frame placed in its full frame.
+def canvas_pixels(output_path, record):
+    pixels = load_image_pixels(os.path.join(output_path, record["path"]))
+    if "offset" not in record:
+        return pixels
+    return mirror.place_on_canvas(pixels, record["offset"], record["canvas_size"])
+
+# Renders a flipped frame for real into a temporary folder and returns the mean difference of their pixels.
+# With Mirrored Actions, the frame is rendered with a mirrored copy of the action.
+def check_mirrored_frame(scene, action, record, output_path, animatable_objects, camera, light, camera_origin, light_origin):
+    config = scene.sprite_frame_generator_config
+    check_path = tempfile.mkdtemp(prefix="sprite_frame_generator_")
+    source = mirror_action(action) if config.render_mirror == 'ACTIONS' else action
+    try:
+        frames = render_direction(scene, source, record["direction"], record["frame"], record["frame"], check_path,
+                                  animatable_objects, camera, light, camera_origin, light_origin)
+        return mirror.frame_difference(canvas_pixels(check_path, frames[0]), canvas_pixels(output_path, record))
+    finally:
+        shutil.rmtree(check_path, ignore_errors=True)
+        if source is not action:
+            bpy.data.actions.remove(source)
+        # put everything back the way the render left it
+        assign_action(animatable_objects, action)
+        camera.location = camera_origin
+        reset_camera_rotation(camera)
+        light.location = light_origin
+
+# Returns a frame in the middle of a flipped direction of frames_by_direction to check, or None.
+def mirrored_check_record(config, frames_by_direction, mirrored_frames_by_direction=None):
+    if mirrored_frames_by_direction is not None:
+        candidates = mirrored_frames_by_direction
+    else:
+        candidates = {j: frames for j, frames in frames_by_direction.items() if mirror.is_mirrored(config.render_directions, j)}
+    for j in sorted(candidates):
+        originals = [frame for frame in candidates[j] if "duplicate_of" not in frame]
+        if originals:
+            return originals[len(originals) // 2]
+    return None
+
+# Number of pixels sampled across all frames of a render to build its shared palette.
+PALETTE_SAMPLES = 200000
+
+# Reads the shared palette of a render and its lookup table, or returns None without a shared palette.
+def read_shared_palette(config, output_path):
+    if not config.output_palette:
+        return None
+    colors = palette.read_palette(os.path.join(output_path, palette.PALETTE_FILE))
+    return colors, palette.build_lut(colors)
+
+# Writes pixels with the nearest colors of a shared palette, as a palette PNG for PNG paths.
+def save_palette_pixels(path, pixels, shared, config):
+    colors, lut = shared
+    indices = palette.quantize(encoding.to_uint8(pixels), lut, colors)
+    if path.endswith(encoding.EXTENSIONS['PNG']):
+        encoding.write_file(path, encoding.encode_png(None, config.output_compression, palette=colors, indices=indices))
+    else:
+        save_frame_pixels(path, colors[indices].astype(numpy.float32) / 255.0, config)
+
+# Builds one palette from pixels sampled across the frames of every action and direction, writes it to
+# palette.json and rewrites the frames with its colors, so all sprites of a character share one palette.
+# Returns the palette colors and lookup table, built once for the whole job, or None without frames.
+def apply_shared_palette(output_path, frames, config):
+    paths = sorted({os.path.join(output_path, frame["path"]) for frame in frames if "duplicate_of" not in frame})
+    if not paths:
+        return None
+    # a fixed seed gives the same palette for the same frames
+    rng = numpy.random.default_rng(0)
+    count = max(1, PALETTE_SAMPLES // len(paths))
+    samples = [palette.sample_pixels(encoding.to_uint8(load_image_pixels(path)), count, rng) for path in paths]
+    colors = palette.build_palette(numpy.concatenate(samples), config.output_palette_size)
+    palette.write_palette(os.path.join(output_path, palette.PALETTE_FILE), colors)
+    shared = (colors, palette.build_lut(colors))
+    # frames are read again instead of kept, a render can have more frames than fit in memory
+    for path in paths:
+        save_palette_pixels(path, load_image_pixels(path), shared, config)
+    return shared
+
+# Returns the path of the delta sequence of a direction, next to its folder.
+def delta_sequence_path(output_path, action_name, direction):
+    return direction_folder(output_path, action_name, direction) + delta.DELTA_EXTENSION
+
+# Writes the frames of every direction of an action as delta sequences, see delta.py.
+# Returns the bytes of the sequences and of the frame files they hold.
+def write_delta_sequences(output_path, action_name, frames_by_direction, config):
+    sequence_size = 0
+    file_size = 0
+    for j in sorted(frames_by_direction):
+        path = delta_sequence_path(output_path, action_name, j)
+        with delta.DeltaWriter(path, config.output_delta_keyframe_interval, config.output_compression) as writer:
+            loaded_path = None
+            pixels = None
+            for frame in sorted(frames_by_direction[j], key=lambda frame: frame["frame"]):
+                # held frames point to the file of the frame they repeat
+                if frame["path"] != loaded_path:
+                    loaded_path = frame["path"]
+                    # cropped frames are placed in their full frame, so every frame of a direction has one size
+                    pixels = encoding.to_uint8(canvas_pixels(output_path, frame))
+                    file_size += os.path.getsize(os.path.join(output_path, loaded_path))
+                writer.add(frame["frame"], pixels)
+        sequence_size += os.path.getsize(path)
+    return sequence_size, file_size
+
+# Opens the frame archive of a render, or returns None when frames are only written as files.
+# The archive is written next to its final path and moved there once it is complete.
+def start_frame_archive(config, output_path):
+    if config.output_archive == 'OFF':
+        return None
+    return archive.ArchiveWriter(os.path.join(output_path, archive.ARCHIVE_FILE + ".tmp"))
+
+# Appends the frame files of an action to the frame archive, with the trim rects of trim_stage when it has them.
+def archive_action_frames(writer, output_path, frames, trim_stage=None):
+    # originals first, duplicates point to their bytes
+    for frame in sorted(frames, key=lambda frame: ("duplicate_of" in frame, frame["direction"], frame["frame"])):
+        trim = None
+        if trim_stage is not None and (frame["direction"], frame["frame"]) in trim_stage.trimmed:
+            trim = trim_stage.trimmed[(frame["direction"], frame["frame"])][1]
+        pass_paths = {name: os.path.join(output_path, path) for name, path in frame.get("passes", {}).items()}
+        writer.add_file(frame, os.path.join(output_path, frame["path"]), trim, pass_paths)
+
+# Moves the complete frame archive to its final path.
+def finish_frame_archive(config, output_path, writer):
+    writer.close()
+    os.replace(writer.path, os.path.join(output_path, archive.ARCHIVE_FILE))
+
+# Returns whether an action matches the filter text of the action list.
+# Every word must be part of the name, words starting with # must be one of the tags.
+def action_matches_filter(name, tags, filter_text):
+    name = name.lower()
+    tag_set = {tag.strip().lower() for tag in tags.split(",") if tag.strip()}
+    for word in filter_text.lower().split():
+        if word.startswith("#"):
+            if word[1:] not in tag_set:
+                return False
+        elif word not in name:
+            return False
+    return True
+
+# Brings the action registry of the scene up to date with bpy.data.actions.
+# Only added, removed and renamed actions are touched, so selections and tags stay with their action.
+def sync_action_registry(scene):
+    registry = scene.sprite_frame_generator_config.actions
+    action_names = {action.name for action in bpy.data.actions}
+    item_names = {item.name for item in registry}
+    if action_names == item_names:
+        return
+
+    removed = item_names - action_names
+    added = action_names - item_names
+    # a single action removed and added together was renamed when it is the same action, keep its settings.
+    # An action deleted and a new one created is not a rename, the new one starts with the defaults.
+    if len(removed) == 1 and len(added) == 1:
+        item = registry[next(iter(removed))]
+        action = bpy.data.actions[next(iter(added))]
+        if item.session_uid == action.session_uid or item.channels_key == action_channels_key(action):
+            item.name = action.name
+            remember_action(item, action)
+            return
+
+    for i in reversed(range(len(registry))):
+        if registry[i].name in removed:
+            registry.remove(i)
+
+    # files saved with the old fixed size action list keep their selections by position
+    old_selections = scene.sprite_frame_generator_config.get("action_list") if not item_names else None
+    for i, action in enumerate(bpy.data.actions):
+        if action.name in added:
+            item = registry.add()
+            item.name = action.name
+            remember_action(item, action)
+            if old_selections is not None and i < len(old_selections):
+                item.selected = bool(old_selections[i])
+
+# Returns a key of the channels an action animates, which a renamed action keeps.
+def action_channels_key(action):
+    return cache.Fingerprint().update(sorted((fcurve.data_path, fcurve.array_index) for fcurve in action.fcurves)).hexdigest()
+
+# Stores what tells the action of a registry item apart from other actions, besides its name.
+def remember_action(item, action):
+    item.session_uid = action.session_uid
+    item.channels_key = action_channels_key(action)
+
+# Returns the selected actions in the order of bpy.data.actions.
+def selected_actions(scene):
+    sync_action_registry(scene)
+    names = {item.name for item in scene.sprite_frame_generator_config.actions if item.selected}
+    return [action for action in bpy.data.actions if action.name in names]
+
+@bpy.app.handlers.persistent
+def sync_action_registry_on_update(scene, depsgraph=None):
+    # cheap enough for every update: nothing is written unless the actions changed
+    if hasattr(scene, "sprite_frame_generator_config"):
+        sync_action_registry(scene)
+
+@bpy.app.handlers.persistent
+def sync_action_registry_on_load(*args):
+    for scene in bpy.data.scenes:
+        sync_action_registry(scene)
+        # session uids are new in every session
+        for item in scene.sprite_frame_generator_config.actions:
+            action = bpy.data.actions.get(item.name)
+            if action is not None:
+                remember_action(item, action)
+
 ################
 # Data Structures
 ################
 
+# An action in the action list, found by the name of its action.
+class SPRITEFRAMEGENERATOR_HT_ActionItem(bpy.types.PropertyGroup):
+    """An action and whether it is rendered."""
+    selected: bpy.props.BoolProperty(name="Render", default=True)
+    tags: bpy.props.StringProperty(
+        name="Tags", default="",
+        description="Comma separated tags. Search for a tag with #tag")
+    # tell a renamed action from a deleted one replaced by a new one, see sync_action_registry
+    session_uid: bpy.props.IntProperty(default=0)
+    channels_key: bpy.props.StringProperty(default="")
+
 # Configurations
 class SPRITEFRAMEGENERATOR_HT_Config(bpy.types.PropertyGroup):
     """The configuration for the sprite frame generator."""
@@ -70,6 +1754,38 @@ class SPRITEFRAMEGENERATOR_HT_Config(bpy.types.PropertyGroup):
     render_directions: bpy.props.IntProperty(
         name="Rotation Angles", default=4, min=1, max=10000)
     render_fps: bpy.props.IntProperty(name="FPS", default=30, min=1, max=10000)
+    render_use_workers: bpy.props.BoolProperty(
+        name="Render on Background Workers", default=False,
+        description="Render in background blender processes so blender stays usable. Press ESC to stop them")
+    render_worker_count: bpy.props.IntProperty(
+        name="Workers", default=2, min=1, max=256)
+    render_in_memory: bpy.props.BoolProperty(
+        name="Render in Memory", default=False,
+        description="Render frame by frame and run the post render stages on the pixels in memory, writing only the final frames")
+    render_persistent_data: bpy.props.BoolProperty(
+        name="Keep Render Data", default=True,
+        description="Keep the synced scene, BVH, images and compiled shaders between the renders of a job, so only the camera, light and posed objects are updated. Cycles only, uses more memory")
+    render_use_multiview: bpy.props.BoolProperty(
+        name="Render Directions as Views", default=False,
+        description="Render all directions of a frame in one multi-view render. The light does not rotate with the camera")
+    render_auto_border: bpy.props.EnumProperty(
+        name="Auto Border", default='OFF',
+        items=[('OFF', "Off", "Render the full frame"),
+               ('ACTION', "Per Action", "Render one border around the character in every direction, so all frames of an action have the same size"),
+               ('DIRECTION', "Per Direction", "Render a border around the character for every direction")])
+    render_border_padding: bpy.props.IntProperty(
+        name="Border Padding", default=8, min=0, max=10000)
+    render_mirror: bpy.props.EnumProperty(
+        name="Mirror", default='OFF',
+        items=[('OFF', "Off", "Render every direction"),
+               ('DIRECTIONS', "Mirror Directions", "Render half of the directions and flip them into the others. For symmetric characters and actions, seen from the front at the camera's starting position"),
+               ('ACTIONS', "Mirrored Actions", "Also flip every direction into a mirrored copy of every action, without rendering it. For actions that differ on the left and right")])
+    render_mirror_check: bpy.props.BoolProperty(
+        name="Check Mirror", default=False,
+        description="Render one flipped frame for real and report how much it differs")
+    render_mirror_tolerance: bpy.props.FloatProperty(
+        name="Mirror Tolerance", default=0.01, min=0.0, max=1.0,
+        description="Mean difference of the pixel values above which the check warns")
 
     animation_expanded: bpy.props.BoolProperty(
         name="Animation Settings", default=True)
@@ -77,22 +1793,106 @@ class SPRITEFRAMEGENERATOR_HT_Config(bpy.types.PropertyGroup):
         name="Frame Step", default=1, min=1, max=10000)
     animation_start_frame: bpy.props.IntProperty(
         name="Start Frame", default=1, min=0, max=10000)
+    animation_skip_held_frames: bpy.props.BoolProperty(
+        name="Skip Held Frames", default=False)
+    animation_sampling: bpy.props.EnumProperty(
+        name="Frame Sampling", default='STEP',
+        items=[('STEP', "Frame Step", "Render every frame step frame"),
+               ('ADAPTIVE', "Adaptive", "Render the frames where the pose changes the most, other frames show the last rendered frame")])
+    animation_frame_budget: bpy.props.IntProperty(
+        name="Frame Budget", default=0, min=0, max=10000,
+        description="Most frames to render per action and direction, 0 for no limit")
+    animation_max_pose_error: bpy.props.FloatProperty(
+        name="Max Pose Error", default=2.0, min=0.0, max=100.0, subtype='PERCENTAGE',
+        description="How far the bones of a skipped frame may be from the frame shown in its place, in percent of the character's size")
 
     output_expanded: bpy.props.BoolProperty(
         name="Output Settings", default=True)
     output_path: bpy.props.StringProperty(
         name="Output Folder", default="", subtype='DIR_PATH')
+    output_use_cache: bpy.props.BoolProperty(
+        name="Reuse Unchanged Frames", default=True)
+    output_deduplicate: bpy.props.BoolProperty(
+        name="Deduplicate Frames", default=False)
+    output_format: bpy.props.EnumProperty(
+        name="File Format", default='BLENDER',
+        items=[('BLENDER', "Scene Settings", "Write frames with blender using the scene's output settings"),
+               ('PNG', "PNG", "Write PNG frames on encoder threads, as palette PNGs when they have 256 colors or less"),
+               ('WEBP', "WebP", "Write lossless WebP frames on encoder threads. Needs the Pillow python package"),
+               ('QOI', "QOI", "Write QOI frames on encoder threads. Fast to decode, blender itself cannot open them")])
+    output_compression: bpy.props.IntProperty(
+        name="Compression", default=6, min=0, max=9,
+        description="0 writes fastest for iterating, 9 writes the smallest files for release. QOI has no levels")
+    output_encoder_threads: bpy.props.IntProperty(
+        name="Encoder Threads", default=4, min=1, max=64)
+    output_resume: bpy.props.BoolProperty(
+        name="Resume Interrupted Renders", default=False,
+        description="Keep the frames of an interrupted render that journal.jsonl lists as complete and intact, and render only the rest")
+    output_pass_normal: bpy.props.BoolProperty(
+        name="Normal Pass", default=False,
+        description="Write camera space normals of every frame to a normal folder next to the frames")
+    output_pass_depth: bpy.props.BoolProperty(
+        name="Depth Pass", default=False,
+        description="Write the depth of every frame to a depth folder next to the frames, near is white")
+    output_pass_mask: bpy.props.BoolProperty(
+        name="Mask Pass", default=False,
+        description="Write the silhouette of every frame to a mask folder next to the frames")
+    output_pass_index: bpy.props.BoolProperty(
+        name="Index Pass", default=False,
+        description="Write the object pass index of every frame, divided by 255, to an index folder next to the frames")
+    output_depth_range: bpy.props.FloatProperty(
+        name="Depth Range", default=4.0, min=0.01, subtype='DISTANCE',
+        description="Depth around the world origin mapped from white to black")
+    output_palette: bpy.props.BoolProperty(
+        name="Shared Palette", default=False,
+        description="Map the frames of every action and direction to one palette built from all of them, written to palette.json. PNG frames are written as palette PNGs")
+    output_palette_size: bpy.props.IntProperty(
+        name="Palette Colors", default=32, min=2, max=255)
+    output_delta: bpy.props.BoolProperty(
+        name="Delta Sequences", default=False,
+        description="Also write every direction as one .sfgdelta file with keyframes and, for the frames between, only the rects that changed")
+    output_delta_keyframe_interval: bpy.props.IntProperty(
+        name="Keyframe Interval", default=30, min=1, max=10000,
+        description="Frames between keyframes. Longer intervals give smaller files, shorter ones faster seeking")
+    output_archive: bpy.props.EnumProperty(
+        name="Frame Archive", default='OFF',
+        items=[('OFF', "Off", "Write a file per frame"),
+               ('ARCHIVE', "Archive", "Also pack the frame files of the render into frames.sfgpack")])
+    output_profile: bpy.props.BoolProperty(
+        name="Write Profile", default=False,
+        description="Trace the time of every render stage to profile.jsonl in the output folder")
+    output_profile_chrome: bpy.props.BoolProperty(
+        name="Chrome Trace", default=False,
+        description="Also write the trace as profile.trace.json, for chrome://tracing or ui.perfetto.dev")
+    output_atlas: bpy.props.BoolProperty(
+        name="Pack Atlas", default=False)
+    output_atlas_max_size: bpy.props.IntProperty(
+        name="Atlas Size", default=2048, min=16, max=16384)
+    output_atlas_padding: bpy.props.IntProperty(
+        name="Atlas Padding", default=1, min=0, max=64)
 
     action_list_expanded: bpy.props.BoolProperty(
         name="Action Settings", default=True)
-    action_list: bpy.props.BoolVectorProperty(name="Action List", size=30, default=[True] * 30) # NOTE: Strange, I cannot set a higher size number than 30. I don't know why.
+    actions: bpy.props.CollectionProperty(type=SPRITEFRAMEGENERATOR_HT_ActionItem)
+    actions_index: bpy.props.IntProperty(name="Active Action", default=0)
+    action_filter: bpy.props.StringProperty(
+        name="Filter", default="", options={'TEXTEDIT_UPDATE'},
+        description="Show actions with all these words in their name. Words starting with # match tags")
 
     composite_expanded: bpy.props.BoolProperty(
         name="Pixel Art Settings", default=True)
+    composite_engine: bpy.props.EnumProperty(
+        name="Pixel Art Engine", default='NODES',
+        items=[('NODES', "Compositor Nodes", "Use the compositor nodes made by Apply Pixel Art"),
+               ('NUMPY', "NumPy", "Pixelate rendered frames with numpy, leaving the compositor untouched"),
+               ('NATIVE', "Native Resolution", "Render one pixel per pixel art pixel and round the colors with numpy, leaving the compositor untouched")])
     composite_pixel_size: bpy.props.FloatProperty(
         name="Pixel Size", default=12.0, min=1.0, max=10000.0)
     composite_color_palette_size: bpy.props.FloatProperty(
         name="Color Palette Size", default=30.0, min=1.0, max=10000.0)
+    composite_upscale: bpy.props.BoolProperty(
+        name="Upscale Frames", default=True,
+        description="Scale frames rendered at native resolution up by the pixel size, so every pixel art pixel is a block of pixels")
 
 ################
 # Operators
@@ -283,10 +2083,40 @@ class SPRITEFRAMEGENERATOR_OT_RenderSettings(bpy.types.Operator):
     bl_options = {'REGISTER'}
 
     def execute(self, context):
-        apply_render_settings(context)
+        # the pixel filter width is only changed for the duration of a render, not kept in the scene
+        restore_render_settings(apply_render_settings(context))
         return {'FINISHED'}
 
 
+# Folder in the output path holding the scene copy and job file of background workers.
+WORKER_STAGING_FOLDER = ".workers"
+
+# Status lines of the render running on background workers, drawn by the main panel.
+worker_status = []
+
+def redraw_panels(context):
+    for window in context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == 'VIEW_3D':
+                area.tag_redraw()
+
+# Selects or deselects the actions shown in the action list.
+class SPRITEFRAMEGENERATOR_OT_SelectActions(bpy.types.Operator):
+    """Select or deselect the actions matching the filter."""
+    bl_idname = "sprite_frame_generator.select_actions"
+    bl_label = "Select Actions"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    select: bpy.props.BoolProperty(name="Select", default=True)
+
+    def execute(self, context):
+        config = context.scene.sprite_frame_generator_config
+        sync_action_registry(context.scene)
+        for item in config.actions:
+            if action_matches_filter(item.name, item.tags, config.action_filter):
+                item.selected = self.select
+        return {'FINISHED'}
+
 # The main operator to generate the sprite frames.
 class SPRITEFRAMEGENERATOR_OT_Render(bpy.types.Operator):
     """Render the sprite frames."""
@@ -295,149 +2125,397 @@ class SPRITEFRAMEGENERATOR_OT_Render(bpy.types.Operator):
     bl_options = {'REGISTER'}
 
     _timer = None
-    th = None
-    stop_early = False
-
-    # Intermittent crashes when running render function in background. 
-    # Using the foreground thread will freeze blender until the render is complete.
-    run_in_background = False
+    pool = None
 
-    def start_timer(self, context):
-        self.th = threading.Thread(target=self.render_animations, args=())
-        self.th.start()
+    # Rendering from a thread inside blender crashes, so background rendering runs in separate blender processes.
+    # Rendering in the foreground freezes blender until the render is complete.
+    def start_workers(self, context):
+        config = context.scene.sprite_frame_generator_config
+        scene = context.scene
+
+        staging_path = os.path.join(self.output_path, WORKER_STAGING_FOLDER)
+        if os.path.exists(staging_path):
+            shutil.rmtree(staging_path)
+        os.makedirs(staging_path)
+
+        # workers render a copy of the current session, so unsaved changes are included and artists can keep working
+        blend_path = os.path.join(staging_path, "scene.blend")
+        bpy.ops.wm.save_as_mainfile(filepath=blend_path, copy=True)
+        job = jobs.config_to_job(config)
+        job["output_path"] = self.output_path
+        job_path = os.path.join(staging_path, "job.json")
+        jobs.write_json(job_path, job)
+
+        camera_origin = self.camera.location.copy()
+        light_origin = self.light.location.copy()
+        # the cache keys also tell the journaled frames of these settings apart
+        scene_key = scene_cache_key(scene, self.animatable_objects, self.camera, self.light)
+
+        # action name -> (frame records by direction, cache keys of the directions to render)
+        self.worker_actions = {}
+        units = []
+        for action in selected_actions(scene):
+            frame_start, frame_end, frames_by_direction, cache_keys, originals = self.prepare_action(
+                config, scene, action, scene_key, camera_origin, light_origin)
+            self.worker_actions[action.name] = (frames_by_direction, cache_keys)
+
+            # mirrored directions are flipped from the rendered ones
+            pending_directions = rendered_directions(config, sorted(cache_keys))
+            if config.render_use_multiview and len(pending_directions) > 1:
+                action_units = [jobs.make_unit(action.name, pending_directions, frame_start, frame_end)]
+            else:
+                action_units = [jobs.make_unit(action.name, [j], frame_start, frame_end) for j in pending_directions]
+            borders = action_render_borders(scene, action, frame_start, frame_end, pending_directions,
+                                            self.animatable_objects, self.camera, camera_origin)
+            for unit in action_units:
+                unit["journal_keys"] = {str(j): cache_keys[j] for j in unit["directions"]}
+                # json object keys are strings
+                unit["originals"] = {str(frame): original for frame, original in originals.items()}
+                if borders is not None:
+                    unit["border"] = list(directions_border(borders, unit["directions"]))
+            units += action_units
+
+        if not units:
+            self.finish_workers(context)
+            return {'FINISHED'}
+
+        core_slices = jobs.split_cores(jobs.available_cores(), min(config.render_worker_count, len(units)))
+        # the workers only append to the journal
+        journal.Journal(self.output_path, compact=True).close()
+        batch_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "batch.py")
+
+        def args_for_worker(index):
+            return [bpy.app.binary_path, "-b", blend_path, "-t", str(len(core_slices[index])),
+                    "-P", batch_path, "--", "--job", job_path, "--serve"]
+
+        self.pool = workers.WorkerPool(units, args_for_worker, core_slices, config.animation_frame_step)
+        worker_status[:] = self.pool.status_lines()
 
         wm = context.window_manager
-        self._timer = wm.event_timer_add(0.1, context.window)
+        self._timer = wm.event_timer_add(0.5, window=context.window)
         wm.modal_handler_add(self)
-    
-    def cancel_timer(self, context):
-        wm = context.window_manager
-        wm.event_timer_remove(self._timer)
-        self.stop_early = True
-        self.th.join()
+        return {'RUNNING_MODAL'}
+
+    def stop_workers(self, context):
+        if self._timer is not None:
+            context.window_manager.event_timer_remove(self._timer)
+            self._timer = None
+        if self.pool is not None:
+            self.pool.stop()
+            self.pool = None
+        # the scene copy of the workers is not needed once they stopped, also when canceled
+        shutil.rmtree(os.path.join(self.output_path, WORKER_STAGING_FOLDER), ignore_errors=True)
+        worker_status.clear()
+        redraw_panels(context)
+
+    # Writes the caches and atlases of the actions rendered by the workers.
+    def finish_workers(self, context):
+        config = context.scene.sprite_frame_generator_config
+        self.archive = start_frame_archive(config, self.output_path)
+        try:
+            finished = []
+            for action_name, (frames_by_direction, cache_keys) in self.worker_actions.items():
+                mirrored_frames = add_mirrored_frames(self.output_path, action_name, frames_by_direction, config)
+                self.check_mirror(config, bpy.data.actions[action_name], frames_by_direction, mirrored_frames,
+                                  self.camera.location.copy(), self.light.location.copy())
+                finished.append((action_name, frames_by_direction, cache_keys, None, mirrored_frames))
+            self.finish_actions(config, finished)
+            if self.archive is not None:
+                finish_frame_archive(config, self.output_path, self.archive)
+        finally:
+            # an archive that did not finish is not kept
+            if self.archive is not None:
+                self.archive.discard()
+        if config.output_profile:
+            # every worker traced to its own file
+            warmup = profiling.warmup_line(profiling.merge_profiles(self.output_path, config.output_profile_chrome))
+            if warmup is not None:
+                self.report({'INFO'}, warmup + ".")
+
+    def cancel(self, context):
+        self.stop_workers(context)
 
     def modal(self, context, event):
-        if event.type in {'RIGHTMOUSE', 'ESC'}:
-            self.cancel(context)
+        if event.type == 'ESC':
+            self.stop_workers(context)
             self.report({'INFO'}, "Rendering canceled.")
             return {'CANCELLED'}
 
         if event.type == 'TIMER':
-            if self.th.is_alive():
-                return {'PASS_THROUGH'}
-            else:
-                self.cancel(context)
-                self.report({'INFO'}, "Rendering finished.")
+            for unit, message in self.pool.poll():
+                if message["event"] == "done":
+                    frames_by_direction = self.worker_actions[unit["action"]][0]
+                    for frame in message["frames"]:
+                        frames_by_direction.setdefault(frame["direction"], []).append(frame)
+                else:
+                    self.report({'ERROR'}, "Rendering " + unit["action"] + " failed: " + message.get("message", ""))
+
+            worker_status[:] = self.pool.status_lines()
+            redraw_panels(context)
+
+            if self.pool.is_finished():
+                failed = len(self.pool.errors)
+                completed = len(self.pool.completed)
+                self.stop_workers(context)
+                self.finish_workers(context)
+                if failed and not completed:
+                    self.report({'ERROR'}, "Rendering failed, none of the " + str(failed) + " units was rendered.")
+                    return {'CANCELLED'}
+                if failed:
+                    self.report({'ERROR'}, "Rendering finished with " + str(failed) + " failed units.")
+                else:
+                    self.report({'INFO'}, "Rendering finished.")
                 return {'FINISHED'}
 
         return {'PASS_THROUGH'}
 
-    def render_animations(self):
-        # Loop through all actions.
-        for i in range(len(bpy.data.actions)):
-            if self.stop_early:
-                return
-            action = bpy.data.actions[i]
-            config = bpy.context.scene.sprite_frame_generator_config
-            scene = bpy.context.scene
-
-            # Check if the action is selected.
-            if not config.action_list[i]:
-                continue
-
-            self.report({'INFO'}, "Rendering action " + action.name + "...")
-
-            # dynamically set the last frame to render based on the action
-            scene.frame_start = int(action.frame_range[0]) + config.animation_start_frame
-            scene.frame_end = int(action.frame_range[1])
-
+    # Clears outdated output of an action and looks up its cached directions.
+    # Returns the frame range, the cached frame records by direction and the cache keys of the directions to render.
+    def prepare_action(self, config, scene, action, scene_key, camera_origin, light_origin):
+        if config.output_use_cache or config.output_resume:
+            remove_stale_directions(self.output_path, action.name, config.render_directions)
+        else:
             # delete action folder if it already exists
             action_folder = os.path.join(self.output_path, action.name)
             if os.path.exists(action_folder):
                 shutil.rmtree(action_folder)
-            
-            angle_delta = 2*math.pi/config.render_directions
-
-            # Loop through all rotation angles.
-            for j in range(config.render_directions):
-                if self.stop_early:
-                    return
-
-                self.report({'INFO'}, "Rendering direction " + str(j) + "...")
-                # create folder for the angle and action
-                angle_folder = os.path.join(self.output_path, action.name, "direction_"+str(j))
-
-                # create the folder if it doesn't exist
-                if not os.path.exists(angle_folder):
-                    os.makedirs(angle_folder)
-                
-                # make all selected objects to rotate around the z axis
-                for obj in self.animatable_objects:
-                    # assign the action to the object
-                    obj.animation_data.action = action
-                
-                # make camera location vector to rotate around the z axis at the center of the world
-                rotate_camera_around_z_axis(self.camera, angle_delta)
-                # rotate it around the z axis at the center of the world
-                rotate_light_around_z_axis(self.light, angle_delta)
-                
-                # set output file path
-                scene.render.filepath = os.path.join(angle_folder, "frame_####")
-
-                # render animation.
-                bpy.ops.render.render(animation=True)
+
+        # dynamically set the last frame to render based on the action
+        frame_start, frame_end = action_frame_range(action, config)
+
+        frames_by_direction = {}
+        cache_keys = {}
+        for j in range(config.render_directions):
+            angle_folder = direction_folder(self.output_path, action.name, j)
+            key = direction_cache_key(scene_key, config, action, j, frame_start, frame_end, camera_origin, light_origin)
+            if config.output_use_cache:
+                cached_frames = cache.read_cached_frames(angle_folder, key, self.output_path)
+                if cached_frames is not None:
+                    self.report({'INFO'}, "Reusing direction " + str(j) + "...")
+                    frames_by_direction[j] = cached_frames
+                    continue
+                # drop frames of the outdated render, unless the journal can tell which ones are still good
+                if os.path.exists(angle_folder) and not config.output_resume:
+                    shutil.rmtree(angle_folder)
+            cache_keys[j] = key
+
+        # the held and sampled frames are the same for every direction, so they are planned once
+        originals = None
+        if cache_keys:
+            assign_action(self.animatable_objects, action)
+            with profile_stage("plan"):
+                originals = plan_frames(scene, frame_start, frame_end, self.animatable_objects, self.camera)
+        return frame_start, frame_end, frames_by_direction, cache_keys, originals
+
+    # Maps the frames of the finished actions to the shared palette, then finishes every action.
+    # finished holds (action name, frames by direction, cache keys, trim stage, mirrored frames) of every action.
+    def finish_actions(self, config, finished):
+        shared_palette = None
+        if config.output_palette and finished:
+            self.report({'INFO'}, "Mapping frames to a shared palette...")
+            frames = [frame for _, frames_by_direction, _, _, mirrored_frames in finished
+                      for frames_by in (frames_by_direction, mirrored_frames or {})
+                      for direction_frames in frames_by.values() for frame in direction_frames]
+            with profile_stage("palette"):
+                shared_palette = apply_shared_palette(self.output_path, frames, config)
+        for action_name, frames_by_direction, cache_keys, trim_stage, mirrored_frames in finished:
+            # frames trimmed in memory have their colors from before the palette
+            if config.output_palette:
+                trim_stage = None
+            with profile_stage("finish_action"):
+                self.finish_action(config, action_name, frames_by_direction, cache_keys, trim_stage, mirrored_frames,
+                                   shared_palette)
+
+    # Writes the caches of the rendered directions, packs the atlas once every direction is there and appends the
+    # frames to the frame archive, also those of the mirrored copy of the action.
+    # shared_palette is the one apply_shared_palette built for all finished actions.
+    def finish_action(self, config, action_name, frames_by_direction, cache_keys, trim_stage=None, mirrored_frames=None,
+                      shared_palette=None):
+        for j, key in cache_keys.items():
+            if config.output_use_cache and j in frames_by_direction:
+                frames = sorted(frames_by_direction[j], key=lambda frame: frame["frame"])
+                cache.write_cached_frames(direction_folder(self.output_path, action_name, j), key, frames)
+
+        self.pack_action(config, action_name, frames_by_direction, trim_stage, shared_palette)
+        if mirrored_frames is not None:
+            self.pack_action(config, action_name + MIRRORED_ACTION_SUFFIX, mirrored_frames, shared_palette=shared_palette)
+
+    # Packs the atlas of an action once every direction is there, writes its delta sequences and appends its frames
+    # to the frame archive.
+    def pack_action(self, config, action_name, frames_by_direction, trim_stage=None, shared_palette=None):
+        frames = []
+        for j in sorted(frames_by_direction):
+            frames += sorted(frames_by_direction[j], key=lambda frame: frame["frame"])
+
+        if config.output_atlas and all(j in frames_by_direction for j in range(config.render_directions)):
+            self.report({'INFO'}, "Packing atlas for " + action_name + "...")
+            trim_stage = pack_action_atlas(self.output_path, action_name, frames, config, trim_stage, shared_palette)
+        if config.output_delta:
+            with profile_stage("delta"):
+                sequence_size, file_size = write_delta_sequences(self.output_path, action_name, frames_by_direction, config)
+            self.report({'INFO'}, "Delta sequences of " + action_name + ": " + str(sequence_size) + " bytes for " +
+                        str(file_size) + " bytes of frames.")
+        if self.archive is not None:
+            archive_action_frames(self.archive, self.output_path, frames, trim_stage)
+
+    # Renders one flipped frame for real, once per render, and reports how much it differs.
+    def check_mirror(self, config, action, frames_by_direction, mirrored_frames, camera_origin, light_origin):
+        if not config.render_mirror_check or self.mirror_checked:
+            return
+        record = mirrored_check_record(config, frames_by_direction, mirrored_frames)
+        if record is None:
+            return
+        self.mirror_checked = True
+        difference = check_mirrored_frame(bpy.context.scene, action, record, self.output_path, self.animatable_objects,
+                                          self.camera, self.light, camera_origin, light_origin)
+        message = "Mirrored frame " + str(record["frame"]) + " of direction " + str(record["direction"]) + \
+            " differs from a real render by " + "%.4f" % difference + "."
+        if difference > config.render_mirror_tolerance:
+            self.report({'WARNING'}, message + " The character or action may not be symmetric.")
+        else:
+            self.report({'INFO'}, message)
+
+    def render_animations(self):
+        config = bpy.context.scene.sprite_frame_generator_config
+        scene = bpy.context.scene
+
+        # Every direction is placed from the original camera and light locations.
+        camera_origin = self.camera.location.copy()
+        light_origin = self.light.location.copy()
+
+        # the cache keys also tell the journaled frames of these settings apart
+        scene_key = scene_cache_key(scene, self.animatable_objects, self.camera, self.light)
+
+        # frames of every selected action in every direction, cached and held frames are dropped as they are found
+        actions = selected_actions(scene)
+        frame_counts = {}
+        for action in actions:
+            frame_start, frame_end = action_frame_range(action, config)
+            frame_counts[action.name] = len(range(frame_start, frame_end + 1, scene.frame_step))
+        start_profiling(config, self.output_path, sum(frame_counts.values()) * config.render_directions)
+        start_journal(self.output_path, compact=True)
+        session = start_render_session(scene)
+        self.archive = start_frame_archive(config, self.output_path)
+        # actions rendered but not finished, all of them wait for the shared palette
+        finished = []
+
+        try:
+            # Loop through the selected actions.
+            for action in actions:
+                self.report({'INFO'}, "Rendering action " + action.name + "...")
+
+                # Loop through all rotation angles, reusing cached directions.
+                frame_start, frame_end, frames_by_direction, cache_keys, originals = self.prepare_action(
+                    config, scene, action, scene_key, camera_origin, light_origin)
+                active_progress.skip(frame_counts[action.name] * len(frames_by_direction))
+
+                # keeps trimmed frames rendered in memory for the atlas
+                trim_stage = pipeline.TrimStage() if config.output_atlas and config.render_in_memory else None
+
+                # mirrored directions are flipped from the rendered ones
+                pending_directions = rendered_directions(config, sorted(cache_keys))
+                active_progress.skip(frame_counts[action.name] * (len(cache_keys) - len(pending_directions)))
+                with profile_stage("border"):
+                    borders = action_render_borders(scene, action, frame_start, frame_end, pending_directions,
+                                                    self.animatable_objects, self.camera, camera_origin)
+                if config.render_use_multiview and len(pending_directions) > 1:
+                    self.report({'INFO'}, "Rendering " + str(len(pending_directions)) + " directions as views... " + active_progress.status_line())
+                    done_frames = active_progress.done_frames
+                    frames_by_direction.update(render_directions_multiview(
+                        scene, action, pending_directions, frame_start, frame_end, self.output_path,
+                        self.animatable_objects, self.camera, self.light, camera_origin, light_origin, cache_keys,
+                        directions_border(borders, pending_directions), originals))
+                    active_progress.skip(frame_counts[action.name] * len(pending_directions) - (active_progress.done_frames - done_frames))
+                else:
+                    for j in pending_directions:
+                        self.report({'INFO'}, "Rendering direction " + str(j) + "... " + active_progress.status_line())
+                        done_frames = active_progress.done_frames
+                        frames_by_direction[j] = render_direction(scene, action, j, frame_start, frame_end, self.output_path,
+                                                                  self.animatable_objects, self.camera, self.light, camera_origin, light_origin,
+                                                                  trim_stage, cache_keys[j], directions_border(borders, [j]), originals)
+                        active_progress.skip(frame_counts[action.name] - (active_progress.done_frames - done_frames))
+
+                with profile_stage("mirror"):
+                    mirrored_frames = add_mirrored_frames(self.output_path, action.name, frames_by_direction, config)
+                with profile_stage("check_mirror"):
+                    self.check_mirror(config, action, frames_by_direction, mirrored_frames, camera_origin, light_origin)
+                finished.append((action.name, frames_by_direction, cache_keys, trim_stage, mirrored_frames))
+                if not config.output_palette:
+                    self.finish_actions(config, finished)
+                    finished = []
+            self.finish_actions(config, finished)
+            if self.archive is not None:
+                finish_frame_archive(config, self.output_path, self.archive)
+        finally:
+            # an archive that did not finish is not kept
+            if self.archive is not None:
+                self.archive.discard()
+            stop_journal()
+            stop_render_session(scene, session)
+            warmup = stop_profiling(config, self.output_path)
+            if warmup is not None:
+                self.report({'INFO'}, warmup + ".")
+            # put the camera and light back where they started
+            self.camera.location = camera_origin
+            reset_camera_rotation(self.camera)
+            self.light.location = light_origin
 
     def execute(self, context):
-        apply_render_settings(context)
+        previous_settings = apply_render_settings(context)
+        try:
+            return self.start(context)
+        finally:
+            # workers render the scene copy saved on start, so the settings can go back right away
+            restore_render_settings(previous_settings)
+
+    def start(self, context):
         # notify the user that the rendering has started.
         self.report({'INFO'}, "Rendering started.")
 
         self.output_path = bpy.path.abspath(context.scene.sprite_frame_generator_config.output_path)
+        self.mirror_checked = False
         if not os.path.exists(self.output_path):
             os.makedirs(self.output_path)
         
         # get all objects with animation data and set them to self.animatable_objects
-        self.animatable_objects = []
-        for obj in bpy.data.objects:
-            # obj type must be ARMATURE
-            if obj.type != 'ARMATURE':
-                continue
-
-            # obj must have animation data, otherwise create one
-            if not obj.animation_data:
-                obj.animation_data_create()
-
-            # add to animatable objects
-            if obj.animation_data:
-                self.animatable_objects.append(obj)
-        
+        self.animatable_objects = find_animatable_objects()
+
         # Cancel if no action is selected.
-        empty_action_list = True
-        for i in range(len(bpy.data.actions)):
-            if context.scene.sprite_frame_generator_config.action_list[i]:
-                empty_action_list = False
-                break
-        if empty_action_list:
+        if not selected_actions(context.scene):
             self.report({'ERROR'}, "No action is selected.")
             return {'CANCELLED'}
 
-        self.camera = bpy.data.objects['Camera']
+        if context.scene.sprite_frame_generator_config.render_in_memory:
+            error = in_memory_color_management_error(context.scene)
+            if error:
+                self.report({'ERROR'}, error)
+                return {'CANCELLED'}
+
+        error = output_format_error(context.scene.sprite_frame_generator_config)
+        if error:
+            self.report({'ERROR'}, error)
+            return {'CANCELLED'}
+
+        # the workers and batch jobs look them up by the same names
+        self.camera = bpy.data.objects.get('Camera')
 
         # if camera is not found, cancel the render
         if self.camera is None:
-            self.report({'ERROR'}, "Camera not found.")
+            self.report({'ERROR'}, "Camera not found, the camera object has to be named Camera.")
             return {'CANCELLED'}
-        
-        self.light = bpy.data.objects['Light']
+
+        self.light = bpy.data.objects.get('Light')
 
         # if light is not found, cancel the render
         if self.light is None:
-            self.report({'ERROR'}, "Light not found.")
+            self.report({'ERROR'}, "Light not found, the light object has to be named Light.")
             return {'CANCELLED'}
 
-        if self.run_in_background:
-            self.start_timer(context)
-            return {'RUNNING_MODAL'}
+        if context.scene.sprite_frame_generator_config.render_use_workers:
+            if worker_status:
+                self.report({'ERROR'}, "Workers are already rendering.")
+                return {'CANCELLED'}
+            return self.start_workers(context)
 
         self.render_animations()
         return {'FINISHED'}
@@ -448,6 +2526,22 @@ class SPRITEFRAMEGENERATOR_OT_Render(bpy.types.Operator):
 # Panels
 ################
 
+# Lists the actions with their selection and tags. Only the visible rows are drawn, so thousands of actions stay fast.
+class SPRITEFRAMEGENERATOR_UL_Actions(bpy.types.UIList):
+    def draw_item(self, context, layout, data, item, icon, active_data, active_property, index=0, flt_flag=0):
+        row = layout.row(align=True)
+        row.prop(item, "selected", text="")
+        row.label(text=item.name, icon='ACTION')
+        row.prop(item, "tags", text="", emboss=False, icon='BOOKMARKS')
+
+    def filter_items(self, context, data, property):
+        items = getattr(data, property)
+        # the filter field of the list itself works like the one above it
+        filter_text = data.action_filter + " " + self.filter_name
+        flags = [self.bitflag_filter_item if action_matches_filter(item.name, item.tags, filter_text) else 0 for item in items]
+        order = bpy.types.UI_UL_list.sort_items_by_name(items, "name") if self.use_filter_sort_alpha else []
+        return flags, order
+
 # The main panel to control how the sprite frames are generated.
 #
 # Section 1: Render Settings
@@ -492,6 +2586,20 @@ class SPRITEFRAMEGENERATOR_PT_MainPanel(bpy.types.Panel):
             box.row().prop(config, "render_resolution", text="Resolution")
             box.row().prop(config, "render_directions", text="Directions")
             box.row().prop(config, "render_fps", text="FPS")
+            box.row().prop(config, "render_use_workers", text="Render on Background Workers")
+            if config.render_use_workers:
+                box.row().prop(config, "render_worker_count", text="Workers")
+            box.row().prop(config, "render_in_memory", text="Render in Memory")
+            box.row().prop(config, "render_persistent_data", text="Keep Render Data")
+            box.row().prop(config, "render_use_multiview", text="Render Directions as Views")
+            box.row().prop(config, "render_auto_border", text="Auto Border")
+            if config.render_auto_border != 'OFF':
+                box.row().prop(config, "render_border_padding", text="Padding")
+            box.row().prop(config, "render_mirror", text="Mirror")
+            if config.render_mirror != 'OFF':
+                box.row().prop(config, "render_mirror_check", text="Check Mirror")
+                if config.render_mirror_check:
+                    box.row().prop(config, "render_mirror_tolerance", text="Tolerance")
             box.row().operator("sprite_frame_generator.apply_render_settings", text="Apply Render Settings")
         
         # Section 2: Animation Settings
@@ -503,6 +2611,11 @@ class SPRITEFRAMEGENERATOR_PT_MainPanel(bpy.types.Panel):
         if config.animation_expanded:
             box.row().prop(config, "animation_frame_step", text="Frame Step")
             box.row().prop(config, "animation_start_frame", text="Start Frame")
+            box.row().prop(config, "animation_skip_held_frames", text="Skip Held Frames")
+            box.row().prop(config, "animation_sampling", text="Sampling")
+            if config.animation_sampling == 'ADAPTIVE':
+                box.row().prop(config, "animation_frame_budget", text="Frame Budget")
+                box.row().prop(config, "animation_max_pose_error", text="Max Pose Error")
 
         # Section 3: Action List
         box = layout.box()
@@ -512,14 +2625,14 @@ class SPRITEFRAMEGENERATOR_PT_MainPanel(bpy.types.Panel):
 
         if config.action_list_expanded:
             # if actions is None or empty, show a message.
-            if len(config.action_list) == 0:
+            if len(config.actions) == 0:
                 box.row().label(text="No actions found.")
             else:
-                all_actions = bpy.data.actions
-                # for each action in the action map, add a checkbox.
-                for i in range(len(all_actions)):
-                    box.row().prop(config, "action_list",
-                                   index=i, text=all_actions[i].name)
+                row = box.row(align=True)
+                row.prop(config, "action_filter", text="", icon='VIEWZOOM')
+                row.operator("sprite_frame_generator.select_actions", text="", icon='CHECKBOX_HLT').select = True
+                row.operator("sprite_frame_generator.select_actions", text="", icon='CHECKBOX_DEHLT').select = False
+                box.template_list("SPRITEFRAMEGENERATOR_UL_Actions", "", config, "actions", config, "actions_index", rows=8)
         
         # Section 4: Composition Settings
         box = layout.box()
@@ -528,9 +2641,13 @@ class SPRITEFRAMEGENERATOR_PT_MainPanel(bpy.types.Panel):
                           icon="TRIA_DOWN" if config.composite_expanded else "TRIA_RIGHT", icon_only=True, emboss=False, text="Pixel Art Settings")
         
         if config.composite_expanded:
+            box.row().prop(config, "composite_engine", text="Engine")
             box.row().prop(config, "composite_pixel_size", text="Pixel Size")
             box.row().prop(config, "composite_color_palette_size", text="Color Palette Size")
-            box.row().operator("sprite_frame_generator.confirm_composite_nodes", text="Apply Pixel Art")
+            if config.composite_engine == 'NATIVE':
+                box.row().prop(config, "composite_upscale", text="Upscale Frames")
+            if config.composite_engine == 'NODES':
+                box.row().operator("sprite_frame_generator.confirm_composite_nodes", text="Apply Pixel Art")
 
         # Section 5: Output Settings
         box = layout.box()
@@ -540,10 +2657,45 @@ class SPRITEFRAMEGENERATOR_PT_MainPanel(bpy.types.Panel):
 
         if config.output_expanded:
             box.row().prop(config, "output_path", text="Output Folder")
+            box.row().prop(config, "output_use_cache", text="Reuse Unchanged Frames")
+            box.row().prop(config, "output_resume", text="Resume Interrupted Renders")
+            box.row().prop(config, "output_deduplicate", text="Deduplicate Frames")
+            box.row().prop(config, "output_format", text="Format")
+            if config.output_format != 'BLENDER':
+                box.row().prop(config, "output_compression", text="Compression")
+                box.row().prop(config, "output_encoder_threads", text="Threads")
+            row = box.row()
+            row.prop(config, "output_pass_normal", text="Normal")
+            row.prop(config, "output_pass_depth", text="Depth")
+            row.prop(config, "output_pass_mask", text="Mask")
+            row.prop(config, "output_pass_index", text="Index")
+            if config.output_pass_depth:
+                box.row().prop(config, "output_depth_range", text="Depth Range")
+            box.row().prop(config, "output_palette", text="Shared Palette")
+            if config.output_palette:
+                box.row().prop(config, "output_palette_size", text="Colors")
+            box.row().prop(config, "output_delta", text="Delta Sequences")
+            if config.output_delta:
+                box.row().prop(config, "output_delta_keyframe_interval", text="Keyframe Interval")
+            box.row().prop(config, "output_archive", text="Frame Archive")
+            box.row().prop(config, "output_profile", text="Write Profile")
+            if config.output_profile:
+                box.row().prop(config, "output_profile_chrome", text="Chrome Trace")
+            box.row().prop(config, "output_atlas", text="Pack Atlas")
+            if config.output_atlas:
+                box.row().prop(config, "output_atlas_max_size", text="Max Size")
+                box.row().prop(config, "output_atlas_padding", text="Padding")
 
         # Section 6: Render Button
         layout.row().operator("sprite_frame_generator.render_sprite_frames", text="Render")
 
+        # Section 7: Progress of background workers
+        if worker_status:
+            box = layout.box()
+            for line in worker_status:
+                box.row().label(text=line)
+            box.row().label(text="Press ESC to stop.")
+
 ################
 # Registration
 ################
@@ -551,9 +2703,12 @@ class SPRITEFRAMEGENERATOR_PT_MainPanel(bpy.types.Panel):
 classes = (
     SPRITEFRAMEGENERATOR_OT_ConfirmCompositeNodes,
     SPRITEFRAMEGENERATOR_OT_CompositeNodes,
+    SPRITEFRAMEGENERATOR_OT_SelectActions,
     SPRITEFRAMEGENERATOR_OT_Render,
     SPRITEFRAMEGENERATOR_OT_RenderSettings,
+    SPRITEFRAMEGENERATOR_HT_ActionItem,
     SPRITEFRAMEGENERATOR_HT_Config,
+    SPRITEFRAMEGENERATOR_UL_Actions,
     SPRITEFRAMEGENERATOR_PT_MainPanel,
 )
 
@@ -565,9 +2720,14 @@ def register():
     # Add config object to the scene.
     bpy.types.Scene.sprite_frame_generator_config = bpy.props.PointerProperty(
         type=SPRITEFRAMEGENERATOR_HT_Config)
+    # keep the action list in step with the actions of the file
+    bpy.app.handlers.depsgraph_update_post.append(sync_action_registry_on_update)
+    bpy.app.handlers.load_post.append(sync_action_registry_on_load)
 
 
 def unregister():
+    bpy.app.handlers.depsgraph_update_post.remove(sync_action_registry_on_update)
+    bpy.app.handlers.load_post.remove(sync_action_registry_on_load)
     # Delete config object from the scene.
     del bpy.types.Scene.sprite_frame_generator_config
     # for each class, unregister it using bpy.utils.unregister_class
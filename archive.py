@@ -0,0 +1,263 @@
+# (c) 2023 Pururum LLC
+# This code is licensed under MIT license (see LICENSE for details)
+
+# Single file frame archives.
+#
+# Instead of one file per frame, the encoded frame files of a job are appended
+# to one container file, followed by an index in a footer:
+#
+#   header  "SFGPACK\0", version (uint32)
+#   data    the bytes of every frame file, back to back
+#   index   JSON, {"version": 1, "frames": [entry, ...]}
+#   footer  index offset (uint64), index size (uint64), "SFGINDEX"
+#
+# Every index entry is the frame record (action, direction, frame, path, ...)
+# plus "data_offset" and "data_size" of its bytes, the "format" of the file and,
+# when known, the "trim" rect (x, y, width, height) of its opaque pixels.
+# Frames with pass images (see the "passes" of a frame record) also have the
+# byte ranges of those files in "pass_data", {name: [offset, size]}.
+# Duplicate frames point to the bytes of the frame they repeat.
+#
+# The reader memory maps the archive, so frames are sliced out without copies.
+# This module only uses the python standard library, so it can be copied into
+# other asset pipelines as is. It also runs as a script:
+#
+#   python archive.py frames.sfgpack                  lists the frames
+#   python archive.py frames.sfgpack --extract out    writes the frame files
+# Nothing in this module imports bpy.
+
+import argparse
+import json
+import mmap
+import os
+import shutil
+import struct
+import sys
+
+ARCHIVE_FILE = "frames.sfgpack"
+ARCHIVE_VERSION = 1
+
+HEADER = struct.Struct("<8sI")
+HEADER_MAGIC = b"SFGPACK\0"
+FOOTER = struct.Struct("<QQ8s")
+FOOTER_MAGIC = b"SFGINDEX"
+
+class ArchiveError(Exception):
+    """Raised when a file is not a complete frame archive."""
+    pass
+
+def frame_format(path):
+    return os.path.splitext(path)[1][1:].upper()
+
+def read_index(f, file_size):
+    """Return (index offset, index) of an open archive file."""
+    if file_size < HEADER.size + FOOTER.size:
+        raise ArchiveError("File is too small to be a frame archive.")
+    f.seek(0)
+    magic, version = HEADER.unpack(f.read(HEADER.size))
+    if magic != HEADER_MAGIC:
+        raise ArchiveError("File is not a frame archive.")
+    if version > ARCHIVE_VERSION:
+        raise ArchiveError("Frame archive version %d is not supported." % version)
+    f.seek(file_size - FOOTER.size)
+    index_offset, index_size, magic = FOOTER.unpack(f.read(FOOTER.size))
+    # a missing footer means the writer never finished
+    if magic != FOOTER_MAGIC or index_offset + index_size + FOOTER.size != file_size:
+        raise ArchiveError("Frame archive has no index, it was not closed.")
+    f.seek(index_offset)
+    return index_offset, json.loads(f.read(index_size).decode("utf-8"))
+
+class ArchiveWriter:
+    """Appends frame files to an archive. The index is written on close."""
+
+    def __init__(self, path, append=False):
+        self.path = path
+        # (action, direction, frame) -> index entry, in the order the frames were added
+        self.by_frame = {}
+        if append and os.path.exists(path):
+            self.file = open(path, "r+b")
+            index_offset, index = read_index(self.file, os.path.getsize(path))
+            for entry in index["frames"]:
+                self.by_frame[(entry["action"], entry["direction"], entry["frame"])] = entry
+            # new frames overwrite the old index, it is written again on close
+            self.file.seek(index_offset)
+            self.file.truncate()
+        else:
+            self.file = open(path, "wb")
+            self.file.write(HEADER.pack(HEADER_MAGIC, ARCHIVE_VERSION))
+
+    def _append(self, source):
+        offset = self.file.tell()
+        shutil.copyfileobj(source, self.file, 1 << 20)
+        return [offset, self.file.tell() - offset]
+
+    def add(self, record, data=None, source=None, trim=None, pass_sources=None):
+        """Append the bytes of a frame, either from data or streamed from the file object source.
+
+        pass_sources maps the names of the frame's passes to file objects to stream their bytes from.
+        Records with a duplicate_of frame store no bytes of their own.
+        """
+        entry = dict(record)
+        if "duplicate_of" in record:
+            original = self.by_frame.get((record["action"], record["direction"], record["duplicate_of"]))
+            if original is None:
+                raise ArchiveError("Frame %d repeats frame %d, which is not in the archive." % (record["frame"], record["duplicate_of"]))
+            entry["data_offset"] = original["data_offset"]
+            entry["data_size"] = original["data_size"]
+            if "pass_data" in original:
+                entry["pass_data"] = original["pass_data"]
+            trim = original.get("trim")
+        else:
+            entry["data_offset"] = self.file.tell()
+            if data is not None:
+                self.file.write(data)
+            else:
+                shutil.copyfileobj(source, self.file, 1 << 20)
+            entry["data_size"] = self.file.tell() - entry["data_offset"]
+            if pass_sources:
+                entry["pass_data"] = {name: self._append(pass_source) for name, pass_source in pass_sources.items()}
+        entry["format"] = frame_format(record["path"])
+        if trim is not None:
+            entry["trim"] = [int(value) for value in trim]
+        # a frame added again replaces its old entry, its old bytes stay unused
+        key = (record["action"], record["direction"], record["frame"])
+        self.by_frame.pop(key, None)
+        self.by_frame[key] = entry
+
+    def add_file(self, record, path, trim=None, pass_paths=None):
+        """Append a frame file, and the files of its passes from pass_paths, {name: path}."""
+        if "duplicate_of" in record:
+            self.add(record, trim=trim)
+            return
+        pass_sources = {}
+        try:
+            for name, pass_path in (pass_paths or {}).items():
+                pass_sources[name] = open(pass_path, "rb")
+            with open(path, "rb") as f:
+                self.add(record, source=f, trim=trim, pass_sources=pass_sources)
+        finally:
+            for pass_source in pass_sources.values():
+                pass_source.close()
+
+    def close(self):
+        if self.file is None:
+            return
+        index_offset = self.file.tell()
+        index = json.dumps({"version": ARCHIVE_VERSION, "frames": list(self.by_frame.values())}).encode("utf-8")
+        self.file.write(index)
+        self.file.write(FOOTER.pack(index_offset, len(index), FOOTER_MAGIC))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        self.file = None
+
+    def discard(self):
+        """Close an unfinished archive without an index and delete it."""
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class ArchiveReader:
+    """Random access to the frames of an archive through a memory map."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        try:
+            _, index = read_index(self.file, os.path.getsize(path))
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self.file.close()
+            raise
+        self.entries = index["frames"]
+        self.by_frame = {(entry["action"], entry["direction"], entry["frame"]): entry for entry in self.entries}
+
+    def actions(self):
+        return sorted({entry["action"] for entry in self.entries})
+
+    def frames(self, action=None, direction=None):
+        """Return the index entries, optionally of one action and direction, in frame order."""
+        entries = [entry for entry in self.entries
+                   if (action is None or entry["action"] == action) and (direction is None or entry["direction"] == direction)]
+        return sorted(entries, key=lambda entry: (entry["action"], entry["direction"], entry["frame"]))
+
+    def entry(self, action, direction, frame):
+        return self.by_frame[(action, direction, frame)]
+
+    def read(self, action, direction, frame, pass_name=None):
+        """Return the file bytes of a frame, or of one of its passes, as a memoryview into the map.
+
+        Release the view before closing the reader, a map with views cannot be closed.
+        """
+        entry = self.entry(action, direction, frame)
+        if pass_name is None:
+            offset, size = entry["data_offset"], entry["data_size"]
+        else:
+            offset, size = entry["pass_data"][pass_name]
+        return memoryview(self.map)[offset:offset + size]
+
+    def extract(self, folder, action=None, direction=None):
+        """Write the frame files to their paths under folder, the layout of loose frame output.
+
+        Duplicate frames are not written, their records point to the file they repeat.
+        Returns the number of files written.
+        """
+        count = 0
+        for entry in self.frames(action, direction):
+            if "duplicate_of" in entry:
+                continue
+            files = [(entry["path"], entry["data_offset"], entry["data_size"])]
+            for name, (offset, size) in entry.get("pass_data", {}).items():
+                files.append((entry["passes"][name], offset, size))
+            for relative_path, offset, size in files:
+                path = os.path.join(folder, relative_path)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "wb") as f:
+                    f.write(self.map[offset:offset + size])
+                count += 1
+        return count
+
+    def close(self):
+        if self.file is None:
+            return
+        self.map.close()
+        self.file.close()
+        self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="archive.py", description="List or extract the frames of a frame archive.")
+    parser.add_argument("archive", help="Path of the frame archive.")
+    parser.add_argument("--extract", metavar="FOLDER", default=None, help="Write the frame files to FOLDER.")
+    parser.add_argument("--action", default=None, help="Only list or extract the frames of this action.")
+    args = parser.parse_args(argv)
+
+    with ArchiveReader(args.archive) as reader:
+        if args.extract is not None:
+            count = reader.extract(args.extract, args.action)
+            print("Extracted %d frame files to %s." % (count, args.extract))
+            return
+        for entry in reader.frames(args.action):
+            note = " (repeats frame %d)" % entry["duplicate_of"] if "duplicate_of" in entry else ""
+            print("%s direction %d frame %d: %s, %d bytes%s" % (
+                entry["action"], entry["direction"], entry["frame"], entry["format"], entry["data_size"], note))
+
+if __name__ == "__main__":
+    try:
+        main()
+    except (ArchiveError, OSError) as e:
+        print("Error: " + str(e), file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,202 @@
+# (c) 2023 Pururum LLC
+# This code is licensed under MIT license (see LICENSE for details)
+
+# Alpha trimming and atlas packing for rendered sprite frames.
+#
+# Frames are numpy arrays of shape (height, width, 4) with rows stored top to
+# bottom. Nothing in this module imports bpy.
+
+import numpy
+
+################
+# Trimming
+################
+
+def trim_bounds(pixels, alpha_threshold=0.0):
+    """Return (x, y, width, height) of the pixels with alpha above the threshold.
+
+    Fully transparent frames keep a single pixel, so every frame still has a rect.
+    """
+    opaque = pixels[:, :, 3] > alpha_threshold
+    rows = numpy.flatnonzero(opaque.any(axis=1))
+    if rows.size == 0:
+        return (0, 0, 1, 1)
+    columns = numpy.flatnonzero(opaque.any(axis=0))
+    return (int(columns[0]), int(rows[0]), int(columns[-1] - columns[0] + 1), int(rows[-1] - rows[0] + 1))
+
+def crop(pixels, bounds):
+    x, y, width, height = bounds
+    return pixels[y:y + height, x:x + width]
+
+################
+# Packing
+################
+
+class MaxRectsBin:
+    """A MaxRects bin packer using the best short side fit rule."""
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.free_rects = [(0, 0, width, height)]
+
+    def insert(self, width, height):
+        """Place a rect and return its (x, y), or None if it does not fit."""
+        best = None
+        best_score = None
+        for free_x, free_y, free_width, free_height in self.free_rects:
+            if width > free_width or height > free_height:
+                continue
+            leftover = (min(free_width - width, free_height - height), max(free_width - width, free_height - height))
+            # prefer tight fits, then the top left corner, so results do not depend on dict or set order
+            score = leftover + (free_y, free_x)
+            if best_score is None or score < best_score:
+                best = (free_x, free_y, width, height)
+                best_score = score
+
+        if best is None:
+            return None
+
+        self._split_free_rects(best)
+        self._prune_free_rects()
+        return best[0], best[1]
+
+    def _split_free_rects(self, used):
+        used_x, used_y, used_width, used_height = used
+        split_rects = []
+        for rect in self.free_rects:
+            x, y, width, height = rect
+            # keep free rects the used rect does not touch
+            if used_x >= x + width or used_x + used_width <= x or used_y >= y + height or used_y + used_height <= y:
+                split_rects.append(rect)
+                continue
+            # the free space left of, right of, above and below the used rect
+            if used_x > x:
+                split_rects.append((x, y, used_x - x, height))
+            if used_x + used_width < x + width:
+                split_rects.append((used_x + used_width, y, x + width - used_x - used_width, height))
+            if used_y > y:
+                split_rects.append((x, y, width, used_y - y))
+            if used_y + used_height < y + height:
+                split_rects.append((x, used_y + used_height, width, y + height - used_y - used_height))
+        self.free_rects = split_rects
+
+    def _prune_free_rects(self):
+        # drop free rects that are inside another free rect
+        rects = sorted(set(self.free_rects), key=lambda rect: (-rect[2] * rect[3], rect))
+        kept = []
+        for rect in rects:
+            x, y, width, height = rect
+            if not any(x >= kx and y >= ky and x + width <= kx + kwidth and y + height <= ky + kheight
+                       for kx, ky, kwidth, kheight in kept):
+                kept.append(rect)
+        self.free_rects = kept
+
+def _power_of_two_sizes(max_size):
+    sizes = []
+    size = 1
+    while size <= max_size:
+        sizes.append(size)
+        size *= 2
+    # smallest area first, square before wide before tall
+    return sorted(((width, height) for width in sizes for height in sizes),
+                  key=lambda size: (size[0] * size[1], abs(size[0] - size[1]), -size[0]))
+
+def _pack_into(sizes, order, width, height, padding):
+    packer = MaxRectsBin(width, height)
+    positions = {}
+    for index in order:
+        rect_width, rect_height = sizes[index]
+        position = packer.insert(rect_width + padding, rect_height + padding)
+        if position is None:
+            break
+        positions[index] = position
+    return positions
+
+def pack_rects(sizes, max_size=2048, padding=1):
+    """Pack (width, height) sizes into as few power of two pages as possible.
+
+    Returns a list of pages as (width, height, {index: (x, y)}). Every page is
+    the smallest power of two size its rects fit in.
+    """
+    for width, height in sizes:
+        if width + padding > max_size or height + padding > max_size:
+            raise ValueError("A %dx%d frame does not fit in a %d atlas." % (width, height, max_size))
+
+    # large rects first, the order is fixed for equal sizes
+    remaining = sorted(range(len(sizes)), key=lambda index: (-max(sizes[index]), -sizes[index][0] * sizes[index][1], index))
+    candidates = _power_of_two_sizes(max_size)
+    pages = []
+    while remaining:
+        area = sum((sizes[index][0] + padding) * (sizes[index][1] + padding) for index in remaining)
+        positions = None
+        for width, height in candidates:
+            if width * height < area:
+                continue
+            attempt = _pack_into(sizes, remaining, width, height, padding)
+            if len(attempt) == len(remaining):
+                positions = attempt
+                break
+
+        if positions is None:
+            # fill a full size page and carry the rest over to the next one
+            width = height = candidates[-1][0]
+            positions = _pack_into(sizes, remaining, width, height, padding)
+
+        pages.append((width, height, positions))
+        remaining = [index for index in remaining if index not in positions]
+    return pages
+
+################
+# Atlases
+################
+
+def build_atlases(frames, images, max_size=2048, padding=1, alpha_threshold=0.0):
+    """Trim the images and pack them into atlas pages.
+
+    frames is a list of dicts describing the source of every image, for example
+    {"action": ..., "direction": ..., "frame": ...}. Returns the atlas pixel
+    arrays and metadata with the rect, trim offset and source size of every frame.
+    """
+    bounds = [trim_bounds(image, alpha_threshold) for image in images]
+    crops = [crop(image, image_bounds) for image, image_bounds in zip(images, bounds)]
+    source_sizes = [(image.shape[1], image.shape[0]) for image in images]
+    return pack_trimmed(frames, crops, bounds, source_sizes, max_size, padding)
+
+def pack_trimmed(frames, crops, bounds, source_sizes, max_size=2048, padding=1):
+    """Pack already trimmed images, see build_atlases."""
+    sizes = [(crop_pixels.shape[1], crop_pixels.shape[0]) for crop_pixels in crops]
+    pages = pack_rects(sizes, max_size, padding)
+
+    atlases = []
+    metadata = {"atlases": [], "frames": [None] * len(frames)}
+    dtype = crops[0].dtype if crops else numpy.float32
+    for page_index, (width, height, positions) in enumerate(pages):
+        page = numpy.zeros((height, width, 4), dtype=dtype)
+        for index, (x, y) in sorted(positions.items()):
+            trim_width, trim_height = sizes[index]
+            page[y:y + trim_height, x:x + trim_width] = crops[index]
+
+            entry = dict(frames[index])
+            entry["atlas"] = page_index
+            entry["rect"] = [x, y, trim_width, trim_height]
+            entry["trim"] = [bounds[index][0], bounds[index][1]]
+            entry["source_size"] = list(source_sizes[index])
+            metadata["frames"][index] = entry
+
+        atlases.append(page)
+        metadata["atlases"].append({"size": [width, height]})
+    return atlases, metadata
+
+def fill_pages(metadata, crops):
+    """Lay out other images of packed frames, like their normal maps, on pages of their own.
+
+    crops are in the order of metadata["frames"] and are placed at the same rects,
+    so every page lines up with its atlas page.
+    """
+    dtype = crops[0].dtype if crops else numpy.float32
+    pages = [numpy.zeros((height, width, 4), dtype=dtype) for width, height in (page["size"] for page in metadata["atlases"])]
+    for entry, crop_pixels in zip(metadata["frames"], crops):
+        x, y, width, height = entry["rect"]
+        pages[entry["atlas"]][y:y + height, x:x + width] = crop_pixels
+    return pages
@@ -0,0 +1,487 @@
+# (c) 2023 Pururum LLC
+# This code is licensed under MIT license (see LICENSE for details)
+
+# Headless batch rendering.
+#
+# Usage:
+#
+#   blender -b character.blend -P batch.py -- --job job.json
+#
+# The job file holds the same settings as the addon panel (see jobs.py for the
+# keys). The work is split into (action, direction, frame range) units which are
+# shared between worker Blender processes, each pinned to its own slice of cores.
+# When every worker is done, their manifests are merged into output/manifest.json.
+# Jobs with characters plan every character with its own settings and share the
+# units of all of them between the workers, which switch characters by hiding
+# the others, so the blend file is loaded once for the whole roster. Every
+# character is finished into its own folder of the output.
+
+import argparse
+import contextlib
+import importlib
+import importlib.util
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import bpy
+
+PACKAGE_NAME = "sprite_frame_generator"
+
+# Folder in the output path where shard files are kept while the batch runs.
+STAGING_FOLDER = ".batch"
+
+def load_addon():
+    """Import the addon next to this script as a package and make sure it is registered."""
+    addon_dir = os.path.dirname(os.path.abspath(__file__))
+    if PACKAGE_NAME not in sys.modules:
+        spec = importlib.util.spec_from_file_location(
+            PACKAGE_NAME, os.path.join(addon_dir, "__init__.py"), submodule_search_locations=[addon_dir])
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[PACKAGE_NAME] = module
+        spec.loader.exec_module(module)
+
+    addon = sys.modules[PACKAGE_NAME]
+    # the addon may already be enabled in the user's preferences
+    if not hasattr(bpy.types.Scene, "sprite_frame_generator_config"):
+        addon.register()
+    return addon, importlib.import_module(PACKAGE_NAME + ".jobs")
+
+def parse_args():
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    parser = argparse.ArgumentParser(prog="blender -b file.blend -P batch.py --")
+    parser.add_argument("--job", required=True, help="JSON or TOML job file.")
+    parser.add_argument("--workers", type=int, default=None, help="Overrides the number of workers in the job file.")
+    parser.add_argument("--shard", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def log(message):
+    print("[sprite_frame_generator] " + message, flush=True)
+
+################
+# Worker
+################
+
+def prepare_scene(addon, jobs, job):
+    """Apply the job to the scene and return what rendering a unit needs."""
+    scene = bpy.context.scene
+    config = scene.sprite_frame_generator_config
+    jobs.apply_job_to_config(job, config)
+    addon.apply_render_settings(bpy.context)
+
+    # every process traces to its own file, the coordinator merges them
+    profile_path = bpy.path.abspath(config.output_path)
+    addon.start_profiling(config, profile_path)
+    # the renderer is set up once for every unit this process renders, of every character
+    session = addon.start_render_session(scene)
+    state = {"scene": scene, "session": session, "profile_path": profile_path, "character_jobs": jobs.character_jobs(job),
+             "camera": bpy.data.objects[job["camera"]], "light": bpy.data.objects[job["light"]],
+             "character": None, "shown": None}
+    select_character(addon, jobs, state, 0)
+    return state
+
+def select_character(addon, jobs, state, index):
+    """Switch the scene to the character of a unit, see jobs.character_jobs.
+
+    Only the settings, the visible characters and the camera change, so loaded
+    assets and the render data of the objects all characters share are kept.
+    """
+    if state["character"] == index:
+        return
+    scene = state["scene"]
+    config = scene.sprite_frame_generator_config
+    camera = state["camera"]
+    if state["shown"] is not None:
+        addon.hide_character(state["shown"])
+        state["shown"] = None
+    addon.stop_journal()
+
+    job = state["character_jobs"][index]
+    jobs.apply_job_to_config(job, config)
+    addon.apply_render_settings(bpy.context)
+    objects = None
+    if job["character"] is not None:
+        log("Rendering character " + job["character"]["name"] + ".")
+        state["shown"] = addon.show_character(job["characters"], job["character_index"], camera)
+        objects = addon.character_objects(job["character"])
+    state["character"] = index
+    state["output_path"] = bpy.path.abspath(config.output_path)
+    addon.start_journal(state["output_path"])
+    state["animatable_objects"] = addon.find_animatable_objects(objects)
+    state["camera_origin"] = camera.location.copy()
+    state["light_origin"] = state["light"].location.copy()
+
+def finish_scene(addon, state):
+    """Undo prepare_scene and log the render warm-up of this process."""
+    if state["shown"] is not None:
+        addon.hide_character(state["shown"])
+    addon.stop_journal()
+    addon.stop_render_session(state["scene"], state["session"])
+    warmup = addon.stop_profiling(state["scene"].sprite_frame_generator_config, state["profile_path"], merge=False)
+    if warmup is not None:
+        log(warmup + ".")
+
+def render_unit(addon, jobs, state, unit):
+    select_character(addon, jobs, state, unit.get("character", 0))
+    return addon.render_unit(state["scene"], unit, state["output_path"], state["animatable_objects"],
+                             state["camera"], state["light"], state["camera_origin"], state["light_origin"])
+
+def render_shard(addon, jobs, job, units, manifest_path):
+    """Render the given work units in this process and write their manifest.
+
+    Frames of units of a character are tagged with its index, see jobs.split_characters.
+    """
+    state = prepare_scene(addon, jobs, job)
+
+    frames = []
+    for unit in units:
+        start_time = time.time()
+        unit_frames = render_unit(addon, jobs, state, unit)
+        if "character" in unit:
+            for frame in unit_frames:
+                frame["character"] = unit["character"]
+        frames.extend(unit_frames)
+        log("Rendered %s directions %s frames %d-%d in %.1fs." % (
+            unit["action"], unit["directions"], unit["frame_start"], unit["frame_end"], time.time() - start_time))
+
+    jobs.write_json(manifest_path, {"frames": frames})
+    finish_scene(addon, state)
+
+def serve(addon, jobs, job):
+    """Render the units sent on stdin one at a time and report on stdout, see workers.py."""
+    workers = importlib.import_module(PACKAGE_NAME + ".workers")
+    state = prepare_scene(addon, jobs, job)
+
+    def send(data):
+        sys.stdout.write(workers.encode_message(data))
+        sys.stdout.flush()
+
+    def on_render_post(scene, *args):
+        send({"event": "frame", "frame": scene.frame_current})
+    bpy.app.handlers.render_post.append(on_render_post)
+
+    send({"event": "ready"})
+    for line in sys.stdin:
+        command = json.loads(line)
+        if command.get("command") != "render":
+            break
+
+        start_time = time.time()
+        try:
+            frames = render_unit(addon, jobs, state, command["unit"])
+        except Exception as e:
+            send({"event": "error", "message": str(e)})
+            continue
+        send({"event": "done", "frames": frames, "seconds": time.time() - start_time})
+    finish_scene(addon, state)
+
+################
+# Coordinator
+################
+
+def selected_actions(addon, job):
+    if job["actions"] is not None:
+        missing = [name for name in job["actions"] if name not in bpy.data.actions]
+        if missing:
+            raise RuntimeError("Actions not found: " + ", ".join(missing))
+        return [bpy.data.actions[name] for name in job["actions"]]
+
+    return addon.selected_actions(bpy.context.scene)
+
+def start_worker(job_path, shard_path, cores):
+    args = [bpy.app.binary_path, "-b", bpy.data.filepath, "-t", str(len(cores)),
+            "-P", os.path.abspath(__file__), "--", "--job", job_path, "--shard", shard_path]
+
+    preexec_fn = None
+    if hasattr(os, "sched_setaffinity"):
+        def preexec_fn():
+            os.sched_setaffinity(0, cores)
+    return subprocess.Popen(args, preexec_fn=preexec_fn)
+
+@contextlib.contextmanager
+def character_shown(addon, jobs, job, camera):
+    """Apply the settings of a character job, see jobs.character_jobs, and show only its character while the block runs."""
+    scene = bpy.context.scene
+    jobs.apply_job_to_config(job, scene.sprite_frame_generator_config)
+    addon.apply_render_settings(bpy.context)
+    shown = None
+    if job["character"] is not None:
+        shown = addon.show_character(job["characters"], job["character_index"], camera)
+    try:
+        yield
+    finally:
+        if shown is not None:
+            addon.hide_character(shown)
+
+def character_animatable_objects(addon, job):
+    return addon.find_animatable_objects(addon.character_objects(job["character"]) if job["character"] is not None else None)
+
+def plan_character(addon, jobs, job, camera, light):
+    """Clear outdated output of a character job and return its plan: the work units to render and the cached frames."""
+    scene = bpy.context.scene
+    config = scene.sprite_frame_generator_config
+    output_path = bpy.path.abspath(config.output_path)
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
+
+    actions = selected_actions(addon, job)
+    if not actions:
+        raise RuntimeError("No action is selected.")
+    if config.render_in_memory and addon.in_memory_color_management_error(scene):
+        raise RuntimeError(addon.in_memory_color_management_error(scene))
+    if addon.output_format_error(config):
+        raise RuntimeError(addon.output_format_error(config))
+    if job["frames_per_unit"] > 0 and config.output_deduplicate:
+        raise RuntimeError("Deduplicate Frames compares the frames of a whole direction, it cannot be used with frames_per_unit.")
+
+    action_ranges = [(action.name,) + addon.action_frame_range(action, config) for action in actions]
+    units = jobs.expand_work_units(action_ranges, config.render_directions, config.animation_frame_step,
+                                   job["frames_per_unit"], config.render_use_multiview)
+
+    # (action, direction) -> cache key of the directions that need rendering,
+    # the keys also tell the journaled frames of these settings apart
+    cache_keys = {}
+    cached_frames = []
+    camera_origin = camera.location.copy()
+    light_origin = light.location.copy()
+    scene_key = addon.scene_cache_key(scene, character_animatable_objects(addon, job), camera, light)
+    for name, frame_start, frame_end in action_ranges:
+        if config.output_use_cache or config.output_resume:
+            addon.remove_stale_directions(output_path, name, config.render_directions)
+        else:
+            # start from empty action folders, like the render operator does
+            action_folder = os.path.join(output_path, name)
+            if os.path.exists(action_folder):
+                shutil.rmtree(action_folder)
+        for direction in range(config.render_directions):
+            key = addon.direction_cache_key(scene_key, config, bpy.data.actions[name], direction,
+                                            frame_start, frame_end, camera.location, light.location)
+            folder = addon.direction_folder(output_path, name, direction)
+            if config.output_use_cache:
+                frames = addon.cache.read_cached_frames(folder, key, output_path)
+                if frames is not None:
+                    cached_frames.extend(frames)
+                    continue
+                if os.path.exists(folder) and not config.output_resume:
+                    shutil.rmtree(folder)
+            cache_keys[(name, direction)] = key
+    if config.output_use_cache:
+        # keep only the directions that missed the cache
+        for unit in units:
+            unit["directions"] = [direction for direction in unit["directions"] if (unit["action"], direction) in cache_keys]
+        units = [unit for unit in units if unit["directions"]]
+        log("Reusing %d cached directions." % (len(action_ranges) * config.render_directions - len(cache_keys)))
+    # mirrored directions are flipped from the rendered ones
+    for unit in units:
+        unit["directions"] = addon.rendered_directions(config, unit["directions"])
+    units = [unit for unit in units if unit["directions"]]
+    animatable_objects = character_animatable_objects(addon, job)
+    # held frames and adaptive sampling are planned once over the whole action, not for every direction,
+    # and runs of held frames and the frame budget do not stop at the ranges of split units
+    if config.animation_sampling == 'ADAPTIVE' or config.animation_skip_held_frames:
+        for name, frame_start, frame_end in action_ranges:
+            action_units = [unit for unit in units if unit["action"] == name]
+            if not action_units:
+                continue
+            addon.assign_action(animatable_objects, bpy.data.actions[name])
+            originals = addon.plan_frames(scene, frame_start, frame_end, animatable_objects, camera)
+            for unit in action_units:
+                unit["originals"] = {str(frame): original for frame, original in
+                                     jobs.unit_originals(originals, unit["frame_start"], unit["frame_end"]).items()}
+    # the mesh bounds of an action are collected once and projected for every direction,
+    # and split units of an action share the border of its whole frame range
+    borders = {}
+    for name, frame_start, frame_end in action_ranges:
+        directions = sorted({direction for unit in units if unit["action"] == name for direction in unit["directions"]})
+        borders[name] = addon.action_render_borders(scene, bpy.data.actions[name], frame_start, frame_end, directions,
+                                                    animatable_objects, camera, camera_origin)
+    for unit in units:
+        unit["journal_keys"] = {str(direction): cache_keys[(unit["action"], direction)] for direction in unit["directions"]}
+        if borders[unit["action"]] is not None:
+            unit["border"] = list(addon.directions_border(borders[unit["action"]], unit["directions"]))
+        if job["character"] is not None:
+            unit["character"] = job["character_index"]
+    # the workers only append to the journal
+    addon.journal.Journal(output_path, compact=True).close()
+
+    return {"output_path": output_path, "action_ranges": action_ranges, "units": units, "cache_keys": cache_keys,
+            "cached_frames": cached_frames, "camera_origin": camera_origin, "light_origin": light_origin}
+
+def finish_character(addon, jobs, job, plan, rendered_frames, camera, light):
+    """Write the manifest, caches, atlases, delta sequences and archive of a character job from its rendered frames."""
+    scene = bpy.context.scene
+    config = scene.sprite_frame_generator_config
+    output_path = plan["output_path"]
+    action_ranges = plan["action_ranges"]
+    manifest = jobs.merge_manifests([], plan["cached_frames"] + rendered_frames)
+
+    # action name -> frames by direction, with the flipped directions and mirrored copies of the actions added
+    action_frames = {}
+    for name, _, _ in action_ranges:
+        frames_by_direction = {}
+        for frame in manifest["frames"]:
+            if frame["action"] == name:
+                frames_by_direction.setdefault(frame["direction"], []).append(frame)
+        for frames in frames_by_direction.values():
+            frames.sort(key=lambda frame: frame["frame"])
+        rendered = set(frames_by_direction)
+        mirrored_frames = addon.add_mirrored_frames(output_path, name, frames_by_direction, config)
+        action_frames[name] = frames_by_direction
+        for direction in set(frames_by_direction) - rendered:
+            manifest["frames"].extend(frames_by_direction[direction])
+        if mirrored_frames is not None:
+            action_frames[name + addon.MIRRORED_ACTION_SUFFIX] = mirrored_frames
+            for frames in mirrored_frames.values():
+                manifest["frames"].extend(frames)
+    jobs.write_json(os.path.join(output_path, "manifest.json"), manifest)
+
+    if config.render_mirror != 'OFF' and config.render_mirror_check:
+        for name, _, _ in action_ranges:
+            mirrored_frames = action_frames.get(name + addon.MIRRORED_ACTION_SUFFIX)
+            record = addon.mirrored_check_record(config, action_frames[name], mirrored_frames)
+            if record is None:
+                continue
+            difference = addon.check_mirrored_frame(scene, bpy.data.actions[name], record, output_path,
+                                                    character_animatable_objects(addon, job), camera, light,
+                                                    plan["camera_origin"], plan["light_origin"])
+            log("Mirrored frame %d of %s direction %d differs from a real render by %.4f.%s" % (
+                record["frame"], record["action"], record["direction"], difference,
+                " The character or action may not be symmetric." if difference > config.render_mirror_tolerance else ""))
+            break
+
+    shared_palette = None
+    if config.output_palette:
+        log("Mapping frames to a shared palette...")
+        shared_palette = addon.apply_shared_palette(output_path, manifest["frames"], config)
+
+    if config.output_use_cache:
+        for (name, direction), key in plan["cache_keys"].items():
+            if direction in action_frames[name]:
+                addon.cache.write_cached_frames(addon.direction_folder(output_path, name, direction), key, action_frames[name][direction])
+
+    # action name -> trim rects of its frames, from packing the atlas
+    trim_stages = {}
+    if config.output_atlas:
+        for name, frames_by_direction in action_frames.items():
+            log("Packing atlas for " + name + "...")
+            frames = [frame for direction in sorted(frames_by_direction) for frame in frames_by_direction[direction]]
+            trim_stages[name] = addon.pack_action_atlas(output_path, name, frames, config, shared_palette=shared_palette)
+    if config.output_delta:
+        for name, frames_by_direction in action_frames.items():
+            sequence_size, file_size = addon.write_delta_sequences(output_path, name, frames_by_direction, config)
+            log("Delta sequences of %s: %d bytes for %d bytes of frames." % (name, sequence_size, file_size))
+    archive_writer = addon.start_frame_archive(config, output_path)
+    if archive_writer is not None:
+        log("Packing frame archive...")
+        try:
+            for name, frames_by_direction in action_frames.items():
+                frames = [frame for direction in sorted(frames_by_direction) for frame in frames_by_direction[direction]]
+                addon.archive_action_frames(archive_writer, output_path, frames, trim_stages.get(name))
+            addon.finish_frame_archive(config, output_path, archive_writer)
+        finally:
+            archive_writer.discard()
+
+def run_batch(addon, jobs, job, job_path, worker_count):
+    scene = bpy.context.scene
+    config = scene.sprite_frame_generator_config
+    jobs.apply_job_to_config(job, config)
+    addon.apply_render_settings(bpy.context)
+
+    output_path = bpy.path.abspath(config.output_path)
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
+
+    if job["camera"] not in bpy.data.objects:
+        raise RuntimeError("Camera " + job["camera"] + " not found.")
+    if job["light"] not in bpy.data.objects:
+        raise RuntimeError("Light " + job["light"] + " not found.")
+    camera = bpy.data.objects[job["camera"]]
+    light = bpy.data.objects[job["light"]]
+
+    # every character is planned with its own settings, the units of all of them share the workers
+    character_jobs = jobs.character_jobs(job)
+    plans = []
+    for character_job in character_jobs:
+        if character_job["character"] is not None:
+            log("Planning character " + character_job["character"]["name"] + "...")
+        with character_shown(addon, jobs, character_job, camera):
+            plans.append(plan_character(addon, jobs, character_job, camera, light))
+    units = [unit for plan in plans for unit in plan["units"]]
+    jobs.apply_job_to_config(job, config)
+
+    staging_path = os.path.join(output_path, STAGING_FOLDER)
+    if os.path.exists(staging_path):
+        shutil.rmtree(staging_path)
+    os.makedirs(staging_path)
+
+    cores = jobs.available_cores()
+    if worker_count <= 0:
+        worker_count = len(cores)
+    shards = jobs.shard_work_units(units, min(worker_count, len(cores)), config.animation_frame_step)
+    core_slices = jobs.split_cores(cores, len(shards))
+    log("Rendering %d work units on %d workers." % (len(units), len(shards)))
+
+    manifest_paths = []
+    if len(shards) == 1:
+        # no need to load the blend file again for a single worker
+        manifest_paths.append(os.path.join(staging_path, "shard_0.manifest.json"))
+        render_shard(addon, jobs, job, shards[0], manifest_paths[0])
+    elif shards:
+        if not bpy.data.filepath:
+            raise RuntimeError("The blend file must be saved to render with several workers.")
+
+        workers = []
+        for i, shard in enumerate(shards):
+            shard_path = os.path.join(staging_path, "shard_%d.json" % i)
+            jobs.write_json(shard_path, {"units": shard})
+            manifest_paths.append(shard_path[:-len(".json")] + ".manifest.json")
+            workers.append(start_worker(os.path.abspath(job_path), shard_path, core_slices[i]))
+
+        failed = [i for i, worker in enumerate(workers) if worker.wait() != 0]
+        if failed:
+            raise RuntimeError("Workers failed: " + ", ".join(str(i) for i in failed))
+
+    frames = jobs.merge_manifests(manifest_paths)["frames"]
+    shutil.rmtree(staging_path)
+
+    for character_job, plan, character_frames in zip(character_jobs, plans, jobs.split_characters(frames, len(plans))):
+        if character_job["character"] is not None:
+            log("Finishing character " + character_job["character"]["name"] + "...")
+        with character_shown(addon, jobs, character_job, camera):
+            finish_character(addon, jobs, character_job, plan, character_frames, camera, light)
+
+    jobs.apply_job_to_config(job, config)
+    if config.output_profile:
+        warmup = addon.profiling.warmup_line(addon.profiling.merge_profiles(output_path, config.output_profile_chrome))
+        if warmup is not None:
+            log(warmup + " in all workers.")
+    log("Batch finished.")
+
+def main():
+    args = parse_args()
+    addon, jobs = load_addon()
+    job = jobs.load_job(args.job)
+
+    if args.serve:
+        serve(addon, jobs, job)
+        return
+
+    if args.shard:
+        with open(args.shard, "r") as f:
+            units = json.load(f)["units"]
+        render_shard(addon, jobs, job, units, args.shard[:-len(".json")] + ".manifest.json")
+        return
+
+    worker_count = args.workers if args.workers is not None else job["workers"]
+    run_batch(addon, jobs, job, args.job, worker_count)
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception as e:
+        log("Error: " + str(e))
+        sys.exit(1)
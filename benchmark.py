@@ -0,0 +1,357 @@
+# (c) 2023 Pururum LLC
+# This code is licensed under MIT license (see LICENSE for details)
+
+# Reproducible render benchmarks on synthetic scenes.
+#
+# Usage:
+#
+#   blender -b --factory-startup -P benchmark.py -- --output results.json
+#   blender -b --factory-startup -P benchmark.py -- --matrix matrix.json --output results.json --baseline baseline.json
+#   blender -b --factory-startup -P benchmark.py -- --compare results.json --baseline baseline.json
+#
+# A rigged character is built from code: a chain of bones, a tube mesh skinned
+# to them and actions with seeded random swings. Every case of the matrix (see
+# DEFAULT_MATRIX) renders all actions with the render operator on the CPU and
+# records the time spent in every stage, frames per second and peak memory.
+# Every run of a case is a blender process of its own, so the peak memory is
+# that of the case and not the highest of all cases run before it.
+# With a baseline, cases that got slower than the tolerance are reported and
+# the exit code is 1.
+
+import argparse
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import bpy
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import batch
+
+# Every combination of directions, resolutions, pixel sizes and engines is one case.
+DEFAULT_MATRIX = {
+    "scene": {"bones": 16, "actions": 2, "frames": 12, "subdivisions": 3, "seed": 0},
+    "directions": [1, 4],
+    "resolutions": [[256, 256], [512, 512]],
+    "pixel_sizes": [4, 12],
+    "engines": ["NODES", "NUMPY"],
+    "samples": 4,
+    "repeat": 1,
+}
+
+# Addon functions timed as stages, by function name.
+STAGE_FUNCTIONS = {
+    "border_points": "border",
+    "project_render_border": "border",
+    "plan_frames": "plan",
+    "render_planned_frames": "render",
+    "render_frames_in_memory": "render",
+    "finish_frames": "post",
+    "pack_action_atlas": "atlas",
+}
+
+# Stages shorter than this in both runs are too noisy to compare.
+MIN_COMPARED_SECONDS = 0.05
+
+def parse_args():
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    parser = argparse.ArgumentParser(prog="blender -b --factory-startup -P benchmark.py --")
+    parser.add_argument("--matrix", default=None, help="JSON file overriding keys of the default matrix.")
+    parser.add_argument("--output", default=None, help="Where to write the results as JSON.")
+    parser.add_argument("--baseline", default=None, help="Results to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed slowdown as a fraction, 0.1 is 10%%.")
+    parser.add_argument("--compare", default=None, help="Compare these results with the baseline without running anything.")
+    parser.add_argument("--run", default=None, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def log(message):
+    print("[sprite_frame_generator benchmark] " + message, flush=True)
+
+################
+# Scene
+################
+
+def build_scene(bones=16, actions=2, frames=12, subdivisions=3, seed=0):
+    """Replace the open file with a synthetic character, a camera and a light."""
+    bpy.ops.wm.read_factory_settings(use_empty=True)
+    scene = bpy.context.scene
+    rng = random.Random(seed)
+    height = 2.0
+    bone_length = height / bones
+
+    armature = bpy.data.objects.new("BenchmarkRig", bpy.data.armatures.new("BenchmarkRig"))
+    armature.location = (0.0, 0.0, -height / 2)
+    scene.collection.objects.link(armature)
+    bpy.context.view_layer.objects.active = armature
+    bpy.ops.object.mode_set(mode='EDIT')
+    parent = None
+    for i in range(bones):
+        bone = armature.data.edit_bones.new("Bone_%03d" % i)
+        bone.head = (0.0, 0.0, i * bone_length)
+        bone.tail = (0.0, 0.0, (i + 1) * bone_length)
+        bone.parent = parent
+        bone.use_connect = parent is not None
+        parent = bone
+    bpy.ops.object.mode_set(mode='OBJECT')
+
+    # a tube around the bones, denser with every subdivision
+    segments = 8 * 2 ** subdivisions
+    rings = bones * 2 ** subdivisions + 1
+    vertices = []
+    for ring in range(rings):
+        z = height * ring / (rings - 1)
+        radius = 0.2 + 0.1 * math.sin(math.pi * ring / (rings - 1))
+        for segment in range(segments):
+            angle = 2 * math.pi * segment / segments
+            vertices.append((radius * math.cos(angle), radius * math.sin(angle), z))
+    faces = [(ring * segments + segment, ring * segments + (segment + 1) % segments,
+              (ring + 1) * segments + (segment + 1) % segments, (ring + 1) * segments + segment)
+             for ring in range(rings - 1) for segment in range(segments)]
+    mesh = bpy.data.meshes.new("BenchmarkBody")
+    mesh.from_pydata(vertices, [], faces)
+    body = bpy.data.objects.new("BenchmarkBody", mesh)
+    scene.collection.objects.link(body)
+    body.parent = armature
+
+    # every vertex follows the bone at its height
+    groups = [body.vertex_groups.new(name=bone.name) for bone in armature.data.bones]
+    for ring in range(rings):
+        bone_index = min(bones - 1, int(height * ring / (rings - 1) / bone_length))
+        groups[bone_index].add(list(range(ring * segments, (ring + 1) * segments)), 1.0, 'REPLACE')
+    modifier = body.modifiers.new("Armature", 'ARMATURE')
+    modifier.object = armature
+
+    armature.animation_data_create()
+    for i in range(actions):
+        action = bpy.data.actions.new("BenchmarkAction_%d" % i)
+        action.use_fake_user = True
+        armature.animation_data.action = action
+        for pose_bone in armature.pose.bones:
+            pose_bone.rotation_mode = 'XYZ'
+            amplitude = rng.uniform(0.05, 0.3)
+            phase = rng.uniform(0.0, 2 * math.pi)
+            for frame in range(1, frames + 1, 3):
+                pose_bone.rotation_euler = (amplitude * math.sin(2 * math.pi * frame / frames + phase), 0.0,
+                                            amplitude * math.cos(2 * math.pi * frame / frames + phase))
+                pose_bone.keyframe_insert("rotation_euler", frame=frame, group=pose_bone.name)
+            pose_bone.rotation_euler = (amplitude * math.sin(2 * math.pi + phase), 0.0, amplitude * math.cos(2 * math.pi + phase))
+            pose_bone.keyframe_insert("rotation_euler", frame=frames, group=pose_bone.name)
+
+    camera = bpy.data.objects.new("Camera", bpy.data.cameras.new("Camera"))
+    camera.location = (0.0, -6.0, 1.0)
+    scene.collection.objects.link(camera)
+    scene.camera = camera
+    light = bpy.data.objects.new("Light", bpy.data.lights.new("Light", 'SUN'))
+    light.location = (3.0, -3.0, 5.0)
+    scene.collection.objects.link(light)
+    return scene
+
+def configure_case(addon, scene, config, case, samples, output_path):
+    scene.render.engine = 'CYCLES'
+    scene.cycles.device = 'CPU'
+    scene.cycles.samples = samples
+    scene.render.film_transparent = True
+    scene.render.resolution_percentage = 100
+
+    config.render_resolution = case["resolution"]
+    config.render_directions = case["directions"]
+    config.composite_engine = case["engine"]
+    config.composite_pixel_size = case["pixel_size"]
+    config.render_use_workers = False
+    config.output_use_cache = False
+    config.output_path = output_path
+    addon.sync_action_registry(scene)
+    for item in config.actions:
+        item.selected = True
+
+################
+# Measuring
+################
+
+def peak_rss_mb():
+    """Return the peak resident memory of this process, which runs one case only."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def timed(function, stage, timings):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+    return wrapper
+
+def instrument(addon, timings):
+    """Time the stage functions of the addon, returns what restore() needs."""
+    originals = {}
+    for name, stage in STAGE_FUNCTIONS.items():
+        if hasattr(addon, name):
+            originals[name] = getattr(addon, name)
+            setattr(addon, name, timed(originals[name], stage, timings))
+    return originals
+
+def restore(addon, originals):
+    for name, function in originals.items():
+        setattr(addon, name, function)
+
+def expand_cases(matrix):
+    cases = []
+    for directions, resolution, pixel_size, engine in itertools.product(
+            matrix["directions"], matrix["resolutions"], matrix["pixel_sizes"], matrix["engines"]):
+        cases.append({"name": "%s_%dx%d_d%d_px%g" % (engine, resolution[0], resolution[1], directions, pixel_size),
+                      "directions": directions, "resolution": list(resolution), "pixel_size": pixel_size, "engine": engine})
+    return cases
+
+def run_case(addon, scene, case, matrix):
+    config = scene.sprite_frame_generator_config
+    output_path = tempfile.mkdtemp(prefix="sprite_frame_generator_benchmark_")
+    timings = {}
+    try:
+        configure_case(addon, scene, config, case, matrix["samples"], output_path)
+        frame_ranges = [addon.action_frame_range(action, config) for action in bpy.data.actions]
+        frame_count = case["directions"] * sum(len(range(frame_start, frame_end + 1, config.animation_frame_step))
+                                               for frame_start, frame_end in frame_ranges)
+
+        start = time.perf_counter()
+        if case["engine"] == 'NODES':
+            bpy.ops.sprite_frame_generator.generate_composite_nodes()
+        else:
+            scene.use_nodes = False
+        timings["composite_nodes"] = time.perf_counter() - start
+
+        originals = instrument(addon, timings)
+        try:
+            start = time.perf_counter()
+            result = bpy.ops.sprite_frame_generator.render_sprite_frames()
+            seconds = time.perf_counter() - start
+        finally:
+            restore(addon, originals)
+        if result != {'FINISHED'}:
+            raise RuntimeError("Rendering " + case["name"] + " did not finish: " + str(result))
+    finally:
+        shutil.rmtree(output_path, ignore_errors=True)
+
+    return dict(case, seconds=seconds, frames=frame_count, frames_per_second=frame_count / seconds if seconds else 0.0,
+                stages=timings, peak_rss_mb=peak_rss_mb())
+
+def environment(addon):
+    fingerprint = addon.cache.Fingerprint()
+    addon_dir = os.path.dirname(os.path.abspath(addon.__file__))
+    for name in sorted(os.listdir(addon_dir)):
+        if name.endswith(".py"):
+            with open(os.path.join(addon_dir, name), "rb") as f:
+                fingerprint.update(name, f.read().decode("utf-8", "replace"))
+    return {"blender": bpy.app.version_string, "addon": fingerprint.hexdigest()[:12], "python": platform.python_version(),
+            "platform": platform.platform(), "processor": platform.processor(), "cpu_count": os.cpu_count()}
+
+def run_single_case(path, output):
+    """Run the case of a --run file in this process and write its result."""
+    job = load_json(path)
+    scene = build_scene(**job["matrix"]["scene"])
+    # reading factory settings unregisters the addon, so load it after building the scene
+    addon, jobs = batch.load_addon()
+    jobs.write_json(output, run_case(addon, scene, job["case"], job["matrix"]))
+
+def run_case_process(case, matrix, staging_path):
+    """Run one case in a new blender process, the ru_maxrss peak of a process is never reset."""
+    job_path = os.path.join(staging_path, "case.json")
+    result_path = os.path.join(staging_path, "result.json")
+    with open(job_path, "w") as f:
+        json.dump({"case": case, "matrix": matrix}, f)
+    if os.path.exists(result_path):
+        os.remove(result_path)
+    command = [bpy.app.binary_path, "-b", "--factory-startup", "-P", os.path.abspath(__file__),
+               "--", "--run", job_path, "--output", result_path]
+    completed = subprocess.run(command)
+    if completed.returncode != 0 or not os.path.exists(result_path):
+        raise RuntimeError("Running " + case["name"] + " failed with exit code " + str(completed.returncode))
+    return load_json(result_path)
+
+def run_benchmarks(matrix):
+    addon, _ = batch.load_addon()
+    results = {"environment": environment(addon), "matrix": matrix, "cases": []}
+
+    staging_path = tempfile.mkdtemp(prefix="sprite_frame_generator_benchmark_cases_")
+    try:
+        for case in expand_cases(matrix):
+            runs = [run_case_process(case, matrix, staging_path) for _ in range(max(1, matrix["repeat"]))]
+            # the fastest run is the least disturbed by the rest of the machine
+            best = min(runs, key=lambda run: run["seconds"])
+            log("%s: %.2fs, %.2f frames/s, %s MB peak" % (best["name"], best["seconds"], best["frames_per_second"],
+                                                         "?" if best["peak_rss_mb"] is None else "%.0f" % best["peak_rss_mb"]))
+            results["cases"].append(best)
+    finally:
+        shutil.rmtree(staging_path, ignore_errors=True)
+    return results
+
+################
+# Comparing
+################
+
+def compare_results(results, baseline, tolerance):
+    """Return a message for every case or stage that got slower than the tolerance allows."""
+    baseline_cases = {case["name"]: case for case in baseline["cases"]}
+    regressions = []
+    for case in results["cases"]:
+        previous = baseline_cases.get(case["name"])
+        if previous is None:
+            continue
+        if case["frames_per_second"] < previous["frames_per_second"] * (1.0 - tolerance):
+            regressions.append("%s: %.2f frames/s, was %.2f" % (case["name"], case["frames_per_second"], previous["frames_per_second"]))
+        for stage, seconds in sorted(case["stages"].items()):
+            previous_seconds = previous["stages"].get(stage)
+            if previous_seconds is None or max(seconds, previous_seconds) < MIN_COMPARED_SECONDS:
+                continue
+            if seconds > previous_seconds * (1.0 + tolerance):
+                regressions.append("%s: %s took %.2fs, was %.2fs" % (case["name"], stage, seconds, previous_seconds))
+    return regressions
+
+def load_json(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+def main():
+    args = parse_args()
+    if args.run:
+        run_single_case(args.run, args.output)
+        return
+    if args.compare:
+        results = load_json(args.compare)
+    else:
+        matrix = dict(DEFAULT_MATRIX)
+        if args.matrix:
+            matrix.update(load_json(args.matrix))
+        results = run_benchmarks(matrix)
+        if args.output:
+            _, jobs = batch.load_addon()
+            jobs.write_json(args.output, results)
+            log("Results written to " + args.output)
+
+    if args.baseline:
+        regressions = compare_results(results, load_json(args.baseline), args.tolerance)
+        for regression in regressions:
+            log("Regression: " + regression)
+        if regressions:
+            sys.exit(1)
+        log("No regressions against " + args.baseline)
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception as e:
+        log("Error: " + str(e))
+        sys.exit(1)
@@ -0,0 +1,73 @@
+# (c) 2023 Pururum LLC
+# This code is licensed under MIT license (see LICENSE for details)
+
+# Tight render borders from projected bounding boxes.
+#
+# Bounding box corners of the animated meshes are projected through the camera
+# of every direction over the frames of an action. The rect around them, plus
+# padding, is all that needs rendering. Rects are (x, y, width, height) in
+# pixels with y going down from the top of the full frame, like the trim rects
+# in atlas.py. Nothing in this module imports bpy.
+
+import numpy
+
+def box_corners(bound_box, matrix_world):
+    """Return the 8 corners of a local bounding box in world space as an (8, 3) array."""
+    corners = numpy.array(bound_box, dtype=numpy.float64).reshape(8, 3)
+    matrix = numpy.array(matrix_world, dtype=numpy.float64)
+    return corners @ matrix[:3, :3].T + matrix[:3, 3]
+
+def project_points(points, view_matrix, projection_matrix):
+    """Project (n, 3) world points to (n, 2) normalized screen coordinates, origin at the bottom left.
+
+    Returns None when a point is behind the camera, since its projection is meaningless.
+    """
+    points = numpy.asarray(points, dtype=numpy.float64)
+    homogeneous = numpy.hstack([points, numpy.ones((len(points), 1))])
+    clip = homogeneous @ (numpy.array(projection_matrix, dtype=numpy.float64) @ numpy.array(view_matrix, dtype=numpy.float64)).T
+    if (clip[:, 3] <= 1e-9).any():
+        return None
+    return (clip[:, :2] / clip[:, 3:4] + 1.0) / 2.0
+
+def border_rect(screen_points, width, height, padding=0, align=1):
+    """Return the pixel rect holding the normalized screen points, or the full frame if there are none.
+
+    The rect grows by padding pixels on every side, is clamped to the frame and
+    snapped outward to a grid of align pixels from the top left corner, so
+    pixel art blocks line up with the blocks of the full frame.
+    """
+    if screen_points is None or len(screen_points) == 0:
+        return (0, 0, width, height)
+    screen_points = numpy.asarray(screen_points, dtype=numpy.float64)
+    left = numpy.floor(screen_points[:, 0].min() * width) - padding
+    right = numpy.ceil(screen_points[:, 0].max() * width) + padding
+    # flip y so rects go down from the top like images
+    top = numpy.floor((1.0 - screen_points[:, 1].max()) * height) - padding
+    bottom = numpy.ceil((1.0 - screen_points[:, 1].min()) * height) + padding
+
+    left = max(0, int(left) // align * align)
+    top = max(0, int(top) // align * align)
+    right = min(width, -(-int(right) // align) * align)
+    bottom = min(height, -(-int(bottom) // align) * align)
+    if right <= left or bottom <= top:
+        # everything is off screen, keep a single block so the render still has a size
+        return (0, 0, min(width, align), min(height, align))
+    return (left, top, right - left, bottom - top)
+
+def union_rects(rects):
+    rects = list(rects)
+    left = min(rect[0] for rect in rects)
+    top = min(rect[1] for rect in rects)
+    right = max(rect[0] + rect[2] for rect in rects)
+    bottom = max(rect[1] + rect[3] for rect in rects)
+    return (left, top, right - left, bottom - top)
+
+def render_border(rect, width, height):
+    """Return (min_x, max_x, min_y, max_y) of blender's render border for a pixel rect.
+
+    Values are nudged a quarter pixel inside, so blender lands on the same pixels
+    whether it rounds or truncates them.
+    """
+    x, y, rect_width, rect_height = rect
+    return ((x + 0.25) / width, min(1.0, (x + rect_width + 0.25) / width),
+            (height - y - rect_height + 0.25) / height, min(1.0, (height - y + 0.25) / height))
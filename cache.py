@@ -0,0 +1,95 @@
+# (c) 2023 Pururum LLC
+# This code is licensed under MIT license (see LICENSE for details)
+
+# Content addressed render cache.
+#
+# Every rendered (action, direction) gets a cache manifest next to its folder,
+# holding the hash of everything that went into its frames. When the next run
+# computes the same hash and all frames are still on disk, the folder is reused
+# instead of rendered again.
+# Nothing in this module imports bpy.
+
+import hashlib
+import json
+import os
+
+import numpy
+
+CACHE_EXTENSION = ".cache.json"
+
+# Bump when the way keys are computed changes, so old caches are never trusted.
+CACHE_VERSION = 2
+
+class Fingerprint:
+    """Builds a sha256 key from nested python values and numpy arrays."""
+
+    def __init__(self):
+        self._hash = hashlib.sha256()
+        self.update(CACHE_VERSION)
+
+    def update(self, *values):
+        for value in values:
+            self._update(value)
+        return self
+
+    def _update(self, value):
+        if isinstance(value, numpy.ndarray):
+            self._write("a", str(value.dtype) + str(value.shape))
+            self._hash.update(numpy.ascontiguousarray(value).tobytes())
+        elif isinstance(value, (list, tuple)):
+            self._write("l", str(len(value)))
+            for item in value:
+                self._update(item)
+        elif isinstance(value, (set, frozenset)):
+            self._update(sorted(value))
+        elif isinstance(value, float):
+            self._write("f", repr(value))
+        elif value is None or isinstance(value, (bool, int, str)):
+            self._write(type(value).__name__[0], str(value))
+        else:
+            self._write("r", repr(value))
+
+    def _write(self, tag, text):
+        # length prefixes keep ("ab", "c") and ("a", "bc") apart
+        data = text.encode("utf-8")
+        self._hash.update(tag.encode("ascii") + str(len(data)).encode("ascii") + b":" + data)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+def cache_path(folder):
+    """Return the path of the cache manifest of a direction folder."""
+    return os.path.normpath(folder) + CACHE_EXTENSION
+
+def read_cache_manifest(folder):
+    """Return the {"key", "frames"} cache manifest of a direction folder, or None."""
+    path = cache_path(folder)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def read_cached_frames(folder, key, output_path):
+    """Return the frame records cached for a direction folder for key, or None on a miss.
+
+    A cache only hits when the key matches and every frame and pass file still exists.
+    """
+    manifest = read_cache_manifest(folder)
+    if manifest is None or manifest.get("key") != key:
+        return None
+    frames = manifest.get("frames", [])
+    for frame in frames:
+        for path in [frame["path"]] + list(frame.get("passes", {}).values()):
+            if not os.path.isfile(os.path.join(output_path, path)):
+                return None
+    return frames
+
+def write_cached_frames(folder, key, frames):
+    path = cache_path(folder)
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump({"key": key, "frames": frames}, f, indent=2)
+    os.replace(temp_path, path)
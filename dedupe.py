@@ -0,0 +1,41 @@
+# (c) 2023 Pururum LLC
+# This code is licensed under MIT license (see LICENSE for details)
+
+# Helpers to find held (repeated) frames before and after rendering.
+# Nothing in this module imports bpy.
+
+import hashlib
+
+import numpy
+
+# Pose matrices are rounded to this many decimals before they are compared,
+# so float noise from the evaluation does not hide a held pose.
+POSE_DECIMALS = 5
+
+def array_key(arrays, decimals=None):
+    """Hash a list of numpy arrays by value."""
+    digest = hashlib.sha1()
+    for array in arrays:
+        array = numpy.asarray(array)
+        if decimals is not None:
+            # + 0.0 turns -0.0 into 0.0
+            array = numpy.round(array.astype(numpy.float64), decimals) + 0.0
+        digest.update(str(array.shape).encode("ascii"))
+        digest.update(numpy.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+def pose_key(matrices):
+    return array_key(matrices, POSE_DECIMALS)
+
+def pixel_key(pixels):
+    return array_key([pixels])
+
+def frame_runs(frames, frame_step=1):
+    """Group sorted frame numbers into (first, last) runs that step by frame_step."""
+    runs = []
+    for frame in frames:
+        if runs and frame == runs[-1][1] + frame_step:
+            runs[-1][1] = frame
+        else:
+            runs.append([frame, frame])
+    return [tuple(run) for run in runs]
@@ -0,0 +1,236 @@
+# (c) 2023 Pururum LLC
+# This code is licensed under MIT license (see LICENSE for details)
+
+# Delta encoded frame sequences.
+#
+# Consecutive frames of an animation often differ in a small region only, an
+# arm swing or a blink. A sequence file stores a keyframe every few frames and,
+# for the frames between, only the rectangles that changed since the previous
+# frame:
+#
+#   header  "SFGDELTA", version, width, height, frame count (uint32 each)
+#   frames  frame number (int32), kind (uint8, 0 key, 1 delta), rect count (uint32),
+#           then per rect x, y, width, height (uint16), data size (uint32) and
+#           the zlib compressed uint8 RGBA pixels of the rect, rows from top to bottom
+#   index   offset of every frame (uint64)
+#   footer  index offset (uint64), "SFGDINDX"
+#
+# A keyframe is one rect covering the whole frame and clears everything else.
+# The header holds the largest frame size, a frame of another size than the
+# one before it is a keyframe at the top left. Changed pixels are found on a
+# grid of TILE_SIZE tiles, runs of changed tiles are merged into rects and
+# every rect is shrunk to the pixels that changed in it. Frames are rebuilt
+# from the keyframe before them, or from the previous frame when playing in
+# order, which only copies the changed rects.
+# Nothing in this module imports bpy.
+
+import os
+import struct
+import zlib
+
+import numpy
+
+DELTA_EXTENSION = ".sfgdelta"
+DELTA_VERSION = 1
+
+TILE_SIZE = 16
+
+HEADER = struct.Struct("<8sIIII")
+HEADER_MAGIC = b"SFGDELTA"
+FRAME = struct.Struct("<iBI")
+RECT = struct.Struct("<HHHHI")
+FOOTER = struct.Struct("<Q8s")
+FOOTER_MAGIC = b"SFGDINDX"
+
+KEYFRAME = 0
+DELTA = 1
+
+# A frame whose changed rects cover more than this share of it is stored as a keyframe.
+MAX_DELTA_AREA = 0.5
+
+class DeltaError(Exception):
+    """Raised for files that are not complete delta sequences."""
+    pass
+
+def changed_tiles(previous, current, tile_size=TILE_SIZE):
+    """Return the (rows, columns) bool grid of tiles with a pixel that differs between two frames."""
+    height, width = current.shape[:2]
+    changed = (previous != current).any(axis=2)
+    rows, columns = -(-height // tile_size), -(-width // tile_size)
+    padded = numpy.zeros((rows * tile_size, columns * tile_size), dtype=bool)
+    padded[:height, :width] = changed
+    return padded.reshape(rows, tile_size, columns, tile_size).any(axis=(1, 3)), changed
+
+def tile_rects(tiles):
+    """Merge changed tiles into (column, row, columns, rows) rects.
+
+    Runs of changed tiles in a row grow downwards while the next row has the same run.
+    """
+    rects = []
+    # (start, end) column run -> first row
+    open_runs = {}
+    for row in range(tiles.shape[0] + 1):
+        runs = []
+        if row < tiles.shape[0]:
+            edges = numpy.flatnonzero(numpy.diff(numpy.concatenate(([False], tiles[row], [False])).astype(numpy.int8)))
+            runs = list(zip(edges[::2].tolist(), edges[1::2].tolist()))
+        next_runs = {run: open_runs.pop(run, row) for run in runs}
+        for (start, end), first_row in open_runs.items():
+            rects.append((start, first_row, end - start, row - first_row))
+        open_runs = next_runs
+    return rects
+
+def changed_rects(previous, current, tile_size=TILE_SIZE):
+    """Return the (x, y, width, height) rects holding every pixel that differs between two uint8 RGBA frames."""
+    tiles, changed = changed_tiles(previous, current, tile_size)
+    height, width = changed.shape
+    rects = []
+    for column, row, columns, rows in tile_rects(tiles):
+        x, y = column * tile_size, row * tile_size
+        region = changed[y:min(height, y + rows * tile_size), x:min(width, x + columns * tile_size)]
+        # shrink to the changed pixels, the tiles only tell where to look
+        changed_rows = numpy.flatnonzero(region.any(axis=1))
+        changed_columns = numpy.flatnonzero(region.any(axis=0))
+        rects.append((x + int(changed_columns[0]), y + int(changed_rows[0]),
+                      int(changed_columns[-1] - changed_columns[0]) + 1, int(changed_rows[-1] - changed_rows[0]) + 1))
+    return rects
+
+class DeltaWriter:
+    """Writes a sequence of uint8 RGBA frames to a delta file.
+
+    The file is written next to path and moved there on close, so an unfinished
+    sequence never replaces a complete one.
+    """
+
+    def __init__(self, path, keyframe_interval=30, compress_level=6):
+        self.path = path
+        self.keyframe_interval = max(1, keyframe_interval)
+        self.compress_level = compress_level
+        self.file = open(path + ".tmp", "wb")
+        self.file.write(HEADER.pack(HEADER_MAGIC, DELTA_VERSION, 0, 0, 0))
+        self.offsets = []
+        self.previous = None
+        self.since_keyframe = 0
+        self.width = 0
+        self.height = 0
+
+    def add(self, frame, pixels):
+        """Append the pixels of a frame, (height, width, 4) uint8 with rows from top to bottom."""
+        height, width = pixels.shape[:2]
+        self.width = max(self.width, width)
+        self.height = max(self.height, height)
+
+        kind = KEYFRAME
+        rects = [(0, 0, width, height)]
+        # a frame of another size cannot be a delta of the one before
+        if (self.previous is not None and self.previous.shape == pixels.shape
+                and self.since_keyframe < self.keyframe_interval):
+            changed = changed_rects(self.previous, pixels)
+            # a delta covering most of the frame saves nothing over a keyframe
+            if sum(w * h for _, _, w, h in changed) <= MAX_DELTA_AREA * width * height:
+                kind = DELTA
+                rects = changed
+        self.since_keyframe = self.since_keyframe + 1 if kind == DELTA else 1
+
+        self.offsets.append(self.file.tell())
+        self.file.write(FRAME.pack(frame, kind, len(rects)))
+        for x, y, w, h in rects:
+            data = zlib.compress(numpy.ascontiguousarray(pixels[y:y + h, x:x + w]).tobytes(), self.compress_level)
+            self.file.write(RECT.pack(x, y, w, h, len(data)))
+            self.file.write(data)
+        self.previous = pixels
+
+    def close(self):
+        if self.file is None:
+            return
+        index_offset = self.file.tell()
+        self.file.write(struct.pack("<%dQ" % len(self.offsets), *self.offsets))
+        self.file.write(FOOTER.pack(index_offset, FOOTER_MAGIC))
+        self.file.seek(0)
+        self.file.write(HEADER.pack(HEADER_MAGIC, DELTA_VERSION, self.width, self.height, len(self.offsets)))
+        self.file.close()
+        self.file = None
+        os.replace(self.path + ".tmp", self.path)
+
+    def discard(self):
+        """Close an unfinished sequence and delete it."""
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        os.remove(self.path + ".tmp")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, error_type, *args):
+        if error_type is None:
+            self.close()
+        else:
+            self.discard()
+
+class DeltaReader:
+    """Rebuilds the frames of a delta file. Frames read in order only apply their changed rects."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.data = f.read()
+        if len(self.data) < HEADER.size + FOOTER.size:
+            raise DeltaError("File is too small to be a delta sequence.")
+        magic, version, self.width, self.height, count = HEADER.unpack_from(self.data, 0)
+        if magic != HEADER_MAGIC:
+            raise DeltaError("File is not a delta sequence.")
+        if version > DELTA_VERSION:
+            raise DeltaError("Delta sequence version %d is not supported." % version)
+        index_offset, magic = FOOTER.unpack_from(self.data, len(self.data) - FOOTER.size)
+        if magic != FOOTER_MAGIC:
+            raise DeltaError("Delta sequence has no index, it was not closed.")
+        self.offsets = struct.unpack_from("<%dQ" % count, self.data, index_offset)
+        self.frame_numbers = [FRAME.unpack_from(self.data, offset)[0] for offset in self.offsets]
+        self.positions = {frame: i for i, frame in enumerate(self.frame_numbers)}
+        self.current = None
+        self.current_position = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _apply(self, position, pixels):
+        offset = self.offsets[position]
+        _, kind, rect_count = FRAME.unpack_from(self.data, offset)
+        offset += FRAME.size
+        if kind == KEYFRAME:
+            # a keyframe smaller than the sequence leaves nothing of the frames before it
+            pixels[:] = 0
+        for _ in range(rect_count):
+            x, y, w, h, size = RECT.unpack_from(self.data, offset)
+            offset += RECT.size
+            pixels[y:y + h, x:x + w] = numpy.frombuffer(zlib.decompress(self.data[offset:offset + size]),
+                                                        dtype=numpy.uint8).reshape(h, w, 4)
+            offset += size
+        return kind
+
+    def _kind(self, position):
+        return FRAME.unpack_from(self.data, self.offsets[position])[1]
+
+    def read(self, frame):
+        """Return the (height, width, 4) uint8 pixels of a frame number. The array is reused by the next read."""
+        position = self.positions[frame]
+        if self.current is None:
+            self.current = numpy.zeros((self.height, self.width, 4), dtype=numpy.uint8)
+        # playing forward, apply only what changed since the frame read last,
+        # unless there is a keyframe on the way, otherwise start at the keyframe before the frame
+        forward = self.current_position is not None and self.current_position <= position
+        start = self.current_position + 1 if forward else 0
+        for i in range(position, start - 1, -1):
+            if self._kind(i) == KEYFRAME:
+                start = i
+                break
+        for i in range(start, position + 1):
+            self._apply(i, self.current)
+        self.current_position = position
+        return self.current
+
+    def frames(self):
+        """Yield (frame number, pixels) of every frame in order. The pixels are reused for the next frame."""
+        for frame in self.frame_numbers:
+            yield frame, self.read(frame)
@@ -0,0 +1,339 @@
+# (c) 2023 Pururum LLC
+# This code is licensed under MIT license (see LICENSE for details)
+
+# Image encoders and an asynchronous writer for rendered frames.
+#
+# Frames come in as float RGBA arrays of shape (height, width, 4) with rows from
+# top to bottom. PNG and QOI are encoded here with numpy and zlib, WebP needs
+# Pillow, which is not bundled with Blender and is only imported when used.
+# zlib releases the GIL while compressing, so PNG encoding runs in parallel on
+# the writer threads while the next frame renders. Nothing in this module
+# imports bpy.
+
+import concurrent.futures
+import os
+import struct
+import threading
+import zlib
+
+import numpy
+
+# File extension of every format.
+EXTENSIONS = {"PNG": ".png", "WEBP": ".webp", "QOI": ".qoi"}
+
+class EncodingError(Exception):
+    pass
+
+def to_uint8(pixels):
+    # the same rounding blender uses when saving byte images
+    return numpy.floor(numpy.clip(pixels, 0.0, 1.0) * 255.0 + 0.5).astype(numpy.uint8)
+
+################
+# PNG
+################
+
+def _png_chunk(chunk_type, data):
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data) & 0xffffffff)
+
+def _paeth(left, up, up_left):
+    left = left.astype(numpy.int16)
+    up = up.astype(numpy.int16)
+    up_left = up_left.astype(numpy.int16)
+    estimate = left + up - up_left
+    distance_left = numpy.abs(estimate - left)
+    distance_up = numpy.abs(estimate - up)
+    distance_up_left = numpy.abs(estimate - up_left)
+    return numpy.where((distance_left <= distance_up) & (distance_left <= distance_up_left), left,
+                       numpy.where(distance_up <= distance_up_left, up, up_left)).astype(numpy.uint8)
+
+def filter_scanlines(rows, bytes_per_pixel, adaptive=True):
+    """Filter (height, row bytes) uint8 scanlines for PNG.
+
+    Every PNG filter predicts from unfiltered neighbours, so all five are computed
+    for the whole image at once. adaptive picks the filter with the smallest sum
+    of absolute values per row, otherwise the Sub filter is used for every row.
+    """
+    left = numpy.zeros_like(rows)
+    left[:, bytes_per_pixel:] = rows[:, :-bytes_per_pixel]
+    up = numpy.zeros_like(rows)
+    up[1:] = rows[:-1]
+
+    sub = rows - left
+    if not adaptive:
+        return numpy.hstack([numpy.ones((rows.shape[0], 1), dtype=numpy.uint8), sub])
+
+    up_left = numpy.zeros_like(rows)
+    up_left[1:] = left[:-1]
+    average = ((left.astype(numpy.uint16) + up) // 2).astype(numpy.uint8)
+    candidates = numpy.stack([rows, sub, rows - up, rows - average, rows - _paeth(left, up, up_left)])
+
+    # bytes as signed values, the usual minimum sum of absolute differences heuristic
+    cost = numpy.abs(candidates.view(numpy.int8).astype(numpy.int32)).sum(axis=2)
+    best = cost.argmin(axis=0)
+    filtered = candidates[best, numpy.arange(rows.shape[0])]
+    return numpy.hstack([best.astype(numpy.uint8)[:, None], filtered])
+
+def palette_indices(pixels, max_colors=256):
+    """Return (palette, indices) when uint8 RGBA pixels use at most max_colors colors, otherwise None."""
+    packed = pixels.reshape(-1, 4).view(numpy.uint32).ravel()
+    colors, indices = numpy.unique(packed, return_inverse=True)
+    if len(colors) > max_colors:
+        return None
+    palette = colors.view(numpy.uint8).reshape(-1, 4)
+    return palette, indices.reshape(pixels.shape[:2]).astype(numpy.uint8)
+
+def encode_png(pixels, compress_level=6, indexed=False, palette=None, indices=None):
+    """Encode float RGBA pixels as PNG.
+
+    With indexed, frames with 256 colors or less are written as palette PNGs.
+    An explicit palette (uint8 RGBA rows) and indices can be given instead.
+    """
+    if palette is None and indexed:
+        found = palette_indices(to_uint8(pixels))
+        if found is not None:
+            palette, indices = found
+
+    if palette is not None:
+        height, width = indices.shape
+        header = struct.pack(">IIBBBBB", width, height, 8, 3, 0, 0, 0)
+        rows = numpy.ascontiguousarray(indices, dtype=numpy.uint8)
+        bytes_per_pixel = 1
+        extra_chunks = [_png_chunk(b"PLTE", palette[:, :3].tobytes())]
+        if (palette[:, 3] != 255).any():
+            extra_chunks.append(_png_chunk(b"tRNS", palette[:, 3].tobytes()))
+    else:
+        height, width = pixels.shape[:2]
+        header = struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)
+        rows = to_uint8(pixels).reshape(height, width * 4)
+        bytes_per_pixel = 4
+        extra_chunks = []
+
+    scanlines = filter_scanlines(rows, bytes_per_pixel, adaptive=compress_level > 3)
+    data = zlib.compress(scanlines.tobytes(), compress_level)
+    return b"".join([b"\x89PNG\r\n\x1a\n", _png_chunk(b"IHDR", header)] + extra_chunks +
+                    [_png_chunk(b"IDAT", data), _png_chunk(b"IEND", b"")])
+
+################
+# QOI
+################
+
+def _qoi_hash(r, g, b, a):
+    return (r * 3 + g * 5 + b * 7 + a * 11) % 64
+
+def encode_qoi(pixels):
+    """Encode float RGBA pixels as QOI (https://qoiformat.org).
+
+    The ops of all pixels are worked out at once with numpy and give the same
+    bytes as the reference encoder: pixels equal to the previous one are runs,
+    the others are index hits when the last pixel stored in their index slot
+    has the same color, else a diff, luma, RGB or RGBA op.
+    """
+    height, width = pixels.shape[:2]
+    rgba = to_uint8(pixels).reshape(-1, 4)
+    packed = rgba.view(numpy.uint32).ravel()
+    count = len(packed)
+    header = struct.pack(">4sIIBB", b"qoif", width, height, 4, 0)
+    if count == 0:
+        return header + b"\x00" * 7 + b"\x01"
+
+    previous = numpy.empty_like(rgba)
+    previous[0] = (0, 0, 0, 255)
+    previous[1:] = rgba[:-1]
+    run = packed == previous.view(numpy.uint32).ravel()
+
+    # a run byte at every 62nd pixel of a run and at its last pixel
+    pixel = numpy.arange(count)
+    run_start = numpy.maximum.accumulate(numpy.where(run & ~numpy.concatenate([[False], run[:-1]]), pixel, 0))
+    run_length = pixel - run_start + 1
+    run_end = run & ((run_length % 62 == 0) | ~numpy.concatenate([run[1:], [False]]))
+
+    # the index only changes at pixels that are not runs, so a pixel hits when the
+    # last such pixel with the same hash has its color
+    channels = rgba.astype(numpy.int32)
+    # as bytes, argsort then sorts by counting
+    position = _qoi_hash(channels[:, 0], channels[:, 1], channels[:, 2], channels[:, 3]).astype(numpy.uint8)
+    stored = numpy.flatnonzero(~run)
+    stored = stored[numpy.argsort(position[stored], kind="stable")]
+    same_slot = position[stored[1:]] == position[stored[:-1]]
+    index = numpy.zeros(count, dtype=bool)
+    index[stored[1:]] = same_slot & (packed[stored[1:]] == packed[stored[:-1]])
+
+    delta = (channels[:, :3] - previous[:, :3].astype(numpy.int32) + 128) % 256 - 128
+    dr, dg, db = delta[:, 0], delta[:, 1], delta[:, 2]
+    dr_dg, db_dg = dr - dg, db - dg
+    literal = ~run & ~index
+    rgba_op = literal & (rgba[:, 3] != previous[:, 3])
+    diff = literal & ~rgba_op & (dr >= -2) & (dr <= 1) & (dg >= -2) & (dg <= 1) & (db >= -2) & (db <= 1)
+    luma = (literal & ~rgba_op & ~diff & (dg >= -32) & (dg <= 31) &
+            (dr_dg >= -8) & (dr_dg <= 7) & (db_dg >= -8) & (db_dg <= 7))
+    rgb_op = literal & ~rgba_op & ~diff & ~luma
+
+    size = numpy.zeros(count, dtype=numpy.int64)
+    size[run_end | index | diff] = 1
+    size[luma] = 2
+    size[rgb_op] = 4
+    size[rgba_op] = 5
+    offset = numpy.cumsum(size) - size
+    out = numpy.empty(int(size.sum()), dtype=numpy.uint8)
+
+    first = numpy.zeros(count, dtype=numpy.int32)
+    first[run_end] = 0xc0 | ((run_length[run_end] - 1) % 62)
+    first[index] = position[index]
+    first[diff] = 0x40 | (dr[diff] + 2) << 4 | (dg[diff] + 2) << 2 | (db[diff] + 2)
+    first[luma] = 0x80 | (dg[luma] + 32)
+    first[rgb_op] = 0xfe
+    first[rgba_op] = 0xff
+    emitted = size > 0
+    out[offset[emitted]] = first[emitted]
+    out[offset[luma] + 1] = (dr_dg[luma] + 8) << 4 | (db_dg[luma] + 8)
+    for channel in range(3):
+        out[offset[rgb_op] + 1 + channel] = rgba[rgb_op, channel]
+    for channel in range(4):
+        out[offset[rgba_op] + 1 + channel] = rgba[rgba_op, channel]
+    return header + out.tobytes() + b"\x00" * 7 + b"\x01"
+
+def decode_qoi(data):
+    """Decode a QOI file into float RGBA pixels.
+
+    Runs are not decoded pixel by pixel, every op gives one color and a repeat count.
+    """
+    magic, width, height, channels, _ = struct.unpack(">4sIIBB", data[:14])
+    if magic != b"qoif":
+        raise EncodingError("Not a QOI file.")
+
+    count = width * height
+    colors = []
+    repeats = []
+    index = [(0, 0, 0, 0)] * 64
+    r, g, b, a = 0, 0, 0, 255
+    position = 14
+    decoded = 0
+    while decoded < count:
+        tag = data[position]
+        position += 1
+        if tag >= 0xc0 and tag < 0xfe:
+            run = (tag & 0x3f) + 1
+            if colors:
+                repeats[-1] += run
+            else:
+                # a run before the first op repeats the start pixel
+                colors.append((r, g, b, a))
+                repeats.append(run)
+            decoded += run
+            index[_qoi_hash(r, g, b, a)] = (r, g, b, a)
+            continue
+        if tag == 0xfe:
+            r, g, b = data[position:position + 3]
+            position += 3
+        elif tag == 0xff:
+            r, g, b, a = data[position:position + 4]
+            position += 4
+        elif tag < 0x40:
+            r, g, b, a = index[tag]
+        elif tag < 0x80:
+            r = (r + ((tag >> 4) & 3) - 2) % 256
+            g = (g + ((tag >> 2) & 3) - 2) % 256
+            b = (b + (tag & 3) - 2) % 256
+        else:
+            second = data[position]
+            position += 1
+            dg = (tag & 0x3f) - 32
+            r = (r + dg + (second >> 4) - 8) % 256
+            g = (g + dg) % 256
+            b = (b + dg + (second & 0x0f) - 8) % 256
+        index[_qoi_hash(r, g, b, a)] = (r, g, b, a)
+        colors.append((r, g, b, a))
+        repeats.append(1)
+        decoded += 1
+
+    out = numpy.array(colors, dtype=numpy.uint8).reshape(-1, 4).repeat(repeats, axis=0)[:count]
+    return out.reshape(height, width, 4).astype(numpy.float32) / 255.0
+
+################
+# WebP
+################
+
+def encode_webp(pixels, compress_level=6, lossless=True):
+    try:
+        from PIL import Image
+    except ImportError:
+        raise EncodingError("WebP output needs the Pillow python package installed in Blender's python.")
+    import io
+    buffer = io.BytesIO()
+    # Pillow's method goes from 0 (fast) to 6 (small), exact keeps colors under transparent pixels
+    Image.fromarray(to_uint8(pixels), "RGBA").save(buffer, "WEBP", lossless=lossless, exact=True,
+                                                  method=min(compress_level, 6))
+    return buffer.getvalue()
+
+def check_format(file_format):
+    """Raise EncodingError when file_format cannot be written here."""
+    if file_format not in EXTENSIONS:
+        raise EncodingError("Unknown output format " + str(file_format) + ".")
+    if file_format == "WEBP":
+        try:
+            import PIL
+        except ImportError:
+            raise EncodingError("WebP output needs the Pillow python package installed in Blender's python.")
+
+def encode(pixels, file_format, compress_level=6, indexed=False):
+    if file_format == "PNG":
+        return encode_png(pixels, compress_level, indexed)
+    if file_format == "QOI":
+        return encode_qoi(pixels)
+    if file_format == "WEBP":
+        return encode_webp(pixels, compress_level)
+    raise EncodingError("Unknown output format " + str(file_format) + ".")
+
+################
+# Writer
+################
+
+def write_file(path, data):
+    # write next to the target first, so a crash never leaves a half written frame
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+class AsyncImageWriter:
+    """Encodes and writes images on a pool of threads.
+
+    At most max_pending images wait to be written. write() blocks when the
+    limit is reached, which caps memory when encoding is slower than rendering.
+    """
+
+    def __init__(self, file_format="PNG", compress_level=6, indexed=False, threads=4, max_pending=8):
+        check_format(file_format)
+        self.file_format = file_format
+        self.compress_level = compress_level
+        self.indexed = indexed
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, threads))
+        self.slots = threading.BoundedSemaphore(max(1, max_pending))
+        self.futures = []
+
+    def write(self, path, pixels, on_done=None):
+        """Queue an image. on_done is called on the writer thread once the file is complete."""
+        self.slots.acquire()
+        # the caller may reuse its buffer as soon as this returns
+        pixels = numpy.array(pixels, dtype=numpy.float32, copy=True)
+        future = self.executor.submit(self._write, path, pixels, on_done)
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures.append(future)
+        # keep only unfinished futures around, and surface errors early
+        self.futures = [future for future in self.futures if not future.done() or future.exception() is not None]
+        self._raise_errors()
+
+    def _write(self, path, pixels, on_done):
+        write_file(path, encode(pixels, self.file_format, self.compress_level, self.indexed))
+        if on_done is not None:
+            on_done()
+
+    def _raise_errors(self):
+        for future in self.futures:
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+
+    def close(self):
+        """Wait for all pending images and raise the first error, if any."""
+        self.executor.shutdown(wait=True)
+        self._raise_errors()
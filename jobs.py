@@ -0,0 +1,309 @@
+# (c) 2023 Pururum LLC
+# This code is licensed under MIT license (see LICENSE for details)
+
+# Job files and work units for batch rendering.
+#
+# Nothing in this module imports bpy, so it can be used by the batch
+# coordinator before any scene is loaded and tested with plain python.
+
+import json
+import math
+import os
+
+################
+# Job Files
+################
+
+# Job file keys that map to SPRITEFRAMEGENERATOR_HT_Config properties, with their defaults.
+CONFIG_DEFAULTS = {
+    "render_resolution": [1920, 1080],
+    "render_directions": 4,
+    "render_fps": 30,
+    "render_in_memory": False,
+    "render_persistent_data": True,
+    "render_use_multiview": False,
+    "render_auto_border": "OFF",
+    "render_border_padding": 8,
+    "render_mirror": "OFF",
+    "render_mirror_check": False,
+    "render_mirror_tolerance": 0.01,
+    "animation_frame_step": 1,
+    "animation_start_frame": 1,
+    "animation_skip_held_frames": False,
+    "animation_sampling": "STEP",
+    "animation_frame_budget": 0,
+    "animation_max_pose_error": 2.0,
+    "output_path": "",
+    "output_use_cache": True,
+    "output_resume": False,
+    "output_deduplicate": False,
+    "output_format": "BLENDER",
+    "output_compression": 6,
+    "output_encoder_threads": 4,
+    "output_pass_normal": False,
+    "output_pass_depth": False,
+    "output_pass_mask": False,
+    "output_pass_index": False,
+    "output_depth_range": 4.0,
+    "output_palette": False,
+    "output_palette_size": 32,
+    "output_delta": False,
+    "output_delta_keyframe_interval": 30,
+    "output_archive": "OFF",
+    "output_profile": False,
+    "output_profile_chrome": False,
+    "output_atlas": False,
+    "output_atlas_max_size": 2048,
+    "output_atlas_padding": 1,
+    "composite_engine": "NODES",
+    "composite_pixel_size": 12.0,
+    "composite_color_palette_size": 30.0,
+    "composite_upscale": True,
+}
+
+# Job file keys that only control how the batch is run.
+JOB_DEFAULTS = {
+    # Names of the actions to render. None renders the actions selected in the blend file.
+    "actions": None,
+    # Number of worker processes. 0 uses one worker per core.
+    "workers": 0,
+    # Maximum number of frames in one work unit. 0 keeps every (action, direction) in one unit.
+    "frames_per_unit": 0,
+    # Names of the camera and the light that rotate around the character.
+    "camera": "Camera",
+    "light": "Light",
+    # Characters to render one after another in the same session, see character_jobs. None renders the scene as one character.
+    "characters": None,
+}
+
+# Keys of a character of a job, besides the config keys it overrides for itself.
+CHARACTER_DEFAULTS = {
+    # Name of the output folder of the character.
+    "name": None,
+    # The character is either everything in a collection or an armature with the objects parented to it.
+    "collection": None,
+    "armature": None,
+    # Names of the actions of the character. None uses the actions of the job.
+    "actions": None,
+    # Camera framing of the character. None keeps the camera of the blend file.
+    "camera_location": None,
+    "camera_lens": None,
+    "camera_ortho_scale": None,
+}
+
+class JobError(Exception):
+    """Raised when a job file cannot be used."""
+    pass
+
+def load_job(path):
+    """Read a JSON or TOML job file and fill in the defaults."""
+    with open(path, "rb") as f:
+        raw = f.read()
+
+    if path.lower().endswith(".toml"):
+        try:
+            import tomllib
+        except ImportError:
+            raise JobError("TOML job files need Python 3.11 or later. Use a JSON job file instead.")
+        data = tomllib.loads(raw.decode("utf-8"))
+    else:
+        data = json.loads(raw.decode("utf-8"))
+
+    unknown = set(data) - set(CONFIG_DEFAULTS) - set(JOB_DEFAULTS)
+    if unknown:
+        raise JobError("Unknown job file keys: " + ", ".join(sorted(unknown)))
+
+    job = dict(CONFIG_DEFAULTS)
+    job.update(JOB_DEFAULTS)
+    job.update(data)
+
+    # relative output paths are relative to the job file
+    if job["output_path"] and not os.path.isabs(job["output_path"]) and not job["output_path"].startswith("//"):
+        job["output_path"] = os.path.join(os.path.dirname(os.path.abspath(path)), job["output_path"])
+
+    return job
+
+def character_jobs(job):
+    """Return the job of every character of a job, or just the job when it lists no characters.
+
+    A character job is the job with the config keys of the character applied,
+    its actions and an output folder named after the character inside the
+    output folder of the job. Its "character" key holds the character with
+    the defaults filled in, and its "character_index" where it is in the job's
+    "characters", which are filled in the same way. Both are None for a job
+    without characters.
+    """
+    if not job["characters"]:
+        return [dict(job, character=None, character_index=None)]
+
+    characters = []
+    for character in job["characters"]:
+        unknown = set(character) - set(CHARACTER_DEFAULTS) - set(CONFIG_DEFAULTS)
+        if unknown:
+            raise JobError("Unknown character keys: " + ", ".join(sorted(unknown)))
+        if "output_path" in character:
+            raise JobError("Characters are written to folders named after them, they have no output_path.")
+        character = dict(CHARACTER_DEFAULTS, **character)
+        if not character["name"]:
+            raise JobError("Every character needs a name.")
+        if (character["collection"] is None) == (character["armature"] is None):
+            raise JobError("Character " + character["name"] + " needs either a collection or an armature.")
+        characters.append(character)
+    names = [character["name"] for character in characters]
+    if len(set(names)) != len(names):
+        raise JobError("Character names must be unique.")
+
+    result = []
+    for index, character in enumerate(characters):
+        character_job = dict(job)
+        character_job.update({key: value for key, value in character.items() if key in CONFIG_DEFAULTS})
+        character_job["characters"] = characters
+        character_job["character"] = character
+        character_job["character_index"] = index
+        if character["actions"] is not None:
+            character_job["actions"] = character["actions"]
+        character_job["output_path"] = os.path.join(job["output_path"], character["name"])
+        result.append(character_job)
+    return result
+
+def config_to_job(config):
+    """Make a job from the config keys of a SPRITEFRAMEGENERATOR_HT_Config."""
+    job = dict(JOB_DEFAULTS)
+    for key in CONFIG_DEFAULTS:
+        value = getattr(config, key)
+        if not isinstance(value, (bool, int, float, str)):
+            value = list(value)
+        job[key] = value
+    return job
+
+def apply_job_to_config(job, config):
+    """Copy the config keys of a job onto a SPRITEFRAMEGENERATOR_HT_Config."""
+    for key in CONFIG_DEFAULTS:
+        setattr(config, key, job[key])
+
+################
+# Work Units
+################
+
+def make_unit(action, directions, frame_start, frame_end):
+    return {"action": action, "directions": list(directions), "frame_start": frame_start, "frame_end": frame_end}
+
+def unit_key(unit):
+    # units of a character stay together, so workers switch characters as rarely as possible
+    return (unit.get("character", 0), unit["action"], unit["directions"], unit["frame_start"])
+
+def expand_work_units(action_ranges, directions, frame_step=1, frames_per_unit=0, group_directions=False):
+    """Expand (action name, first frame, last frame) tuples into work units.
+
+    Every unit renders one direction of one action over a frame range, or all
+    directions at once with group_directions. Ranges are split on multiples of
+    frame_step so that the split units render exactly the frames a single unit would.
+    """
+    units = []
+    for name, frame_start, frame_end in action_ranges:
+        if frames_per_unit > 0:
+            # round the chunk up to whole steps
+            chunk = max(1, math.ceil(frames_per_unit / frame_step)) * frame_step
+        else:
+            chunk = frame_end - frame_start + 1
+        chunk = max(chunk, 1)
+
+        if group_directions:
+            direction_groups = [list(range(directions))]
+        else:
+            direction_groups = [[direction] for direction in range(directions)]
+
+        for group in direction_groups:
+            start = frame_start
+            while start <= frame_end:
+                end = min(start + chunk - 1, frame_end)
+                units.append(make_unit(name, group, start, end))
+                start += chunk
+    return units
+
+def unit_originals(originals, frame_start, frame_end):
+    """Return the {frame: original} plan of the frames of a unit from the plan of its whole action.
+
+    Every frame maps to the frame whose image it shows, which is never after it.
+    Originals before the unit are rendered by another unit, so the first frame
+    of this unit showing one is rendered in its place.
+    """
+    plan = {}
+    firsts = {}
+    for frame in sorted(originals):
+        if frame < frame_start or frame > frame_end:
+            continue
+        original = originals[frame]
+        plan[frame] = original if original >= frame_start else firsts.setdefault(original, frame)
+    return plan
+
+def unit_frame_count(unit, frame_step=1):
+    return len(range(unit["frame_start"], unit["frame_end"] + 1, frame_step)) * len(unit["directions"])
+
+def shard_work_units(units, worker_count, frame_step=1):
+    """Split work units into worker_count shards with about the same number of frames.
+
+    Larger units are handed out first, each to the least loaded shard. Ties are
+    broken by shard index, so the same units always produce the same shards.
+    """
+    shards = [[] for _ in range(max(worker_count, 1))]
+    loads = [0] * len(shards)
+
+    ordered = sorted(units, key=lambda unit: (-unit_frame_count(unit, frame_step), unit_key(unit)))
+    for unit in ordered:
+        index = loads.index(min(loads))
+        shards[index].append(unit)
+        loads[index] += unit_frame_count(unit, frame_step)
+
+    for shard in shards:
+        shard.sort(key=unit_key)
+    return [shard for shard in shards if shard]
+
+def available_cores():
+    """Return the sorted ids of the cores this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def split_cores(cores, worker_count):
+    """Split a list of core ids into worker_count contiguous slices."""
+    cores = sorted(cores)
+    worker_count = max(1, min(worker_count, len(cores)))
+    size, extra = divmod(len(cores), worker_count)
+    slices = []
+    start = 0
+    for i in range(worker_count):
+        end = start + size + (1 if i < extra else 0)
+        slices.append(cores[start:end])
+        start = end
+    return slices
+
+################
+# Manifests
+################
+
+def merge_manifests(paths, frames=()):
+    """Merge the frame lists of several shard manifests and frames in (action, direction, frame) order."""
+    frames = list(frames)
+    for path in paths:
+        with open(path, "r") as f:
+            frames.extend(json.load(f)["frames"])
+    frames.sort(key=lambda frame: (frame["action"], frame["direction"], frame["frame"]))
+    return {"frames": frames}
+
+def split_characters(frames, character_count):
+    """Split frames tagged with the index of their character into one list per character, without the tags.
+
+    Untagged frames belong to the first character, the only one of a job without characters.
+    """
+    by_character = [[] for _ in range(character_count)]
+    for frame in frames:
+        by_character[frame.pop("character", 0)].append(frame)
+    return by_character
+
+def write_json(path, data):
+    """Write json next to the target first so readers never see a half written file."""
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
@@ -0,0 +1,110 @@
+# (c) 2023 Pururum LLC
+# This code is licensed under MIT license (see LICENSE for details)
+
+# Crash safe journal of rendered frames.
+#
+# Every frame that is completely on disk gets one line in journal.jsonl in the
+# output folder, with the size and sha256 of its file and the cache key of its
+# direction (see cache.py):
+#
+#   {"key": "...", "action": "Walk", "direction": 2, "frame": 14,
+#    "path": "Walk/direction_2/frame_0014.png", "size": 5321, "sha256": "..."}
+#
+# Lines are appended with a single write and synced to disk, so a crash loses
+# at most the line being written, and a torn last line is skipped on reading.
+# Several processes can append to the same journal. When rendering resumes,
+# frames whose entry matches the key and whose file still has the recorded size
+# and hash are kept, everything else is rendered again.
+# Nothing in this module imports bpy.
+
+import hashlib
+import json
+import os
+import threading
+
+JOURNAL_FILE = "journal.jsonl"
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def read_entries(path):
+    """Return the latest entry of every (key, action, direction, frame) in a journal file."""
+    entries = {}
+    if not os.path.exists(path):
+        return entries
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # torn line of a crashed write
+                continue
+            entries[(entry["key"], entry["action"], entry["direction"], entry["frame"])] = entry
+    return entries
+
+class Journal:
+    """Appends completed frames to the journal of an output folder."""
+
+    def __init__(self, output_path, compact=False):
+        self.output_path = output_path
+        self.path = os.path.join(output_path, JOURNAL_FILE)
+        self.lock = threading.Lock()
+        if compact:
+            self.compact()
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def compact(self):
+        """Rewrite the journal with only the latest entry of every frame. Only safe while nothing else appends."""
+        entries = read_entries(self.path)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            for entry in entries.values():
+                f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+    def record(self, key, record):
+        """Journal a frame record whose file is completely written.
+
+        Records of duplicate frames point to the file of another frame and are
+        journaled without a hash, they stay valid as long as that frame does.
+        """
+        entry = dict(record, key=key)
+        if "duplicate_of" not in record:
+            path = os.path.join(self.output_path, record["path"])
+            entry["size"] = os.path.getsize(path)
+            entry["sha256"] = file_digest(path)
+        data = (json.dumps(entry) + "\n").encode("utf-8")
+        with self.lock:
+            os.write(self.fd, data)
+            os.fsync(self.fd)
+
+    def completed_frames(self, key, action, direction):
+        """Return {frame: record} of the journaled frames of a direction whose files are intact."""
+        entries = read_entries(self.path)
+        frames = {}
+        for (entry_key, entry_action, entry_direction, frame), entry in entries.items():
+            if entry_key != key or entry_action != action or entry_direction != direction or "duplicate_of" in entry:
+                continue
+            path = os.path.join(self.output_path, entry["path"])
+            try:
+                if os.path.getsize(path) != entry["size"] or file_digest(path) != entry["sha256"]:
+                    continue
+            except OSError:
+                continue
+            frames[frame] = {name: value for name, value in entry.items() if name not in {"key", "size", "sha256"}}
+
+        for (entry_key, entry_action, entry_direction, frame), entry in entries.items():
+            if entry_key == key and entry_action == action and entry_direction == direction and entry.get("duplicate_of") in frames:
+                frames[frame] = {name: value for name, value in entry.items() if name != "key"}
+        return frames
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
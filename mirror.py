@@ -0,0 +1,49 @@
+# (c) 2023 Pururum LLC
+# This code is licensed under MIT license (see LICENSE for details)
+
+# Mirrored directions of symmetric characters.
+#
+# Direction j is rendered with the camera rotated by 2 pi (j + 1) / n around
+# the z axis, so direction n - 1 is the camera's starting position. When the
+# character is mirror symmetric across the plane through that position and
+# the z axis, direction j seen in a mirror is direction (-j - 2) mod n. Its
+# frames are the frames of that direction flipped horizontally, with the
+# mirrored action for actions that are not symmetric themselves.
+# Images are float arrays of shape (height, width, 4) with rows from top to
+# bottom. Nothing in this module imports bpy.
+
+import numpy
+
+def mirror_direction(directions, direction):
+    """Return the direction whose flipped frames are the frames of direction."""
+    return (-direction - 2) % directions
+
+def is_mirrored(directions, direction):
+    """Whether direction is made from another direction, one of every mirrored pair is rendered."""
+    return mirror_direction(directions, direction) < direction
+
+def flip_pixels(pixels, normals=False):
+    """Flip an image horizontally. Camera space normal maps also get their x component mirrored."""
+    pixels = numpy.ascontiguousarray(pixels[:, ::-1])
+    if normals:
+        # x is stored as 0.5 + x / 2
+        pixels[:, :, 0] = 1.0 - pixels[:, :, 0]
+    return pixels
+
+def mirrored_offset(offset, width, canvas_width):
+    """Return the offset in the full frame of a cropped frame after flipping the full frame."""
+    return [canvas_width - offset[0] - width, offset[1]]
+
+def place_on_canvas(pixels, offset, canvas_size):
+    """Return a cropped frame placed in its full frame, so frames with different crops can be compared."""
+    canvas = numpy.zeros((canvas_size[1], canvas_size[0], 4), dtype=numpy.float32)
+    x, y = offset
+    height, width = pixels.shape[:2]
+    canvas[y:y + height, x:x + width] = pixels[:canvas_size[1] - y, :canvas_size[0] - x]
+    return canvas
+
+def frame_difference(pixels, other):
+    """Mean absolute difference of two images, 1.0 when their sizes differ."""
+    if pixels.shape != other.shape:
+        return 1.0
+    return float(numpy.abs(pixels.astype(numpy.float32) - other.astype(numpy.float32)).mean())
@@ -0,0 +1,124 @@
+# (c) 2023 Pururum LLC
+# This code is licensed under MIT license (see LICENSE for details)
+
+# Shared palettes for all frames of a render.
+#
+# Opaque pixels sampled from every frame are split into boxes by median cut,
+# and the box averages are refined with a few rounds of k-means to give the
+# palette colors. Index 0 of a palette is always fully transparent.
+# Frames are mapped to the palette through a 3D lookup table from colors with
+# LUT_BITS bits per channel to the nearest palette index, so every pixel costs
+# one table lookup instead of a search over the palette.
+# Colors are uint8 RGBA like the pixels of written frames, alpha is rounded
+# to transparent or opaque. Nothing in this module imports bpy.
+
+import json
+
+import numpy
+
+PALETTE_FILE = "palette.json"
+
+# Bits per channel of the lookup table, 6 bits make a table of 64^3 entries.
+LUT_BITS = 6
+
+# Pixels with alpha from this value on are opaque.
+ALPHA_THRESHOLD = 128
+
+def sample_pixels(pixels, count, rng):
+    """Return up to count random opaque RGB colors of uint8 RGBA pixels."""
+    colors = pixels.reshape(-1, 4)
+    colors = colors[colors[:, 3] >= ALPHA_THRESHOLD, :3]
+    if len(colors) > count:
+        colors = colors[rng.choice(len(colors), count, replace=False)]
+    return colors
+
+def median_cut(colors, size):
+    """Split colors into up to size boxes at the median of their widest channel and return the box averages."""
+    boxes = [numpy.asarray(colors, dtype=numpy.float64)]
+    while len(boxes) < size:
+        # split the box with the largest spread, weighted by how many colors it holds
+        spreads = [(box.max(axis=0) - box.min(axis=0)).max() * len(box) if len(box) > 1 else 0.0 for box in boxes]
+        index = int(numpy.argmax(spreads))
+        if spreads[index] <= 0.0:
+            break
+        box = boxes.pop(index)
+        channel = int(numpy.argmax(box.max(axis=0) - box.min(axis=0)))
+        box = box[numpy.argsort(box[:, channel], kind="stable")]
+        boxes += [box[:len(box) // 2], box[len(box) // 2:]]
+    return numpy.array([box.mean(axis=0) for box in boxes if len(box)])
+
+def nearest_indices(colors, palette_colors, chunk_size=65536):
+    """Index of the nearest palette color of every color."""
+    colors = numpy.asarray(colors, dtype=numpy.float32)
+    palette_colors = numpy.asarray(palette_colors, dtype=numpy.float32)
+    indices = numpy.empty(len(colors), dtype=numpy.int64)
+    palette_norms = (palette_colors ** 2).sum(axis=1)
+    for start in range(0, len(colors), chunk_size):
+        chunk = colors[start:start + chunk_size]
+        # |c - p|^2 without the |c|^2 term, which is the same for every p
+        distances = palette_norms[None, :] - 2.0 * chunk @ palette_colors.T
+        indices[start:start + chunk_size] = distances.argmin(axis=1)
+    return indices
+
+def build_palette(colors, size, iterations=4):
+    """Return (n, 4) uint8 RGBA palette colors for the sampled RGB colors, index 0 transparent.
+
+    size is the number of opaque colors, at most 255.
+    """
+    colors = numpy.asarray(colors, dtype=numpy.float64).reshape(-1, 3)
+    opaque = numpy.zeros((0, 3))
+    if len(colors):
+        opaque = median_cut(colors, size)
+        for _ in range(iterations):
+            indices = nearest_indices(colors, opaque)
+            counts = numpy.bincount(indices, minlength=len(opaque))
+            sums = numpy.zeros_like(opaque)
+            numpy.add.at(sums, indices, colors)
+            # colors left without samples keep their place
+            opaque = numpy.where(counts[:, None] > 0, sums / numpy.maximum(counts, 1)[:, None], opaque)
+        opaque = numpy.unique(numpy.clip(numpy.round(opaque), 0, 255).astype(numpy.uint8), axis=0)
+    palette = numpy.zeros((len(opaque) + 1, 4), dtype=numpy.uint8)
+    palette[1:, :3] = opaque
+    palette[1:, 3] = 255
+    return palette
+
+def build_lut(palette):
+    """Return the (2^LUT_BITS,) * 3 table of the nearest opaque palette index of every color."""
+    levels = 1 << LUT_BITS
+    step = 256 // levels
+    # the center of the colors of every table cell
+    values = numpy.arange(levels) * step + (step - 1) / 2.0
+    grid = numpy.stack(numpy.meshgrid(values, values, values, indexing="ij"), axis=-1).reshape(-1, 3)
+    if len(palette) < 2:
+        return numpy.zeros((levels, levels, levels), dtype=numpy.uint8)
+    indices = nearest_indices(grid, palette[1:, :3]) + 1
+    return indices.astype(numpy.uint8).reshape(levels, levels, levels)
+
+def quantize(pixels, lut, palette=None):
+    """Map uint8 RGBA pixels to (height, width) uint8 palette indices.
+
+    With the palette, pixels that already have a palette color keep its index,
+    even when its lookup table cell is shared with another palette color.
+    """
+    shift = 8 - LUT_BITS
+    indices = lut[pixels[..., 0] >> shift, pixels[..., 1] >> shift, pixels[..., 2] >> shift]
+    if palette is not None and len(palette) > 1:
+        packed = _pack(pixels[..., :3])
+        palette_packed = _pack(palette[1:, :3])
+        order = numpy.argsort(palette_packed)
+        positions = numpy.minimum(numpy.searchsorted(palette_packed[order], packed), len(order) - 1)
+        exact = palette_packed[order][positions] == packed
+        indices = numpy.where(exact, order[positions] + 1, indices)
+    return numpy.where(pixels[..., 3] >= ALPHA_THRESHOLD, indices, 0).astype(numpy.uint8)
+
+def _pack(colors):
+    colors = colors.astype(numpy.uint32)
+    return (colors[..., 0] << 16) | (colors[..., 1] << 8) | colors[..., 2]
+
+def write_palette(path, palette):
+    with open(path, "w") as f:
+        json.dump({"colors": palette.tolist()}, f, indent=2)
+
+def read_palette(path):
+    with open(path, "r") as f:
+        return numpy.array(json.load(f)["colors"], dtype=numpy.uint8).reshape(-1, 4)
@@ -0,0 +1,143 @@
+# (c) 2023 Pururum LLC
+# This code is licensed under MIT license (see LICENSE for details)
+
+# Post render stages for frames kept in memory.
+#
+# A FramePipeline takes the pixels of every rendered frame straight from the
+# renderer and passes them through its stages in order. A stage is a callable
+# taking (record, pixels) and returning the pixels for the next stage, or None
+# to drop the frame. Pixels are float arrays of shape (height, width, 4) with
+# rows from top to bottom and straight alpha, in display color space.
+# Nothing in this module imports bpy.
+
+import os
+
+import numpy
+
+from . import atlas
+from . import dedupe
+from . import encoding
+from . import pixelart
+
+################
+# Color
+################
+
+def render_to_display(pixels, exposure=0.0, gamma=1.0, out=None):
+    """Convert premultiplied scene linear render pixels to straight alpha sRGB.
+
+    This is what the Standard view transform does with no look and no curves.
+    """
+    alpha = pixels[..., 3:4]
+    rgb = numpy.divide(pixels[..., :3], alpha, out=numpy.zeros_like(pixels[..., :3]), where=alpha > 0)
+    if exposure != 0.0:
+        rgb = rgb * numpy.float32(2.0 ** exposure)
+    rgb = pixelart.linear_to_srgb(rgb)
+    if gamma != 1.0:
+        rgb = numpy.power(rgb, numpy.float32(1.0 / gamma))
+
+    if out is None:
+        out = numpy.empty(pixels.shape, dtype=numpy.float32)
+    out[..., :3] = numpy.clip(rgb, 0.0, 1.0)
+    out[..., 3:] = numpy.clip(alpha, 0.0, 1.0)
+    return out
+
+################
+# Pipeline
+################
+
+class FramePipeline:
+    """Runs post render stages on frames as they come out of the renderer.
+
+    With a profiling.Profiler, every stage is timed under its class name.
+    """
+
+    def __init__(self, stages, profiler=None):
+        self.stages = list(stages)
+        self.profiler = profiler
+
+    def process(self, record, pixels):
+        for stage in self.stages:
+            if self.profiler is None:
+                pixels = stage(record, pixels)
+            else:
+                with self.profiler.stage(type(stage).__name__, frame=record["frame"]):
+                    pixels = stage(record, pixels)
+            if pixels is None:
+                return None
+        return pixels
+
+################
+# Stages
+################
+
+class PixelateStage:
+    """The numpy pixel art effect."""
+
+    def __init__(self, pixel_size, palette_size):
+        self.pixel_size = pixel_size
+        self.palette_size = palette_size
+
+    def __call__(self, record, pixels):
+        return pixelart.pixelate(pixels, self.pixel_size, self.palette_size)
+
+class NativePixelateStage:
+    """The numpy pixel art effect for frames rendered at one pixel per block."""
+
+    def __init__(self, palette_size, scale=1):
+        self.palette_size = palette_size
+        self.scale = scale
+
+    def __call__(self, record, pixels):
+        return pixelart.pixelate_native(pixels, self.palette_size, self.scale)
+
+class DeduplicateStage:
+    """Drops frames with the same pixels as an earlier frame and marks their records as duplicates."""
+
+    def __init__(self):
+        self.first_records = {}
+
+    def __call__(self, record, pixels):
+        original = self.first_records.setdefault(dedupe.pixel_key(pixels), record)
+        if original is record:
+            return pixels
+        record["path"] = original["path"]
+        record["duplicate_of"] = original["frame"]
+        return None
+
+class TrimStage:
+    """Keeps a trimmed copy of every frame so atlases can be packed without reading the frames back."""
+
+    def __init__(self, alpha_threshold=0.0):
+        self.alpha_threshold = alpha_threshold
+        # (direction, frame) -> (trimmed pixels, trim bounds, source size)
+        self.trimmed = {}
+
+    def __call__(self, record, pixels):
+        self.add(record, pixels)
+        return pixels
+
+    def add(self, record, pixels):
+        bounds = atlas.trim_bounds(pixels, self.alpha_threshold)
+        # copy, the renderer reuses its buffer for the next frame
+        self.trimmed[(record["direction"], record["frame"])] = (
+            atlas.crop(pixels, bounds).copy(), bounds, (pixels.shape[1], pixels.shape[0]))
+
+class EncodeStage:
+    """Hands frames to an encoding.AsyncImageWriter, which writes them while the next frame renders."""
+
+    def __init__(self, output_path, writer, on_written=None):
+        self.output_path = output_path
+        self.writer = writer
+        # called on a writer thread with the record of every frame once its file is complete
+        self.on_written = on_written
+
+    def __call__(self, record, pixels):
+        on_done = None
+        if self.on_written is not None:
+            on_done = lambda: self.on_written(record)
+        self.writer.write(os.path.join(self.output_path, record["path"]), pixels, on_done)
+        return pixels
+
+    def close(self):
+        self.writer.close()
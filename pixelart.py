@@ -0,0 +1,158 @@
+# (c) 2023 Pururum LLC
+# This code is licensed under MIT license (see LICENSE for details)
+
+# The pixel art effect of the compositor nodes, done with numpy.
+#
+# It follows the node chain built by SPRITEFRAMEGENERATOR_OT_CompositeNodes:
+# blur, scale down by the pixel size, pixelate, scale back up, round the HSV
+# value to the color palette size and round the alpha.
+#
+# Images are float arrays of shape (..., height, width, 4) with straight alpha,
+# so a batch of frames can be processed in one call. Every step is plain numpy
+# arithmetic in a fixed order, so the same input always gives the same output.
+#
+# Frames come in display sRGB, as written with the Standard view transform, but
+# the compositor blurs, averages and rounds in scene linear. So the colors are
+# converted to linear first and back to sRGB at the end. Values the view
+# transform clipped above 1 are not recovered, and other view transforms are
+# treated as Standard.
+# Nothing in this module imports bpy.
+
+import numpy
+
+def srgb_to_linear(values):
+    values = numpy.clip(values, 0.0, None)
+    return numpy.where(values <= 0.04045, values / numpy.float32(12.92),
+                       numpy.power((values + numpy.float32(0.055)) / numpy.float32(1.055), numpy.float32(2.4)))
+
+def linear_to_srgb(values):
+    values = numpy.clip(values, 0.0, None)
+    return numpy.where(values <= 0.0031308, values * numpy.float32(12.92),
+                       numpy.float32(1.055) * numpy.power(values, numpy.float32(1.0 / 2.4)) - numpy.float32(0.055))
+
+def to_linear(pixels):
+    return numpy.concatenate([srgb_to_linear(pixels[..., :3]), pixels[..., 3:]], axis=-1).astype(numpy.float32)
+
+def to_display(pixels):
+    return numpy.concatenate([numpy.clip(linear_to_srgb(pixels[..., :3]), 0.0, 1.0), pixels[..., 3:]], axis=-1).astype(numpy.float32)
+
+def round_half_up(values):
+    # same as the compositor's Round node, numpy.round would round halves to even
+    return numpy.floor(values + numpy.float32(0.5))
+
+def blur(pixels):
+    """A 3x3 gaussian blur, like a Blur node of size 1. Edges repeat the border pixels."""
+    weights = numpy.array([0.25, 0.5, 0.25], dtype=numpy.float32)
+
+    padded = numpy.concatenate([pixels[..., :1, :, :], pixels, pixels[..., -1:, :, :]], axis=-3)
+    pixels = weights[0] * padded[..., :-2, :, :] + weights[1] * padded[..., 1:-1, :, :] + weights[2] * padded[..., 2:, :, :]
+
+    padded = numpy.concatenate([pixels[..., :, :1, :], pixels, pixels[..., :, -1:, :]], axis=-2)
+    return weights[0] * padded[..., :, :-2, :] + weights[1] * padded[..., :, 1:-1, :] + weights[2] * padded[..., :, 2:, :]
+
+def downscale(pixels, block_size):
+    """Average every block_size x block_size block into one pixel.
+
+    Colors are averaged weighted by alpha, so transparent pixels do not darken
+    the edges of a sprite. Blocks on the right and bottom edges may be smaller.
+    """
+    height, width = pixels.shape[-3:-1]
+    out_height = -(-height // block_size)
+    out_width = -(-width // block_size)
+    pad = [(0, 0)] * (pixels.ndim - 3) + [(0, out_height * block_size - height), (0, out_width * block_size - width), (0, 0)]
+
+    alpha = pixels[..., 3:4]
+    weighted = numpy.concatenate([pixels[..., :3] * alpha, alpha, numpy.ones_like(alpha)], axis=-1)
+    weighted = numpy.pad(weighted, pad)
+
+    blocks = weighted.reshape(pixels.shape[:-3] + (out_height, block_size, out_width, block_size, 5))
+    sums = blocks.sum(axis=(-4, -2), dtype=numpy.float64)
+
+    alpha_sum = sums[..., 3:4]
+    count = sums[..., 4:5]
+    color = numpy.divide(sums[..., :3], alpha_sum, out=numpy.zeros_like(sums[..., :3]), where=alpha_sum > 0)
+    return numpy.concatenate([color, alpha_sum / count], axis=-1).astype(numpy.float32)
+
+def upscale(pixels, scale, height=None, width=None):
+    """Scale up with nearest neighbour sampling and crop to height x width."""
+    pixels = numpy.repeat(numpy.repeat(pixels, scale, axis=-3), scale, axis=-2)
+    if height is not None and width is not None:
+        pixels = pixels[..., :height, :width, :]
+    return pixels
+
+def sample_blocks(pixels, block_size):
+    """Keep the center pixel of every block_size x block_size block.
+
+    For data that cannot be averaged, like normals and object indices.
+    Blocks on the right and bottom edges may be smaller.
+    """
+    height, width = pixels.shape[-3:-1]
+    rows = numpy.minimum(numpy.arange(0, height, block_size) + block_size // 2, height - 1)
+    columns = numpy.minimum(numpy.arange(0, width, block_size) + block_size // 2, width - 1)
+    return pixels[..., rows[:, None], columns[None, :], :]
+
+def quantize_value(pixels, palette_size):
+    """Round the HSV value of every pixel to palette_size levels, keeping hue and saturation."""
+    rgb = pixels[..., :3]
+    value = rgb.max(axis=-1, keepdims=True)
+    quantized = round_half_up(value * numpy.float32(palette_size)) / numpy.float32(palette_size)
+    # scaling rgb keeps the hue and saturation of the pixel
+    scale = numpy.divide(quantized, value, out=numpy.zeros_like(value), where=value > 0)
+    return numpy.concatenate([rgb * scale, pixels[..., 3:]], axis=-1)
+
+def round_alpha(pixels):
+    alpha = numpy.clip(round_half_up(pixels[..., 3:]), 0.0, 1.0)
+    return numpy.concatenate([pixels[..., :3], alpha], axis=-1)
+
+def block_size(pixel_size):
+    """The side of the square of rendered pixels that becomes one pixel art pixel."""
+    return max(1, int(round_half_up(numpy.float32(pixel_size))))
+
+def pixelate(pixels, pixel_size, palette_size, use_blur=True, keep_size=True, linear=True):
+    """Apply the whole pixel art effect to an image or a batch of images.
+
+    With keep_size the result has the input size made of pixel_size blocks,
+    otherwise one pixel per block is returned. With linear, the effect is
+    applied in scene linear like the compositor does, otherwise to the sRGB
+    values as they are.
+    """
+    pixels = numpy.asarray(pixels, dtype=numpy.float32)
+    size = block_size(pixel_size)
+    height, width = pixels.shape[-3:-1]
+
+    if linear:
+        pixels = to_linear(pixels)
+    if use_blur:
+        pixels = blur(pixels)
+    pixels = downscale(pixels, size)
+    pixels = quantize_value(pixels, palette_size)
+    pixels = round_alpha(pixels)
+    if linear:
+        pixels = to_display(pixels)
+    if keep_size:
+        pixels = upscale(pixels, size, height, width)
+    return numpy.ascontiguousarray(pixels, dtype=numpy.float32)
+
+def pixelate_pass(pixels, pixel_size):
+    """Give a pass image, like a normal map, the blocks of a pixelated frame without changing its values."""
+    pixels = numpy.asarray(pixels, dtype=numpy.float32)
+    size = block_size(pixel_size)
+    height, width = pixels.shape[-3:-1]
+    return numpy.ascontiguousarray(upscale(sample_blocks(pixels, size), size, height, width), dtype=numpy.float32)
+
+def pixelate_native(pixels, palette_size, scale=1, linear=True):
+    """The pixel art effect for images rendered at one pixel per block.
+
+    Only the colors and alpha are rounded, in scene linear with linear, then
+    every pixel becomes a scale x scale block with nearest neighbour sampling.
+    """
+    pixels = numpy.asarray(pixels, dtype=numpy.float32)
+    if linear:
+        pixels = to_linear(pixels)
+    pixels = quantize_value(pixels, palette_size)
+    pixels = round_alpha(pixels)
+    if linear:
+        pixels = to_display(pixels)
+    if scale > 1:
+        pixels = upscale(pixels, scale)
+    return numpy.ascontiguousarray(pixels, dtype=numpy.float32)
@@ -0,0 +1,191 @@
+# (c) 2023 Pururum LLC
+# This code is licensed under MIT license (see LICENSE for details)
+
+# Stage timings and progress estimates for render jobs.
+#
+# A Profiler records every timed stage as one event and appends it to a JSON
+# lines file as it happens, so a crashed render still leaves its trace:
+#
+#   {"stage": "render", "start": 1700000000.12, "duration": 0.84, "pid": 4242,
+#    "thread": 1, "action": "Walk", "direction": 2, "frame": 14}
+#
+# start is wall clock time in seconds, so traces of several processes can be
+# merged. The render event of the first frame of every render call also has
+# "first": true, as that frame pays for syncing the scene to the renderer.
+# A merged trace can also be written as a Chrome trace event file, to open in
+# chrome://tracing or https://ui.perfetto.dev.
+# Nothing in this module imports bpy.
+
+import collections
+import contextlib
+import glob
+import json
+import os
+import statistics
+import threading
+import time
+
+# File name of the merged trace in the output folder, and the pattern of the traces of single processes.
+PROFILE_FILE = "profile.jsonl"
+PROCESS_PROFILE_PATTERN = "profile.*.jsonl"
+CHROME_TRACE_FILE = "profile.trace.json"
+
+class Profiler:
+    """Records timed stages, tagged with the current context such as the action and direction."""
+
+    def __init__(self, path=None):
+        self.events = []
+        self.context = {}
+        self.pid = os.getpid()
+        self.open_stages = {}
+        self.file = open(path, "w") if path else None
+
+    def set_context(self, **context):
+        self.context = {key: value for key, value in context.items() if value is not None}
+
+    @contextlib.contextmanager
+    def stage(self, name, **args):
+        start = time.time()
+        start_counter = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.perf_counter() - start_counter, **args)
+
+    def begin(self, name):
+        """Start a stage that ends in another callback, like a render_pre and render_post handler pair."""
+        self.open_stages[name] = (time.time(), time.perf_counter())
+
+    def end(self, name, **args):
+        if name not in self.open_stages:
+            return
+        start, start_counter = self.open_stages.pop(name)
+        self.add(name, start, time.perf_counter() - start_counter, **args)
+
+    def add(self, name, start, duration, **args):
+        event = {"stage": name, "start": start, "duration": duration, "pid": self.pid, "thread": threading.get_ident()}
+        event.update(self.context)
+        event.update(args)
+        self.events.append(event)
+        if self.file is not None:
+            self.file.write(json.dumps(event) + "\n")
+            self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+def read_events(path):
+    events = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                events.append(json.loads(line))
+    return events
+
+def merge_profiles(folder, chrome_trace=False):
+    """Merge the traces of every process in folder into PROFILE_FILE and optionally CHROME_TRACE_FILE.
+
+    Returns the merged events ordered by start time.
+    """
+    events = []
+    merged_path = os.path.join(folder, PROFILE_FILE)
+    paths = sorted(glob.glob(os.path.join(folder, PROCESS_PROFILE_PATTERN)))
+    for path in paths:
+        events.extend(read_events(path))
+    events.sort(key=lambda event: (event["start"], event["pid"]))
+
+    with open(merged_path, "w") as f:
+        for event in events:
+            f.write(json.dumps(event) + "\n")
+    for path in paths:
+        os.remove(path)
+    if chrome_trace:
+        write_chrome_trace(os.path.join(folder, CHROME_TRACE_FILE), events)
+    return events
+
+def warmup_summary(events):
+    """Return (render calls, warm-up seconds, median frame seconds) of the render events of a trace, or None.
+
+    The first frame of a render call also syncs the scene, builds the BVH and
+    compiles shaders, unless the renderer kept them from an earlier call. Its
+    warm-up is how much longer it took than the median frame.
+    """
+    renders = [event for event in events if event["stage"] == "render"]
+    if not renders:
+        return None
+    median = statistics.median(event["duration"] for event in renders)
+    firsts = [event for event in renders if event.get("first")]
+    return len(firsts), sum(max(0.0, event["duration"] - median) for event in firsts), median
+
+def warmup_line(events):
+    summary = warmup_summary(events)
+    if summary is None:
+        return None
+    calls, warmup, median = summary
+    return "Render warm-up %.1fs over %d render calls, %.2fs per frame after it" % (warmup, calls, median)
+
+def process_profile_path(folder, pid=None):
+    return os.path.join(folder, "profile.%d.jsonl" % (os.getpid() if pid is None else pid))
+
+def write_chrome_trace(path, events):
+    origin = min((event["start"] for event in events), default=0.0)
+    trace_events = []
+    for event in events:
+        args = {key: value for key, value in event.items() if key not in {"stage", "start", "duration", "pid", "thread"}}
+        trace_events.append({"name": event["stage"], "cat": "sprite_frame_generator", "ph": "X",
+                             "ts": (event["start"] - origin) * 1e6, "dur": event["duration"] * 1e6,
+                             "pid": event["pid"], "tid": event["thread"], "args": args})
+    with open(path, "w") as f:
+        json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, f)
+
+################
+# Progress
+################
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return "%dh %02dm" % (seconds // 3600, seconds % 3600 // 60)
+    if seconds >= 60:
+        return "%dm %02ds" % (seconds // 60, seconds % 60)
+    return "%ds" % seconds
+
+class ProgressEstimate:
+    """Estimates the time left from the rate of the most recently finished frames."""
+
+    def __init__(self, total_frames, window=30):
+        self.total_frames = total_frames
+        self.done_frames = 0
+        self.start_time = time.time()
+        self.finish_times = collections.deque(maxlen=window)
+
+    def frame_done(self, now=None):
+        self.done_frames += 1
+        self.finish_times.append(time.time() if now is None else now)
+
+    def skip(self, frames):
+        """Drop frames that will not be rendered after all, such as held frames."""
+        self.total_frames = max(self.done_frames, self.total_frames - frames)
+
+    def seconds_per_frame(self):
+        if len(self.finish_times) >= 2:
+            return (self.finish_times[-1] - self.finish_times[0]) / (len(self.finish_times) - 1)
+        if self.done_frames:
+            return (self.finish_times[-1] - self.start_time) / self.done_frames
+        return None
+
+    def seconds_left(self):
+        seconds_per_frame = self.seconds_per_frame()
+        if seconds_per_frame is None:
+            return None
+        return seconds_per_frame * max(0, self.total_frames - self.done_frames)
+
+    def status_line(self):
+        line = "Frames %d/%d" % (self.done_frames, self.total_frames)
+        seconds_per_frame = self.seconds_per_frame()
+        if seconds_per_frame is not None:
+            line += ", %.1fs per frame, %s left" % (seconds_per_frame, format_duration(self.seconds_left()))
+        return line
@@ -0,0 +1,143 @@
+# (c) 2023 Pururum LLC
+# This code is licensed under MIT license (see LICENSE for details)
+
+# Adaptive frame sampling from pose changes.
+#
+# A pose is an (n, 3) array of points, the heads and tails of every bone in
+# world space. A frame that is not rendered shows the last rendered frame
+# before it, so its error is how far its points are from the points of that
+# frame. The kept frames are the fewest that keep every error within the
+# allowed one, found by dynamic programming over where each run of held frames
+# ends, so the key poses of fast motions are kept while slow motions need few
+# frames. With a budget, the smallest error that budget reaches is searched.
+# Nothing in this module imports bpy.
+
+import numpy
+
+def bone_points(matrices, lengths, matrix_world):
+    """Return the (2 * bones, 3) world space heads and tails of bones.
+
+    matrices are the pose bone matrices as read by foreach_get, flat and in
+    blender's column major order, lengths the bone lengths.
+    """
+    matrices = numpy.asarray(matrices, dtype=numpy.float64).reshape(-1, 4, 4)
+    heads = matrices[:, 3, :3]
+    # the y axis of a bone points from its head to its tail
+    tails = heads + matrices[:, 1, :3] * numpy.asarray(lengths, dtype=numpy.float64)[:, None]
+    points = numpy.concatenate([heads, tails])
+    matrix_world = numpy.asarray(matrix_world, dtype=numpy.float64)
+    return points @ matrix_world[:3, :3].T + matrix_world[:3, 3]
+
+def pose_distances(poses, pose):
+    """Root mean square distance between the points of every pose in poses and the points of pose."""
+    return numpy.sqrt(((poses - pose) ** 2).sum(axis=-1).mean(axis=-1))
+
+def pose_deltas(poses):
+    """Change of the pose from the previous frame, 0 for the first frame."""
+    poses = numpy.asarray(poses, dtype=numpy.float64)
+    deltas = numpy.zeros(len(poses))
+    if len(poses) > 1:
+        deltas[1:] = pose_distances(poses[1:], poses[:-1])
+    return deltas
+
+def pose_size(poses):
+    """Diagonal of the box holding every point of every pose, to give errors relative to the character."""
+    points = numpy.asarray(poses, dtype=numpy.float64).reshape(-1, 3)
+    if len(points) == 0:
+        return 0.0
+    return float(numpy.linalg.norm(points.max(axis=0) - points.min(axis=0)))
+
+# Longest run of frames showing one pose. Bounds the hold errors to count * MAX_HOLD
+# entries instead of count * count, a pose that does not change is rendered again
+# every MAX_HOLD frames.
+MAX_HOLD = 256
+
+def hold_errors(poses, max_hold=MAX_HOLD):
+    """Return the (count, max_hold) errors of holding a pose.
+
+    errors[a, k] is the largest distance of the poses a to a + k from pose a,
+    the error of showing pose a until pose a + k + 1 is kept. It never
+    decreases along a row. Holds past the last pose are infinite.
+    """
+    count = len(poses)
+    window = max(1, min(max_hold, count))
+    errors = numpy.full((count, window), numpy.inf)
+    # one offset for every pose at once
+    for offset in range(window):
+        errors[:count - offset, offset] = pose_distances(poses[offset:], poses[:count - offset])
+    return numpy.maximum.accumulate(errors, axis=1)
+
+def fewest_poses(errors, max_error):
+    """Return the sorted indices of the fewest poses keeping every hold error within max_error."""
+    count = errors.shape[0]
+    # poses kept from every pose on when it is kept, and the kept pose after it
+    needed = numpy.zeros(count + 1, dtype=numpy.int64)
+    following = numpy.zeros(count, dtype=numpy.int64)
+    for start in range(count - 1, -1, -1):
+        # the hold can end at every pose up to the first one too far away
+        reach = max(1, int(numpy.searchsorted(errors[start], max_error, side="right")))
+        choices = needed[start + 1:start + 1 + reach]
+        # of equal choices the longest hold, so runs are filled from the front
+        best = len(choices) - 1 - int(numpy.argmin(choices[::-1]))
+        following[start] = start + 1 + best
+        needed[start] = 1 + choices[best]
+    kept = [0]
+    while following[kept[-1]] < count:
+        kept.append(int(following[kept[-1]]))
+    return kept
+
+def sample_poses(poses, budget=0, max_error=0.0):
+    """Return the sorted indices of the poses to render.
+
+    The first pose is always kept. The fewest poses are kept that leave every
+    other pose within max_error of the pose shown in its place. When that takes
+    more than budget poses, the budget poses with the smallest largest error are
+    kept instead. A budget of 0 sets no limit.
+    """
+    poses = numpy.asarray(poses, dtype=numpy.float64)
+    if len(poses) == 0:
+        return []
+    errors = hold_errors(poses)
+    kept = fewest_poses(errors, max_error)
+    if 0 < budget < len(kept):
+        # the largest error of the best budget poses is one of the hold errors, search them
+        candidates = numpy.unique(errors[numpy.isfinite(errors)])
+        low, high = 0, len(candidates) - 1
+        while low < high:
+            middle = (low + high) // 2
+            if len(fewest_poses(errors, candidates[middle])) <= budget:
+                high = middle
+            else:
+                low = middle + 1
+        kept = fewest_poses(errors, candidates[low])
+    return kept
+
+def hold_map(frame_numbers, kept_indices):
+    """Map every frame number to the kept frame at or before it."""
+    kept = set(kept_indices)
+    originals = {}
+    current = frame_numbers[0] if frame_numbers else None
+    for index, frame in enumerate(frame_numbers):
+        if index in kept:
+            current = frame
+        originals[frame] = current
+    return originals
+
+def frame_durations(frames, frame_step, fps):
+    """Return {frame: milliseconds} of the frames that start a run of frames showing the same image.
+
+    frames maps frame numbers to the frame whose image they show. Playing only
+    those frames for their durations reproduces the animation.
+    """
+    durations = {}
+    numbers = sorted(frames)
+    start = 0
+    while start < len(numbers):
+        end = start + 1
+        while end < len(numbers) and frames[numbers[end]] == frames[numbers[start]]:
+            end += 1
+        # the last frame is shown for one step
+        next_frame = numbers[end] if end < len(numbers) else numbers[-1] + frame_step
+        durations[numbers[start]] = int(round((next_frame - numbers[start]) * 1000.0 / fps))
+        start = end
+    return durations
@@ -0,0 +1,34 @@
+# (c) 2023 Pururum LLC
+# This code is licensed under MIT license (see LICENSE for details)
+
+# The addon package imports bpy, so the tests import its bpy free modules as
+# top level modules from the addon folder, and the addon folder is collected
+# as a plain folder instead of a package whose __init__.py pytest imports.
+
+import os
+import sys
+import types
+
+import pytest
+
+ADDON_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, ADDON_PATH)
+
+# modules with relative imports, like workers.py, are imported from this package,
+# which has the addon folder as its path but does not run its __init__.py
+ADDON_PACKAGE = "sprite_frame_generator_tests"
+package = types.ModuleType(ADDON_PACKAGE)
+package.__path__ = [ADDON_PATH]
+sys.modules.setdefault(ADDON_PACKAGE, package)
+
+class AddonFolder:
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_collect_directory(self, path, parent):
+        if str(path) == ADDON_PATH:
+            return pytest.Dir.from_parent(parent, path=path)
+        return None
+
+def pytest_configure(config):
+    # a hook of this conftest only sees the folders below it, a plugin sees the addon folder too
+    config.pluginmanager.register(AddonFolder(), "sprite_frame_generator_addon_folder")
@@ -0,0 +1,122 @@
+# (c) 2023 Pururum LLC
+# This code is licensed under MIT license (see LICENSE for details)
+
+import os
+
+import pytest
+
+import archive
+
+def record(frame, direction=0, action="walk", **extra):
+    entry = {"action": action, "direction": direction, "frame": frame,
+             "path": "%s/direction_%d/%04d.png" % (action, direction, frame)}
+    entry.update(extra)
+    return entry
+
+def write_files(folder, frames):
+    """Write loose frame files with the bytes b"frame <number>" and return their records."""
+    records = []
+    for frame in frames:
+        entry = record(frame)
+        path = os.path.join(folder, entry["path"])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"frame %d" % frame)
+        records.append(entry)
+    return records
+
+def test_frames_read_back_from_data_and_files(tmp_path):
+    path = str(tmp_path / archive.ARCHIVE_FILE)
+    records = write_files(str(tmp_path / "out"), [1, 2])
+    with archive.ArchiveWriter(path) as writer:
+        writer.add_file(records[0], str(tmp_path / "out" / records[0]["path"]), trim=(1, 2, 3, 4))
+        writer.add(records[1], data=b"second")
+    with archive.ArchiveReader(path) as reader:
+        assert bytes(reader.read("walk", 0, 1)) == b"frame 1"
+        assert bytes(reader.read("walk", 0, 2)) == b"second"
+        assert reader.entry("walk", 0, 1)["trim"] == [1, 2, 3, 4]
+        assert reader.entry("walk", 0, 1)["format"] == "PNG"
+
+def test_duplicates_point_to_the_bytes_they_repeat(tmp_path):
+    path = str(tmp_path / archive.ARCHIVE_FILE)
+    with archive.ArchiveWriter(path) as writer:
+        writer.add(record(1), data=b"pose", trim=(0, 0, 5, 5))
+        writer.add(record(2, duplicate_of=1))
+    with archive.ArchiveReader(path) as reader:
+        duplicate = reader.entry("walk", 0, 2)
+        assert bytes(reader.read("walk", 0, 2)) == b"pose"
+        assert duplicate["data_offset"] == reader.entry("walk", 0, 1)["data_offset"]
+        assert duplicate["trim"] == [0, 0, 5, 5]
+
+def test_duplicate_of_a_missing_frame_is_rejected(tmp_path):
+    with archive.ArchiveWriter(str(tmp_path / archive.ARCHIVE_FILE)) as writer:
+        with pytest.raises(archive.ArchiveError):
+            writer.add(record(2, duplicate_of=1))
+
+def test_passes_read_back_by_name(tmp_path):
+    path = str(tmp_path / archive.ARCHIVE_FILE)
+    normal = tmp_path / "normal.png"
+    normal.write_bytes(b"normal pass")
+    main = tmp_path / "main.png"
+    main.write_bytes(b"main")
+    entry = record(1, passes={"normal": "walk/direction_0/normal/0001.png"})
+    with archive.ArchiveWriter(path) as writer:
+        writer.add_file(entry, str(main), pass_paths={"normal": str(normal)})
+    with archive.ArchiveReader(path) as reader:
+        assert bytes(reader.read("walk", 0, 1)) == b"main"
+        assert bytes(reader.read("walk", 0, 1, "normal")) == b"normal pass"
+
+def test_frames_filter_and_sort(tmp_path):
+    path = str(tmp_path / archive.ARCHIVE_FILE)
+    with archive.ArchiveWriter(path) as writer:
+        for direction in (1, 0):
+            for frame in (3, 1, 2):
+                writer.add(record(frame, direction), data=b"x")
+        writer.add(record(1, action="idle"), data=b"x")
+    with archive.ArchiveReader(path) as reader:
+        assert reader.actions() == ["idle", "walk"]
+        assert [entry["frame"] for entry in reader.frames("walk", 1)] == [1, 2, 3]
+        assert len(reader.frames("walk")) == 6
+        assert len(reader.frames()) == 7
+
+def test_append_keeps_frames_and_replaces_added_again(tmp_path):
+    path = str(tmp_path / archive.ARCHIVE_FILE)
+    with archive.ArchiveWriter(path) as writer:
+        writer.add(record(1), data=b"old")
+        writer.add(record(2), data=b"kept")
+    with archive.ArchiveWriter(path, append=True) as writer:
+        writer.add(record(1), data=b"new")
+    with archive.ArchiveReader(path) as reader:
+        assert bytes(reader.read("walk", 0, 1)) == b"new"
+        assert bytes(reader.read("walk", 0, 2)) == b"kept"
+        assert len(reader.frames()) == 2
+
+def test_extract_restores_the_folder_layout(tmp_path):
+    path = str(tmp_path / archive.ARCHIVE_FILE)
+    records = write_files(str(tmp_path / "out"), [1, 2])
+    with archive.ArchiveWriter(path) as writer:
+        for entry in records:
+            writer.add_file(entry, str(tmp_path / "out" / entry["path"]))
+        writer.add(record(3, duplicate_of=2))
+    with archive.ArchiveReader(path) as reader:
+        assert reader.extract(str(tmp_path / "extracted")) == 2
+    for entry in records:
+        extracted = tmp_path / "extracted" / entry["path"]
+        assert extracted.read_bytes() == (tmp_path / "out" / entry["path"]).read_bytes()
+    assert not (tmp_path / "extracted" / record(3)["path"]).exists()
+
+def test_unclosed_archive_is_rejected(tmp_path):
+    path = str(tmp_path / archive.ARCHIVE_FILE)
+    writer = archive.ArchiveWriter(path)
+    writer.add(record(1), data=b"frame")
+    writer.file.flush()
+    with pytest.raises(archive.ArchiveError):
+        archive.ArchiveReader(path)
+    writer.discard()
+    assert not os.path.exists(path)
+
+def test_other_files_are_rejected(tmp_path):
+    path = tmp_path / "frame.png"
+    path.write_bytes(b"\x89PNG" + bytes(100))
+    with pytest.raises(archive.ArchiveError):
+        archive.ArchiveReader(str(path))
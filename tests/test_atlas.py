@@ -0,0 +1,50 @@
+# (c) 2023 Pururum LLC
+# This code is licensed under MIT license (see LICENSE for details)
+
+import numpy
+import pytest
+
+import atlas
+
+def image(height, width, box):
+    pixels = numpy.zeros((height, width, 4), dtype=numpy.float32)
+    x, y, box_width, box_height = box
+    pixels[y:y + box_height, x:x + box_width] = 1.0
+    return pixels
+
+def overlaps(a, b):
+    return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
+def test_trim_bounds():
+    assert atlas.trim_bounds(image(10, 10, (2, 3, 4, 5))) == (2, 3, 4, 5)
+    assert atlas.trim_bounds(numpy.zeros((4, 4, 4))) == (0, 0, 1, 1)
+
+def test_pack_rects_uses_power_of_two_pages_without_overlaps():
+    sizes = [(30, 20), (10, 10), (25, 40), (5, 60)]
+    pages = atlas.pack_rects(sizes, max_size=256, padding=1)
+    assert len(pages) == 1
+    width, height, positions = pages[0]
+    assert width & (width - 1) == 0 and height & (height - 1) == 0
+    rects = [(x, y, sizes[index][0] + 1, sizes[index][1] + 1) for index, (x, y) in positions.items()]
+    assert sorted(positions) == [0, 1, 2, 3]
+    for rect in rects:
+        assert rect[0] + rect[2] <= width and rect[1] + rect[3] <= height
+    assert not any(overlaps(a, b) for i, a in enumerate(rects) for b in rects[i + 1:])
+
+def test_pack_rects_spills_onto_more_pages():
+    pages = atlas.pack_rects([(60, 60)] * 3, max_size=64, padding=1)
+    assert len(pages) == 3
+
+def test_pack_rects_rejects_frames_larger_than_a_page():
+    with pytest.raises(ValueError):
+        atlas.pack_rects([(100, 10)], max_size=64)
+
+def test_build_atlases_records_trim_and_rects():
+    images = [image(16, 16, (4, 4, 8, 8)), image(16, 16, (0, 0, 3, 5))]
+    frames = [{"frame": 1}, {"frame": 2}]
+    pages, metadata = atlas.build_atlases(frames, images, max_size=64)
+    first = metadata["frames"][0]
+    assert first["frame"] == 1 and first["trim"] == [4, 4] and first["source_size"] == [16, 16]
+    x, y, width, height = first["rect"]
+    assert (width, height) == (8, 8)
+    assert (pages[first["atlas"]][y:y + height, x:x + width] == 1.0).all()
@@ -0,0 +1,74 @@
+# (c) 2023 Pururum LLC
+# This code is licensed under MIT license (see LICENSE for details)
+
+import os
+
+import numpy
+
+import cache
+
+def key(*values):
+    return cache.Fingerprint().update(*values).hexdigest()
+
+def test_same_values_give_the_same_key():
+    values = ("walk", 3, 0.5, None, [1, 2], numpy.arange(6, dtype=numpy.float32))
+    assert key(*values) == key(*values)
+
+def test_keys_tell_values_apart():
+    assert key("ab", "c") != key("a", "bc")
+    assert key(1) != key("1")
+    assert key(1) != key(1.0)
+    assert key([1, 2]) != key([[1, 2]])
+    assert key(None) != key("None")
+
+def test_arrays_hash_dtype_and_shape():
+    values = numpy.arange(6)
+    assert key(values.astype(numpy.float32)) != key(values.astype(numpy.float64))
+    assert key(values.reshape(2, 3)) != key(values.reshape(3, 2))
+    # views hash their values, not their memory layout
+    assert key(values.reshape(2, 3).T) == key(numpy.ascontiguousarray(values.reshape(2, 3).T))
+
+def test_sets_hash_in_any_order():
+    assert key({"b", "a", "c"}) == key({"c", "a", "b"})
+
+def frames(output_path, count=2):
+    records = []
+    for frame in range(1, count + 1):
+        path = "walk/direction_0/%04d.png" % frame
+        os.makedirs(os.path.join(output_path, os.path.dirname(path)), exist_ok=True)
+        with open(os.path.join(output_path, path), "wb") as f:
+            f.write(b"frame")
+        records.append({"action": "walk", "direction": 0, "frame": frame, "path": path})
+    return records
+
+def test_cached_frames_hit_on_the_same_key(tmp_path):
+    folder = str(tmp_path / "walk" / "direction_0")
+    records = frames(str(tmp_path))
+    cache.write_cached_frames(folder, "key", records)
+    assert os.path.exists(str(tmp_path / "walk" / "direction_0.cache.json"))
+    assert cache.read_cached_frames(folder, "key", str(tmp_path)) == records
+
+def test_cached_frames_miss_on_another_key(tmp_path):
+    folder = str(tmp_path / "walk" / "direction_0")
+    cache.write_cached_frames(folder, "key", frames(str(tmp_path)))
+    assert cache.read_cached_frames(folder, "other", str(tmp_path)) is None
+
+def test_cached_frames_miss_when_a_file_is_gone(tmp_path):
+    folder = str(tmp_path / "walk" / "direction_0")
+    records = frames(str(tmp_path))
+    records[0]["passes"] = {"normal": "walk/direction_0/normal/0001.png"}
+    cache.write_cached_frames(folder, "key", records)
+    # the pass file was never written
+    assert cache.read_cached_frames(folder, "key", str(tmp_path)) is None
+    del records[0]["passes"]
+    cache.write_cached_frames(folder, "key", records)
+    os.remove(os.path.join(str(tmp_path), records[1]["path"]))
+    assert cache.read_cached_frames(folder, "key", str(tmp_path)) is None
+
+def test_missing_or_broken_manifests_miss(tmp_path):
+    folder = str(tmp_path / "direction_0")
+    assert cache.read_cached_frames(folder, "key", str(tmp_path)) is None
+    with open(cache.cache_path(folder), "w") as f:
+        f.write("{")
+    assert cache.read_cache_manifest(folder) is None
+    assert cache.read_cached_frames(folder, "key", str(tmp_path)) is None
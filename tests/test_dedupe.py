@@ -0,0 +1,35 @@
+# (c) 2023 Pururum LLC
+# This code is licensed under MIT license (see LICENSE for details)
+
+import numpy
+
+import dedupe
+
+def test_pose_keys_ignore_float_noise_and_negative_zero():
+    pose = numpy.eye(4, dtype=numpy.float32)
+    noisy = pose + numpy.float32(1e-7)
+    noisy[0, 1] = -0.0
+    assert dedupe.pose_key([pose]) == dedupe.pose_key([noisy])
+
+def test_pose_keys_tell_poses_apart():
+    pose = numpy.eye(4)
+    moved = pose.copy()
+    moved[0, 3] = 0.01
+    assert dedupe.pose_key([pose]) != dedupe.pose_key([moved])
+
+def test_array_keys_include_the_shape():
+    values = numpy.arange(6)
+    assert dedupe.array_key([values.reshape(2, 3)]) != dedupe.array_key([values.reshape(3, 2)])
+    assert dedupe.array_key([values[:3], values[3:]]) != dedupe.array_key([values])
+
+def test_pixel_keys_are_exact():
+    pixels = numpy.zeros((2, 2, 4), dtype=numpy.float32)
+    changed = pixels.copy()
+    changed[1, 1, 0] = 1e-7
+    assert dedupe.pixel_key(pixels) == dedupe.pixel_key(pixels.copy())
+    assert dedupe.pixel_key(pixels) != dedupe.pixel_key(changed)
+
+def test_frame_runs_follow_the_frame_step():
+    assert dedupe.frame_runs([1, 2, 3, 5, 6, 9]) == [(1, 3), (5, 6), (9, 9)]
+    assert dedupe.frame_runs([1, 3, 5, 6], frame_step=2) == [(1, 5), (6, 6)]
+    assert dedupe.frame_runs([]) == []
@@ -0,0 +1,82 @@
+# (c) 2023 Pururum LLC
+# This code is licensed under MIT license (see LICENSE for details)
+
+import os
+
+import numpy
+import pytest
+
+import delta
+
+def animation(count=8, size=40):
+    """A square moving one pixel right every frame."""
+    frames = []
+    for i in range(count):
+        pixels = numpy.zeros((size, size, 4), dtype=numpy.uint8)
+        pixels[10:20, 5 + i:15 + i] = [200, 100, 50, 255]
+        frames.append(pixels)
+    return frames
+
+def write(path, frames, keyframe_interval=30):
+    with delta.DeltaWriter(path, keyframe_interval) as writer:
+        for number, pixels in enumerate(frames):
+            writer.add(number + 1, pixels)
+
+def test_changed_rects_shrink_to_changed_pixels():
+    previous, current = animation(2)
+    assert delta.changed_rects(previous, current) == [(5, 10, 11, 10)]
+
+def test_changed_rects_keep_distant_changes_apart():
+    previous = numpy.zeros((40, 40, 4), dtype=numpy.uint8)
+    current = previous.copy()
+    current[1, 1] = 255
+    current[35, 36] = 255
+    assert sorted(delta.changed_rects(previous, current)) == [(1, 1, 1, 1), (36, 35, 1, 1)]
+
+def test_tile_rects_merge_runs_downwards():
+    tiles = numpy.array([[True, True, False], [True, True, False], [False, False, True]])
+    assert sorted(delta.tile_rects(tiles)) == [(0, 0, 2, 2), (2, 2, 1, 1)]
+
+def test_frames_read_back_in_order_and_out_of_order(tmp_path):
+    path = str(tmp_path / "walk.sfgdelta")
+    frames = animation()
+    write(path, frames, keyframe_interval=3)
+    reader = delta.DeltaReader(path)
+    assert len(reader) == len(frames)
+    for number, pixels in reader.frames():
+        numpy.testing.assert_array_equal(pixels, frames[number - 1])
+    for number in [5, 2, 8, 1]:
+        numpy.testing.assert_array_equal(reader.read(number), frames[number - 1])
+
+def test_deltas_are_smaller_than_keyframes(tmp_path):
+    keyed = str(tmp_path / "keyed.sfgdelta")
+    deltas = str(tmp_path / "deltas.sfgdelta")
+    write(keyed, animation(), keyframe_interval=1)
+    write(deltas, animation())
+    assert os.path.getsize(deltas) < os.path.getsize(keyed)
+
+def test_size_changes_start_a_keyframe(tmp_path):
+    path = str(tmp_path / "sizes.sfgdelta")
+    large = numpy.full((20, 30, 4), 200, dtype=numpy.uint8)
+    small = numpy.full((10, 12, 4), 50, dtype=numpy.uint8)
+    write(path, [large, small, large])
+    reader = delta.DeltaReader(path)
+    assert (reader.width, reader.height) == (30, 20)
+    pixels = reader.read(2)
+    assert (pixels[:10, :12] == 50).all()
+    assert (pixels[10:] == 0).all() and (pixels[:, 12:] == 0).all()
+    numpy.testing.assert_array_equal(reader.read(3), large)
+
+def test_unfinished_sequences_are_not_kept(tmp_path):
+    path = str(tmp_path / "broken.sfgdelta")
+    with pytest.raises(RuntimeError):
+        with delta.DeltaWriter(path) as writer:
+            writer.add(1, animation(1)[0])
+            raise RuntimeError()
+    assert os.listdir(str(tmp_path)) == []
+
+def test_reader_rejects_other_files(tmp_path):
+    path = tmp_path / "other.sfgdelta"
+    path.write_bytes(b"\x00" * 64)
+    with pytest.raises(delta.DeltaError):
+        delta.DeltaReader(str(path))
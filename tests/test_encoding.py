@@ -0,0 +1,136 @@
+# (c) 2023 Pururum LLC
+# This code is licensed under MIT license (see LICENSE for details)
+
+import struct
+import zlib
+
+import numpy
+import pytest
+
+import encoding
+
+def sprite(height=5, width=7):
+    rng = numpy.random.default_rng(1)
+    pixels = numpy.round(rng.random((height, width, 4)) * 255.0) / 255.0
+    pixels[0, :] = 0.0
+    return pixels.astype(numpy.float32)
+
+def png_chunks(data):
+    chunks = {}
+    position = 8
+    while position < len(data):
+        length, chunk_type = struct.unpack(">I4s", data[position:position + 8])
+        chunks.setdefault(chunk_type, b"")
+        chunks[chunk_type] += data[position + 8:position + 8 + length]
+        position += 12 + length
+    return chunks
+
+def paeth(left, up, up_left):
+    estimate = left + up - up_left
+    distances = [abs(estimate - left), abs(estimate - up), abs(estimate - up_left)]
+    return [left, up, up_left][distances.index(min(distances))]
+
+def qoi_ops(rgba):
+    """The ops of the QOI reference encoder, one pixel at a time."""
+    out = bytearray()
+    index = [None] * 64
+    previous = (0, 0, 0, 255)
+    run = 0
+    for pixel in rgba:
+        if pixel == previous:
+            run += 1
+            if run == 62:
+                out.append(0xc0 | 61)
+                run = 0
+            continue
+        if run:
+            out.append(0xc0 | (run - 1))
+            run = 0
+        r, g, b, a = pixel
+        position = (r * 3 + g * 5 + b * 7 + a * 11) % 64
+        if index[position] == pixel:
+            out.append(position)
+        else:
+            index[position] = pixel
+            dr, dg, db = [(value - old + 128) % 256 - 128 for value, old in zip(pixel[:3], previous[:3])]
+            if a != previous[3]:
+                out += bytes((0xff, r, g, b, a))
+            elif -2 <= dr <= 1 and -2 <= dg <= 1 and -2 <= db <= 1:
+                out.append(0x40 | (dr + 2) << 4 | (dg + 2) << 2 | (db + 2))
+            elif -32 <= dg <= 31 and -8 <= dr - dg <= 7 and -8 <= db - dg <= 7:
+                out += bytes((0x80 | (dg + 32), (dr - dg + 8) << 4 | (db - dg + 8)))
+            else:
+                out += bytes((0xfe, r, g, b))
+        previous = pixel
+    if run:
+        out.append(0xc0 | (run - 1))
+    return bytes(out)
+
+def test_to_uint8_rounds_and_clips():
+    assert encoding.to_uint8(numpy.array([-1.0, 0.5, 2.0])).tolist() == [0, 128, 255]
+
+def test_qoi_round_trip():
+    pixels = sprite()
+    numpy.testing.assert_array_equal(encoding.decode_qoi(encoding.encode_qoi(pixels)), pixels)
+
+def qoi_cases():
+    rng = numpy.random.default_rng(2)
+    yield sprite()
+    # long runs, also of the start pixel, and runs over the 62 pixel limit
+    pixels = numpy.zeros((40, 50, 4), dtype=numpy.float32)
+    pixels[..., 3] = 1.0
+    pixels[10:30, 5:45] = (0.5, 0.25, 0.75, 1.0)
+    yield pixels
+    # few colors for index hits, small steps for diff and luma ops, alpha changes for RGBA ops
+    yield rng.random((3, 4)).astype(numpy.float32)[rng.integers(0, 3, (30, 30))]
+    steps = numpy.cumsum(rng.integers(-20, 21, (30, 30, 4)), axis=1) % 256 / 255.0
+    steps[..., 3] = numpy.where(rng.random((30, 30)) < 0.1, 0.5, 1.0)
+    yield steps.astype(numpy.float32)
+
+@pytest.mark.parametrize("pixels", list(qoi_cases()))
+def test_qoi_matches_the_reference_encoder(pixels):
+    rgba = [tuple(pixel) for pixel in encoding.to_uint8(pixels).reshape(-1, 4).tolist()]
+    data = encoding.encode_qoi(pixels)
+    assert data[14:-8] == qoi_ops(rgba)
+    numpy.testing.assert_array_equal(encoding.to_uint8(encoding.decode_qoi(data)), encoding.to_uint8(pixels))
+
+def test_decode_qoi_rejects_other_files():
+    with pytest.raises(encoding.EncodingError):
+        encoding.decode_qoi(b"\x89PNG" + b"\x00" * 20)
+
+@pytest.mark.parametrize("compress_level", [1, 6])
+def test_png_unfilters_to_the_pixels(compress_level):
+    pixels = sprite()
+    data = encoding.encode_png(pixels, compress_level)
+    assert data.startswith(b"\x89PNG\r\n\x1a\n")
+    chunks = png_chunks(data)
+    width, height = struct.unpack(">II", chunks[b"IHDR"][:8])
+    assert (width, height) == (7, 5)
+
+    raw = numpy.frombuffer(zlib.decompress(chunks[b"IDAT"]), dtype=numpy.uint8).reshape(height, 1 + width * 4)
+    rows = numpy.zeros((height, width * 4), dtype=numpy.int64)
+    for y in range(height):
+        previous = rows[y - 1].tolist() if y else [0] * (width * 4)
+        for x in range(width * 4):
+            left = int(rows[y, x - 4]) if x >= 4 else 0
+            up_left = previous[x - 4] if x >= 4 else 0
+            predictor = [0, left, previous[x], (left + previous[x]) // 2,
+                         paeth(left, previous[x], up_left)][raw[y, 0]]
+            rows[y, x] = (int(raw[y, 1 + x]) + predictor) % 256
+    numpy.testing.assert_array_equal(rows.reshape(height, width, 4), encoding.to_uint8(pixels))
+
+def test_indexed_png_has_a_palette():
+    pixels = numpy.zeros((4, 4, 4), dtype=numpy.float32)
+    pixels[:2, :, :] = [1.0, 0.0, 0.0, 1.0]
+    chunks = png_chunks(encoding.encode_png(pixels, indexed=True))
+    assert len(chunks[b"PLTE"]) == 2 * 3
+    assert b"tRNS" in chunks
+
+def test_palette_indices_give_up_on_too_many_colors():
+    assert encoding.palette_indices(encoding.to_uint8(sprite()), max_colors=4) is None
+
+def test_encode_rejects_unknown_formats():
+    with pytest.raises(encoding.EncodingError):
+        encoding.encode(sprite(), "BMP")
+    with pytest.raises(encoding.EncodingError):
+        encoding.check_format("BMP")
@@ -0,0 +1,76 @@
+# (c) 2023 Pururum LLC
+# This code is licensed under MIT license (see LICENSE for details)
+
+import os
+
+import pytest
+
+import jobs
+
+def test_unit_originals_keep_originals_inside_the_unit():
+    originals = {1: 1, 2: 1, 3: 3, 4: 3, 5: 5}
+    assert jobs.unit_originals(originals, 3, 5) == {3: 3, 4: 3, 5: 5}
+
+def test_unit_originals_render_held_runs_crossing_the_start():
+    originals = {1: 1, 2: 1, 3: 1, 4: 1, 5: 5}
+    assert jobs.unit_originals(originals, 3, 5) == {3: 3, 4: 3, 5: 5}
+
+def test_unit_originals_share_one_render_of_an_earlier_pose():
+    # frames 4 and 6 repeat the pose of frame 1, which another unit renders
+    originals = {1: 1, 2: 2, 3: 3, 4: 1, 5: 5, 6: 1}
+    assert jobs.unit_originals(originals, 4, 6) == {4: 4, 5: 5, 6: 4}
+
+def test_expand_work_units_splits_on_frame_steps():
+    units = jobs.expand_work_units([("Walk", 1, 10)], 2, frame_step=2, frames_per_unit=3)
+    assert [(unit["directions"], unit["frame_start"], unit["frame_end"]) for unit in units] == [
+        ([0], 1, 4), ([0], 5, 8), ([0], 9, 10), ([1], 1, 4), ([1], 5, 8), ([1], 9, 10)]
+    split = {frame for unit in units if unit["directions"] == [0]
+             for frame in range(unit["frame_start"], unit["frame_end"] + 1, 2)}
+    assert split == set(range(1, 11, 2))
+
+def test_expand_work_units_groups_directions():
+    units = jobs.expand_work_units([("Walk", 1, 10), ("Run", 1, 4)], 4, group_directions=True)
+    assert [(unit["action"], unit["directions"]) for unit in units] == [("Walk", [0, 1, 2, 3]), ("Run", [0, 1, 2, 3])]
+
+def test_shard_work_units_balances_frames():
+    units = [jobs.make_unit("Walk", [direction], 1, 10) for direction in range(4)] + [jobs.make_unit("Idle", [0], 1, 20)]
+    shards = jobs.shard_work_units(units, 3)
+    loads = sorted(sum(jobs.unit_frame_count(unit) for unit in shard) for shard in shards)
+    assert loads == [20, 20, 20]
+    assert shards == jobs.shard_work_units(list(reversed(units)), 3)
+
+def test_split_cores_covers_every_core_once():
+    assert jobs.split_cores([3, 0, 1, 2, 4], 2) == [[0, 1, 2], [3, 4]]
+    assert jobs.split_cores([0, 1], 4) == [[0], [1]]
+
+def test_load_job_fills_defaults_and_resolves_output(tmp_path):
+    path = tmp_path / "job.json"
+    path.write_text('{"output_path": "out", "frames_per_unit": 8}')
+    job = jobs.load_job(str(path))
+    assert job["frames_per_unit"] == 8
+    assert job["output_path"] == os.path.join(str(tmp_path), "out")
+    assert job["render_directions"] == jobs.CONFIG_DEFAULTS["render_directions"]
+
+def test_load_job_rejects_unknown_keys(tmp_path):
+    path = tmp_path / "job.json"
+    path.write_text('{"render_direction": 8}')
+    with pytest.raises(jobs.JobError):
+        jobs.load_job(str(path))
+
+def test_character_jobs_write_to_character_folders():
+    job = dict(jobs.CONFIG_DEFAULTS, **jobs.JOB_DEFAULTS)
+    job.update(output_path="out", characters=[{"name": "Knight", "armature": "KnightRig", "render_directions": 8},
+                                              {"name": "Mage", "collection": "Mage"}])
+    knight, mage = jobs.character_jobs(job)
+    assert knight["output_path"] == os.path.join("out", "Knight") and knight["render_directions"] == 8
+    assert mage["character_index"] == 1 and mage["render_directions"] == job["render_directions"]
+
+def test_character_jobs_need_one_source():
+    job = dict(jobs.CONFIG_DEFAULTS, **jobs.JOB_DEFAULTS)
+    job["characters"] = [{"name": "Knight"}]
+    with pytest.raises(jobs.JobError):
+        jobs.character_jobs(job)
+
+def test_split_characters_untags_frames():
+    frames = [{"frame": 1, "character": 1}, {"frame": 2}]
+    assert jobs.split_characters(frames, 2) == [[{"frame": 2}], [{"frame": 1}]]
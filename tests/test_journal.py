@@ -0,0 +1,76 @@
+# (c) 2023 Pururum LLC
+# This code is licensed under MIT license (see LICENSE for details)
+
+import os
+
+import journal
+
+def write_frame(output_path, frame, data=b"pixels"):
+    record = {"action": "walk", "direction": 0, "frame": frame, "path": "walk/direction_0/frame_%04d.png" % frame}
+    path = os.path.join(output_path, record["path"])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    return record
+
+def test_recorded_frames_are_completed(tmp_path):
+    output_path = str(tmp_path)
+    records = [write_frame(output_path, frame) for frame in (1, 2)]
+    log = journal.Journal(output_path)
+    for record in records:
+        log.record("key", record)
+    assert log.completed_frames("key", "walk", 0) == {1: records[0], 2: records[1]}
+    log.close()
+
+def test_frames_of_other_keys_and_directions_are_not_completed(tmp_path):
+    output_path = str(tmp_path)
+    log = journal.Journal(output_path)
+    log.record("old", write_frame(output_path, 1))
+    assert log.completed_frames("new", "walk", 0) == {}
+    assert log.completed_frames("old", "walk", 1) == {}
+    log.close()
+
+def test_changed_or_missing_files_are_rendered_again(tmp_path):
+    output_path = str(tmp_path)
+    records = [write_frame(output_path, frame) for frame in (1, 2)]
+    log = journal.Journal(output_path)
+    for record in records:
+        log.record("key", record)
+    # same size, other bytes
+    write_frame(output_path, 1, b"PIXELS")
+    os.remove(os.path.join(output_path, records[1]["path"]))
+    assert log.completed_frames("key", "walk", 0) == {}
+    log.close()
+
+def test_duplicates_are_completed_with_the_frame_they_repeat(tmp_path):
+    output_path = str(tmp_path)
+    log = journal.Journal(output_path)
+    original = write_frame(output_path, 1)
+    log.record("key", original)
+    log.record("key", dict(original, frame=2, duplicate_of=1))
+    log.record("key", {"action": "walk", "direction": 0, "frame": 4, "path": original["path"], "duplicate_of": 3})
+    assert sorted(log.completed_frames("key", "walk", 0)) == [1, 2]
+    log.close()
+
+def test_torn_last_line_is_skipped(tmp_path):
+    output_path = str(tmp_path)
+    log = journal.Journal(output_path)
+    log.record("key", write_frame(output_path, 1))
+    log.close()
+    with open(os.path.join(output_path, journal.JOURNAL_FILE), "a") as f:
+        f.write('{"key": "key", "action": "wa')
+    log = journal.Journal(output_path)
+    assert list(log.completed_frames("key", "walk", 0)) == [1]
+    log.close()
+
+def test_compact_keeps_the_latest_entry_of_every_frame(tmp_path):
+    output_path = str(tmp_path)
+    log = journal.Journal(output_path)
+    for data in (b"first", b"second"):
+        log.record("key", write_frame(output_path, 1, data))
+    log.close()
+    log = journal.Journal(output_path, compact=True)
+    with open(log.path) as f:
+        assert len(f.readlines()) == 1
+    assert list(log.completed_frames("key", "walk", 0)) == [1]
+    log.close()
@@ -0,0 +1,32 @@
+# (c) 2023 Pururum LLC
+# This code is licensed under MIT license (see LICENSE for details)
+
+import numpy
+
+import mirror
+
+def test_mirror_directions_pair_up():
+    directions = 8
+    for direction in range(directions):
+        assert mirror.mirror_direction(directions, mirror.mirror_direction(directions, direction)) == direction
+    # one of every pair is rendered, directions facing the camera axis are their own mirror
+    rendered = [direction for direction in range(directions) if not mirror.is_mirrored(directions, direction)]
+    assert rendered == [0, 1, 2, 3, 7]
+
+def test_flip_pixels_mirrors_normals():
+    pixels = numpy.zeros((1, 2, 4), dtype=numpy.float32)
+    pixels[0, 0] = [0.8, 0.5, 1.0, 1.0]
+    flipped = mirror.flip_pixels(pixels, normals=True)
+    numpy.testing.assert_allclose(flipped[0, 1], [0.2, 0.5, 1.0, 1.0])
+
+def test_mirrored_offset_and_canvas():
+    assert mirror.mirrored_offset([2, 3], 4, 10) == [4, 3]
+    canvas = mirror.place_on_canvas(numpy.ones((2, 4, 4), dtype=numpy.float32), [2, 3], [10, 6])
+    assert canvas.shape == (6, 10, 4)
+    assert canvas.sum() == 2 * 4 * 4
+    assert (canvas[3:5, 2:6] == 1.0).all()
+
+def test_frame_difference():
+    pixels = numpy.zeros((2, 2, 4), dtype=numpy.float32)
+    assert mirror.frame_difference(pixels, pixels) == 0.0
+    assert mirror.frame_difference(pixels, numpy.zeros((2, 3, 4))) == 1.0
@@ -0,0 +1,47 @@
+# (c) 2023 Pururum LLC
+# This code is licensed under MIT license (see LICENSE for details)
+
+import numpy
+
+import palette
+
+def test_sample_pixels_only_takes_opaque_colors():
+    pixels = numpy.array([[[10, 20, 30, 255], [40, 50, 60, 0], [70, 80, 90, 128]]], dtype=numpy.uint8)
+    colors = palette.sample_pixels(pixels, 10, numpy.random.default_rng(0))
+    assert sorted(map(tuple, colors.tolist())) == [(10, 20, 30), (70, 80, 90)]
+
+def test_sample_pixels_limits_the_count():
+    pixels = numpy.full((10, 10, 4), 255, dtype=numpy.uint8)
+    assert len(palette.sample_pixels(pixels, 7, numpy.random.default_rng(0))) == 7
+
+def test_median_cut_splits_clusters_apart():
+    colors = numpy.array([[0, 0, 0]] * 5 + [[250, 0, 0]] * 5)
+    boxes = palette.median_cut(colors, 2)
+    assert sorted(boxes[:, 0].tolist()) == [0.0, 250.0]
+
+def test_build_palette_has_a_transparent_first_color():
+    rng = numpy.random.default_rng(0)
+    colors = numpy.concatenate([rng.normal(center, 3.0, (50, 3)) for center in (30, 120, 220)])
+    result = palette.build_palette(numpy.clip(colors, 0, 255), 3)
+    assert result.dtype == numpy.uint8
+    assert result[0].tolist() == [0, 0, 0, 0]
+    assert len(result) == 4
+    assert (result[1:, 3] == 255).all()
+    numpy.testing.assert_allclose(sorted(result[1:, 0]), [30, 120, 220], atol=3)
+
+def test_build_palette_without_colors_is_only_transparent():
+    assert palette.build_palette(numpy.zeros((0, 3)), 8).tolist() == [[0, 0, 0, 0]]
+
+def test_quantize_maps_to_nearest_and_keeps_exact_colors():
+    colors = numpy.array([[0, 0, 0, 0], [0, 0, 0, 255], [255, 255, 255, 255], [2, 2, 2, 255]], dtype=numpy.uint8)
+    lut = palette.build_lut(colors)
+    pixels = numpy.array([[[250, 240, 245, 255], [0, 0, 0, 255], [2, 2, 2, 255], [255, 255, 255, 0]]], dtype=numpy.uint8)
+    # black and the dark grey share a lookup table cell, the exact colors still get their own index
+    assert palette.quantize(pixels, lut)[0, 1] == palette.quantize(pixels, lut)[0, 2]
+    assert palette.quantize(pixels, lut, colors).tolist() == [[2, 1, 3, 0]]
+
+def test_palette_round_trips_through_json(tmp_path):
+    colors = numpy.array([[0, 0, 0, 0], [1, 2, 3, 255]], dtype=numpy.uint8)
+    path = str(tmp_path / palette.PALETTE_FILE)
+    palette.write_palette(path, colors)
+    numpy.testing.assert_array_equal(palette.read_palette(path), colors)
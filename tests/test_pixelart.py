@@ -0,0 +1,54 @@
+# (c) 2023 Pururum LLC
+# This code is licensed under MIT license (see LICENSE for details)
+
+import numpy
+
+import pixelart
+
+def test_block_size_rounds_half_up():
+    assert pixelart.block_size(2.5) == 3
+    assert pixelart.block_size(0.2) == 1
+
+def test_downscale_weights_colors_by_alpha():
+    pixels = numpy.zeros((2, 2, 4), dtype=numpy.float32)
+    pixels[0, 0] = [1.0, 0.5, 0.0, 1.0]
+    result = pixelart.downscale(pixels, 2)
+    assert result.shape == (1, 1, 4)
+    # the transparent pixels do not darken the color, only lower the alpha
+    numpy.testing.assert_allclose(result[0, 0], [1.0, 0.5, 0.0, 0.25])
+
+def test_downscale_keeps_partial_edge_blocks():
+    assert pixelart.downscale(numpy.ones((5, 3, 4), dtype=numpy.float32), 2).shape == (3, 2, 4)
+
+def test_pixelate_keeps_size_in_blocks():
+    rng = numpy.random.default_rng(0)
+    pixels = rng.random((8, 8, 4), dtype=numpy.float32)
+    result = pixelart.pixelate(pixels, 4, 8, use_blur=False)
+    assert result.shape == (8, 8, 4)
+    assert (result[:4, :4] == result[0, 0]).all()
+    assert set(numpy.unique(result[..., 3])) <= {0.0, 1.0}
+
+def test_pixelate_without_keep_size_returns_one_pixel_per_block():
+    pixels = numpy.ones((6, 6, 4), dtype=numpy.float32)
+    assert pixelart.pixelate(pixels, 3, 8, keep_size=False).shape == (2, 2, 4)
+
+def test_pixelate_pass_samples_block_centers():
+    pixels = numpy.arange(16, dtype=numpy.float32).reshape(4, 4, 1).repeat(4, axis=2)
+    result = pixelart.pixelate_pass(pixels, 2)
+    assert (result[:2, :2] == pixels[1, 1]).all()
+    assert (result[2:, 2:] == pixels[3, 3]).all()
+
+def test_pixelate_native_scales_up():
+    pixels = numpy.ones((2, 3, 4), dtype=numpy.float32)
+    assert pixelart.pixelate_native(pixels, 8, scale=4).shape == (8, 12, 4)
+
+def test_srgb_conversion_round_trips():
+    values = numpy.linspace(0.0, 1.0, 11, dtype=numpy.float32)
+    numpy.testing.assert_allclose(pixelart.linear_to_srgb(pixelart.srgb_to_linear(values)), values, atol=1e-6)
+
+def test_colors_are_rounded_in_linear():
+    # sRGB 0.5 is about 0.21 in linear, below the middle of black and white
+    pixels = numpy.full((1, 1, 4), 0.5, dtype=numpy.float32)
+    pixels[..., 3] = 1.0
+    numpy.testing.assert_allclose(pixelart.pixelate_native(pixels, 1)[0, 0], [0.0, 0.0, 0.0, 1.0])
+    numpy.testing.assert_allclose(pixelart.pixelate_native(pixels, 1, linear=False)[0, 0], [1.0, 1.0, 1.0, 1.0])
@@ -0,0 +1,44 @@
+# (c) 2023 Pururum LLC
+# This code is licensed under MIT license (see LICENSE for details)
+
+import numpy
+
+import sampling
+
+def linear_poses(count):
+    """One point moving one unit along x every frame."""
+    poses = numpy.zeros((count, 1, 3))
+    poses[:, 0, 0] = numpy.arange(count)
+    return poses
+
+def test_budget_spreads_linear_motion_evenly():
+    assert sampling.sample_poses(linear_poses(30), budget=6) == [0, 5, 10, 15, 20, 25]
+
+def test_max_error_keeps_fewest_linear_frames():
+    assert sampling.sample_poses(linear_poses(30), max_error=3.0) == [0, 4, 8, 12, 16, 20, 24, 28]
+
+def test_still_poses_keep_first_frame():
+    assert sampling.sample_poses(numpy.zeros((10, 2, 3)), budget=4) == [0]
+
+def test_no_limit_keeps_every_changed_frame():
+    assert sampling.sample_poses(linear_poses(5)) == [0, 1, 2, 3, 4]
+
+def test_budget_keeps_key_pose_of_fast_motion():
+    poses = numpy.zeros((20, 1, 3))
+    poses[10:, 0, 0] = 5.0
+    assert sampling.sample_poses(poses, budget=2) == [0, 10]
+
+def test_hold_map_and_durations():
+    originals = sampling.hold_map([1, 2, 3, 4], [0, 2])
+    assert originals == {1: 1, 2: 1, 3: 3, 4: 3}
+    assert sampling.frame_durations(originals, 1, 10) == {1: 200, 3: 200}
+
+def test_hold_errors_are_bounded_to_the_longest_hold():
+    errors = sampling.hold_errors(linear_poses(10), max_hold=4)
+    assert errors.shape == (10, 4)
+    numpy.testing.assert_array_equal(errors[0], [0.0, 1.0, 2.0, 3.0])
+    numpy.testing.assert_array_equal(errors[8], [0.0, 1.0, numpy.inf, numpy.inf])
+
+def test_still_poses_are_rendered_again_after_the_longest_hold():
+    poses = numpy.zeros((2 * sampling.MAX_HOLD + 10, 2, 3))
+    assert sampling.sample_poses(poses, budget=4) == [0, sampling.MAX_HOLD, 2 * sampling.MAX_HOLD]
@@ -0,0 +1,59 @@
+# (c) 2023 Pururum LLC
+# This code is licensed under MIT license (see LICENSE for details)
+
+import importlib
+import sys
+import time
+
+workers = importlib.import_module("sprite_frame_generator_tests.workers")
+
+# A stand in for batch.py --serve that renders every unit as one frame.
+FAKE_WORKER = """
+import json, sys
+def send(data):
+    sys.stdout.write(%r + json.dumps(data) + "\\n")
+    sys.stdout.flush()
+send({"event": "ready"})
+for line in sys.stdin:
+    command = json.loads(line)
+    if command["command"] != "render":
+        break
+    send({"event": "frame", "frame": command["unit"]["frame_start"]})
+    send({"event": "done", "frames": [{"action": command["unit"]["action"]}], "seconds": 0.0})
+""" % workers.MESSAGE_PREFIX
+
+def units(count):
+    return [{"action": "Action%d" % i, "directions": [0], "frame_start": 1, "frame_end": 1} for i in range(count)]
+
+def run_pool(pool, timeout=30.0):
+    results = []
+    deadline = time.time() + timeout
+    try:
+        while not pool.is_finished():
+            assert time.time() < deadline, "the pool did not finish"
+            results.extend(pool.poll())
+            time.sleep(0.01)
+    finally:
+        pool.stop()
+    return results
+
+def test_messages_round_trip():
+    line = workers.encode_message({"event": "frame", "frame": 3})
+    assert workers.decode_message(line) == {"event": "frame", "frame": 3}
+    assert workers.decode_message("Blender 4.1 (hash abc)\n") is None
+    assert workers.decode_message(workers.MESSAGE_PREFIX + "{broken\n") is None
+
+def test_pool_renders_every_unit():
+    pool = workers.WorkerPool(units(5), lambda index: [sys.executable, "-c", FAKE_WORKER], [None, None])
+    results = run_pool(pool)
+    assert sorted(unit["action"] for unit, message in results if message["event"] == "done") == [
+        "Action0", "Action1", "Action2", "Action3", "Action4"]
+    assert pool.errors == []
+    assert pool.frames_done == 5
+
+def test_units_fail_when_workers_die_before_ready():
+    pool = workers.WorkerPool(units(3), lambda index: [sys.executable, "-c", "raise SystemExit(3)"], [None])
+    results = run_pool(pool)
+    assert len(results) == 3
+    assert all(message["event"] == "error" for _, message in results)
+    assert len(pool.errors) == 3 and pool.completed == []
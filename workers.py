@@ -0,0 +1,195 @@
+# (c) 2023 Pururum LLC
+# This code is licensed under MIT license (see LICENSE for details)
+
+# A pool of background Blender processes rendering work units.
+#
+# Every worker runs batch.py in serve mode. It reads one JSON command per line
+# on stdin and reports back with JSON messages on stdout, prefixed with
+# MESSAGE_PREFIX so they can be told apart from Blender's own output:
+#
+#   worker -> pool: {"event": "ready"}
+#                   {"event": "frame", "frame": 12}
+#                   {"event": "done", "frames": [...], "seconds": 3.2}
+#                   {"event": "error", "message": "..."}
+#   pool -> worker: {"command": "render", "unit": {...}}
+#                   {"command": "quit"}
+#
+# Output is read on helper threads that only move lines into a queue, so the
+# pool can be polled from a modal operator without blocking Blender.
+# Nothing in this module imports bpy.
+
+import collections
+import json
+import os
+import queue
+import subprocess
+import threading
+import time
+
+from . import jobs
+from . import profiling
+
+MESSAGE_PREFIX = "@sprite_frame_generator "
+
+def encode_message(data):
+    return MESSAGE_PREFIX + json.dumps(data) + "\n"
+
+def decode_message(line):
+    """Return the message in a line of worker output, or None for Blender's own output."""
+    if not line.startswith(MESSAGE_PREFIX):
+        return None
+    try:
+        return json.loads(line[len(MESSAGE_PREFIX):])
+    except ValueError:
+        return None
+
+class WorkerProcess:
+    """One background Blender process and the unit it is rendering."""
+
+    def __init__(self, index, args, cores=None):
+        self.index = index
+        self.unit = None
+        self.unit_start_time = None
+        self.frames_done = 0
+        self.ready = False
+
+        preexec_fn = None
+        if cores and hasattr(os, "sched_setaffinity"):
+            def preexec_fn():
+                os.sched_setaffinity(0, cores)
+        self.process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                        universal_newlines=True, bufsize=1, preexec_fn=preexec_fn)
+
+        self.lines = queue.Queue()
+        self.reader = threading.Thread(target=self._read_output, daemon=True)
+        self.reader.start()
+
+    def _read_output(self):
+        for line in self.process.stdout:
+            self.lines.put(line)
+        self.lines.put(None)
+
+    def messages(self):
+        """Return the messages received since the last call without blocking."""
+        messages = []
+        while True:
+            try:
+                line = self.lines.get_nowait()
+            except queue.Empty:
+                break
+            if line is None:
+                continue
+            message = decode_message(line)
+            if message is not None:
+                messages.append(message)
+        return messages
+
+    def send(self, data):
+        try:
+            self.process.stdin.write(json.dumps(data) + "\n")
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError):
+            pass
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def stop(self, timeout=5.0):
+        """Ask the worker to quit, and terminate it if it does not within timeout."""
+        if self.is_alive():
+            self.send({"command": "quit"})
+            self.process.terminate()
+            try:
+                self.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+class WorkerPool:
+    """Hands work units to idle workers and collects their results.
+
+    args_for_worker(index) returns the command line of a worker, core_slices
+    optionally pins every worker to its own cores. The time left is estimated
+    from the rate frames come in at over all workers.
+    """
+
+    def __init__(self, units, args_for_worker, core_slices, frame_step=1):
+        self.pending = collections.deque(units)
+        self.total_units = len(units)
+        self.frame_step = frame_step
+        self.completed = []
+        self.errors = []
+        self.frames_done = 0
+        self.progress = profiling.ProgressEstimate(sum(jobs.unit_frame_count(unit, frame_step) for unit in units))
+        self.workers = [WorkerProcess(i, args_for_worker(i), cores) for i, cores in enumerate(core_slices)]
+
+    def poll(self):
+        """Process worker messages and dispatch units.
+
+        Returns (unit, message) pairs for every finished or failed unit.
+        """
+        results = []
+        for worker in self.workers:
+            for message in worker.messages():
+                event = message.get("event")
+                if event == "ready":
+                    worker.ready = True
+                elif event == "frame":
+                    worker.frames_done += 1
+                    self.frames_done += 1
+                    self.progress.frame_done()
+                elif event in {"done", "error"}:
+                    # held frames are not rendered, and failed units will not render their remaining frames
+                    self.progress.skip(jobs.unit_frame_count(worker.unit, self.frame_step) - worker.frames_done)
+                    if event == "done":
+                        self.completed.append(worker.unit)
+                    else:
+                        self.errors.append((worker.unit, message.get("message", "")))
+                    results.append((worker.unit, message))
+                    worker.unit = None
+
+            if worker.unit is not None and not worker.is_alive():
+                # the process died without reporting, do not wait for it forever
+                message = {"event": "error", "message": "Worker %d exited with code %s." % (worker.index, worker.process.returncode)}
+                self.progress.skip(jobs.unit_frame_count(worker.unit, self.frame_step) - worker.frames_done)
+                self.errors.append((worker.unit, message["message"]))
+                results.append((worker.unit, message))
+                worker.unit = None
+
+            if worker.ready and worker.unit is None and worker.is_alive():
+                if self.pending:
+                    worker.unit = self.pending.popleft()
+                    worker.unit_start_time = time.time()
+                    worker.frames_done = 0
+                    worker.send({"command": "render", "unit": worker.unit})
+                else:
+                    worker.send({"command": "quit"})
+                    worker.ready = False
+
+        if self.pending and not any(worker.is_alive() for worker in self.workers):
+            # every worker died, some before they were even ready, nothing is left to render the units
+            while self.pending:
+                unit = self.pending.popleft()
+                message = {"event": "error", "message": "No worker was left to render it."}
+                self.progress.skip(jobs.unit_frame_count(unit, self.frame_step))
+                self.errors.append((unit, message["message"]))
+                results.append((unit, message))
+        return results
+
+    def is_finished(self):
+        return not self.pending and all(worker.unit is None for worker in self.workers)
+
+    def stop(self):
+        for worker in self.workers:
+            worker.stop()
+
+    def status_lines(self):
+        lines = ["Units %d/%d" % (len(self.completed) + len(self.errors), self.total_units), self.progress.status_line()]
+        now = time.time()
+        for worker in self.workers:
+            if worker.unit is not None:
+                lines.append("Worker %d: %s %s, %d frames, %.0fs" % (
+                    worker.index, worker.unit["action"], worker.unit["directions"], worker.frames_done, now - worker.unit_start_time))
+        for unit, message in self.errors:
+            lines.append("Failed %s %s: %s" % (unit["action"], unit["directions"], message))
+        return lines